@@ -0,0 +1,248 @@
+"""
+assistant_runs.py
+
+Ожидание завершения run'ов OpenAI Assistants.
+
+Два режима:
+  • stream — run создаётся с stream=True, и мы просто читаем события до финального;
+  • poll   — run опрашивается с экспоненциальной задержкой и джиттером.
+
+У каждого ожидания есть общий дедлайн, а у каждого статуса — понятный исход.
+Для каждого ответа считаем число опросов и затраченное время.
+"""
+
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+
+RUN_DEADLINE_SECONDS = float(os.environ.get("RUN_DEADLINE_SECONDS", 90))
+RUN_POLL_INITIAL = float(os.environ.get("RUN_POLL_INITIAL", 0.3))
+RUN_POLL_MAX = float(os.environ.get("RUN_POLL_MAX", 2.0))
+RUN_POLL_FACTOR = 1.6
+RUN_STREAMING = os.environ.get("RUN_STREAMING", "1") == "1"
+
+# Статусы run'а, после которых ждать больше нечего
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+# Статусы, в которых run ещё идёт
+PENDING_STATUSES = {"queued", "in_progress", "cancelling"}
+
+# Финальные события стрима → статус run'а
+STREAM_TERMINAL_EVENTS = {
+    "thread.run.completed": "completed",
+    "thread.run.failed": "failed",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.expired": "expired",
+    "thread.run.incomplete": "incomplete",
+    "thread.run.requires_action": "requires_action",
+}
+
+
+@dataclass
+class RunOutcome:
+    """
+    Результат ожидания run'а.
+
+    status — статус OpenAI либо "timeout", если истёк дедлайн, или "error",
+    если стрим оборвался без финального события.
+    text — ответ ассистента, если он пришёл в стриме.
+    """
+    status: str
+    run_id: str | None = None
+    thread_id: str | None = None
+    polls: int = 0
+    elapsed: float = 0.0
+    error: str | None = None
+    text: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "completed"
+
+
+# ---------- Метрики ----------
+RUN_STATS = {
+    "runs": 0,
+    "polls": 0,
+    "seconds": 0.0,
+    "outcomes": {},
+}
+
+
+def _record(outcome: RunOutcome) -> RunOutcome:
+    RUN_STATS["runs"] += 1
+    RUN_STATS["polls"] += outcome.polls
+    RUN_STATS["seconds"] += outcome.elapsed
+    RUN_STATS["outcomes"][outcome.status] = RUN_STATS["outcomes"].get(outcome.status, 0) + 1
+    if not outcome.ok:
+        print(f"⚠️ Run {outcome.run_id} завершился со статусом {outcome.status}: {outcome.error or ''}")
+    return outcome
+
+
+def run_stats() -> dict:
+    runs = RUN_STATS["runs"] or 1
+    return {
+        **RUN_STATS,
+        "outcomes": dict(RUN_STATS["outcomes"]),
+        "avg_polls": round(RUN_STATS["polls"] / runs, 2),
+        "avg_seconds": round(RUN_STATS["seconds"] / runs, 2),
+    }
+
+
+def _poll_delays():
+    """Экспоненциальная задержка с джиттером: 0.3с, ~0.5с, ~0.8с … до RUN_POLL_MAX."""
+    delay = RUN_POLL_INITIAL
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * RUN_POLL_FACTOR, RUN_POLL_MAX)
+
+
+def _run_error(run) -> str | None:
+    last_error = getattr(run, "last_error", None)
+    if last_error:
+        return f"{last_error.code}: {last_error.message}"
+    details = getattr(run, "incomplete_details", None)
+    if details:
+        return str(details.reason)
+    return None
+
+
+async def _cancel_quietly(client, thread_id: str, run_id: str | None):
+    if not run_id:
+        return
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"⚠️ Не удалось отменить run {run_id}: {e}")
+
+
+# ---------- Polling ----------
+async def wait_for_run(client, thread_id: str, run, deadline: float | None = None) -> RunOutcome:
+    """Опрашивает уже созданный run до финального статуса или дедлайна."""
+    started = time.monotonic()
+    deadline = deadline or started + RUN_DEADLINE_SECONDS
+    outcome = RunOutcome(status=run.status, run_id=run.id, thread_id=thread_id)
+
+    for delay in _poll_delays():
+        if run.status in TERMINAL_STATUSES:
+            outcome.status = run.status
+            outcome.error = _run_error(run)
+            break
+
+        if run.status == "requires_action":
+            # Инструменты ассистенту не подключены — такой run не завершится сам
+            await _cancel_quietly(client, thread_id, run.id)
+            outcome.status = "requires_action"
+            break
+
+        if time.monotonic() + delay > deadline:
+            await _cancel_quietly(client, thread_id, run.id)
+            outcome.status = "timeout"
+            outcome.error = f"run в статусе {run.status} дольше {RUN_DEADLINE_SECONDS:.0f}с"
+            break
+
+        await asyncio.sleep(delay)
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        outcome.polls += 1
+
+    outcome.elapsed = time.monotonic() - started
+    return _record(outcome)
+
+
+# ---------- Запуск ----------
+async def start_run(client, thread_id: str | None, assistant_id: str, messages: list[dict], stream: bool = False, **run_params):
+    """
+    Запускает run одним запросом.
+    Есть тред — сообщения пользователя уходят как additional_messages,
+    нет треда — тред и run создаются вместе через create_and_run.
+    """
+    if thread_id:
+        return await client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            additional_messages=messages,
+            stream=stream,
+            **run_params
+        )
+    return await client.beta.threads.create_and_run(
+        assistant_id=assistant_id,
+        thread={"messages": messages},
+        stream=stream,
+        **run_params
+    )
+
+
+# ---------- Streaming ----------
+async def stream_run(client, thread_id: str | None, assistant_id: str, messages: list[dict], on_text=None, **run_params) -> RunOutcome:
+    """
+    Запускает run с stream=True и читает события до финального.
+    Текст ответа собирается из дельт в outcome.text; on_text(delta) — необязательный
+    async-колбэк, получающий каждую новую порцию текста.
+    """
+    started = time.monotonic()
+    outcome = RunOutcome(status="error", thread_id=thread_id)
+    parts = []
+
+    try:
+        async with asyncio.timeout(RUN_DEADLINE_SECONDS):
+            stream = await start_run(client, thread_id, assistant_id, messages, stream=True, **run_params)
+            # async with — ответ HTTP закрывается и соединение возвращается в пул
+            # и при выходе по финальному событию, и при таймауте или отмене
+            async with stream:
+                async for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                        outcome.run_id = event.data.id
+                        outcome.thread_id = event.data.thread_id
+
+                    if event.event == "thread.message.delta":
+                        for c in event.data.delta.content or []:
+                            if c.type == "text" and c.text and c.text.value:
+                                parts.append(c.text.value)
+                                if on_text is not None:
+                                    await on_text(c.text.value)
+
+                    status = STREAM_TERMINAL_EVENTS.get(event.event)
+                    if status:
+                        outcome.status = status
+                        outcome.error = _run_error(event.data)
+                        if status == "requires_action":
+                            await _cancel_quietly(client, outcome.thread_id, outcome.run_id)
+                        break
+                    if event.event == "error":
+                        outcome.error = str(event.data)
+                        break
+    except TimeoutError:
+        await _cancel_quietly(client, outcome.thread_id, outcome.run_id)
+        outcome.status = "timeout"
+        outcome.error = f"стрим дольше {RUN_DEADLINE_SECONDS:.0f}с"
+
+    outcome.text = "".join(parts).strip()
+    outcome.elapsed = time.monotonic() - started
+    return _record(outcome)
+
+
+async def create_and_wait_run(client, thread_id: str | None, assistant_id: str, messages: list[dict], on_text=None, **run_params) -> RunOutcome:
+    """
+    Запускает ассистента и ждёт результата: стримом или опросом.
+    При опросе outcome.text остаётся None — ответ нужно забрать отдельно (fetch_run_reply).
+    """
+    if RUN_STREAMING or on_text is not None:
+        return await stream_run(client, thread_id, assistant_id, messages, on_text=on_text, **run_params)
+
+    run = await start_run(client, thread_id, assistant_id, messages, **run_params)
+    return await wait_for_run(client, run.thread_id, run)
+
+
+async def fetch_run_reply(client, thread_id: str, run_id: str) -> str:
+    """Забирает только самое свежее сообщение ассистента, созданное этим run'ом."""
+    page = await client.beta.threads.messages.list(
+        thread_id=thread_id,
+        run_id=run_id,
+        order="desc",
+        limit=1
+    )
+    for m in page.data:
+        if m.role == "assistant":
+            return "".join(c.text.value for c in m.content if c.type == "text").strip()
+    return ""
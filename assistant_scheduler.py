@@ -0,0 +1,147 @@
+"""
+assistant_scheduler.py
+
+Ограничитель одновременных запросов к ассистенту с классами приоритета.
+
+Свободный слот всегда получает самый приоритетный из ожидающих:
+сначала кризисные сообщения, затем платные/безлимитные пользователи,
+затем бесплатные. Если очередь класса переполнена, запрос сразу
+отклоняется (AssistantOverloaded) — пользователю отвечаем «я немного
+перегружена», а не держим его до таймаута.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
+ASSISTANT_CONCURRENCY = int(os.environ.get("ASSISTANT_CONCURRENCY", 20))
+ASSISTANT_QUEUE_LIMIT = int(os.environ.get("ASSISTANT_QUEUE_LIMIT", 50))
+
+PRIORITY_CRISIS = 0
+PRIORITY_PAID = 1
+PRIORITY_FREE = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CRISIS: "crisis",
+    PRIORITY_PAID: "paid",
+    PRIORITY_FREE: "free",
+}
+
+# Сколько запросов может ждать в очереди, прежде чем класс начнёт получать отказ.
+# Кризисные не отклоняются никогда.
+QUEUE_LIMITS = {
+    PRIORITY_CRISIS: None,
+    PRIORITY_PAID: ASSISTANT_QUEUE_LIMIT * 2,
+    PRIORITY_FREE: ASSISTANT_QUEUE_LIMIT,
+}
+
+WAIT_SAMPLES = 200
+
+
+class AssistantOverloaded(Exception):
+    """Очередь к ассистенту переполнена — запрос не принят."""
+
+
+def priority_for(crisis_level: str, has_paid: bool, is_unlimited: bool) -> int:
+    if crisis_level in ("high", "medium", "low"):
+        return PRIORITY_CRISIS
+    if has_paid or is_unlimited:
+        return PRIORITY_PAID
+    return PRIORITY_FREE
+
+
+class _ClassStats:
+    def __init__(self):
+        self.admitted = 0
+        self.shed = 0
+        self.max_waiting = 0
+        self.waits: deque = deque(maxlen=WAIT_SAMPLES)
+
+    def as_dict(self, waiting: int) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "waiting": waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+class AssistantScheduler:
+    """Семафор с приоритетной очередью ожидающих."""
+
+    def __init__(self, concurrency: int = ASSISTANT_CONCURRENCY, queue_limits: dict = QUEUE_LIMITS):
+        self.concurrency = concurrency
+        self.queue_limits = queue_limits
+        self.active = 0
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._waiting = {p: 0 for p in PRIORITY_NAMES}
+        self._stats = {p: _ClassStats() for p in PRIORITY_NAMES}
+
+    async def run(self, priority: int, call):
+        """
+        Выполняет call() (фабрику корутины), когда освободится слот.
+        Бросает AssistantOverloaded, если очередь класса уже переполнена.
+        """
+        await self._acquire(priority)
+        try:
+            return await call()
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int):
+        stats = self._stats[priority]
+        started = time.monotonic()
+
+        if self.active < self.concurrency and not self._heap:
+            self.active += 1
+        else:
+            limit = self.queue_limits.get(priority)
+            if limit is not None and self._waiting[priority] >= limit:
+                stats.shed += 1
+                raise AssistantOverloaded(PRIORITY_NAMES[priority])
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._seq), future))
+            self._waiting[priority] += 1
+            stats.max_waiting = max(stats.max_waiting, self._waiting[priority])
+            try:
+                # Слот передаёт нам _release: active при этом не меняется
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()
+                raise
+            finally:
+                self._waiting[priority] -= 1
+
+        stats.admitted += 1
+        stats.waits.append(time.monotonic() - started)
+
+    def _release(self):
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": sum(self._waiting.values()),
+            "classes": {
+                name: self._stats[p].as_dict(self._waiting[p])
+                for p, name in PRIORITY_NAMES.items()
+            },
+        }
+
+
+assistant_scheduler = AssistantScheduler()
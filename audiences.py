@@ -0,0 +1,103 @@
+"""
+audiences.py
+
+Аудитории рассылок, объявленные как SQL-условия.
+
+Каждая рассылка описывает свой сегмент (все пользователи, давно не писавшие,
+активные за N дней), а отбор делает БД. Получатели читаются страницами
+по AUDIENCE_PAGE_SIZE id с keyset-пагинацией по users.telegram_id
+(WHERE telegram_id > последний id ORDER BY telegram_id LIMIT n — без OFFSET),
+каждая страница — в своей короткой сессии. В памяти держится одна страница
+обычных int, сколько бы ни было пользователей.
+
+Недоступные пользователи (users.unreachable_since, см. reachability.py)
+исключаются из любого сегмента; count_skipped() говорит, сколько их было.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+
+from sqlalchemy import func, or_, select
+
+from database import AsyncSessionLocal
+from models import User, UserActivity
+
+AUDIENCE_PAGE_SIZE = int(os.environ.get("AUDIENCE_PAGE_SIZE", 1000))
+
+
+@dataclass(frozen=True)
+class Audience:
+    """Сегмент: имя для логов и условия на users / user_activity."""
+    name: str
+    conditions: tuple = ()
+
+    def select_ids(self, unreachable: bool = False):
+        """id сегмента; unreachable=True — наоборот, только недоступные из него."""
+        reachability = User.unreachable_since.isnot(None) if unreachable else User.unreachable_since.is_(None)
+        return (
+            select(User.telegram_id)
+            .outerjoin(UserActivity, UserActivity.telegram_id == User.telegram_id)
+            .where(User.telegram_id.isnot(None), reachability, *self.conditions)
+        )
+
+
+# ---------- Сегменты ----------
+def all_users() -> Audience:
+    return Audience("all")
+
+
+def inactive(days: int, not_contacted_days: int | None = None) -> Audience:
+    """
+    Не писали days дней и больше (или не писали никогда); с not_contacted_days —
+    ещё и не получали реактивацию за последние not_contacted_days дней.
+    """
+    cutoff = datetime.utcnow().date() - timedelta(days=days)
+    conditions = [or_(UserActivity.last_message_date.is_(None), UserActivity.last_message_date <= cutoff)]
+    if not_contacted_days is not None:
+        contacted_after = datetime.utcnow() - timedelta(days=not_contacted_days)
+        conditions.append(or_(
+            UserActivity.last_reactivation_sent.is_(None),
+            UserActivity.last_reactivation_sent < contacted_after,
+        ))
+    return Audience(f"inactive_{days}d", tuple(conditions))
+
+
+def active_within(days: int) -> Audience:
+    cutoff = datetime.utcnow().date() - timedelta(days=days)
+    return Audience(f"active_{days}d", (UserActivity.last_message_date >= cutoff,))
+
+
+# ---------- Чтение ----------
+async def count(audience: Audience) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(audience.select_ids().subquery()))
+
+
+async def count_skipped(audience: Audience) -> int:
+    """Сколько пользователей сегмента пропущено как недоступные."""
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(audience.select_ids(unreachable=True).subquery()))
+
+
+async def pages(audience: Audience, page_size: int = AUDIENCE_PAGE_SIZE, after: int | None = None) -> AsyncIterator[list[int]]:
+    """Страницы telegram_id по возрастанию; after — продолжить после этого id."""
+    while True:
+        stmt = audience.select_ids().order_by(User.telegram_id).limit(page_size)
+        if after is not None:
+            stmt = stmt.where(User.telegram_id > after)
+        async with AsyncSessionLocal() as db:
+            page = [int(tg) for tg in await db.scalars(stmt)]
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+
+async def stream(audience: Audience, page_size: int = AUDIENCE_PAGE_SIZE) -> AsyncIterator[int]:
+    async for page in pages(audience, page_size):
+        for telegram_id in page:
+            yield telegram_id
@@ -0,0 +1,182 @@
+"""
+benchmarks/activity_split.py
+
+Бенчмарк записи счётчиков активности: широкая строка users (как до
+user_activity) против узкой таблицы user_activity.
+
+Обе схемы заполняются одинаковыми пользователями (BENCH_USERS, по умолчанию
+50 000; см. fixtures.py — у части длинное резюме треда), затем прогоняется
+одинаковая нагрузка «сообщений» (BENCH_UPDATES, по умолчанию 100 000;
+активна небольшая доля пользователей): бюджет треда после каждого ответа
+и резерв бесплатного сообщения, как в quota.py и context_budget.py.
+
+Считаются пропускная способность (UPDATE/с), прирост размера таблицы
+с индексами и доля HOT-обновлений (без записи в индексы). На Postgres
+таблицы создаются в отдельной схеме activity_bench и удаляются в конце;
+на SQLite (по умолчанию, временный файл) — только пропускная способность.
+
+Запуск:  BENCH_DATABASE_URL=postgresql://localhost/empathai python -m benchmarks.activity_split
+"""
+
+import os
+import random
+import time
+from datetime import date
+
+from sqlalchemy import text
+
+from benchmarks.fixtures import bench_database, describe, synthetic_users, vacuum_analyze
+
+USERS = int(os.environ.get("BENCH_USERS", 50_000))
+UPDATES = int(os.environ.get("BENCH_UPDATES", 100_000))
+BATCH = 100
+SCHEMA = "activity_bench"
+SEED = 19
+
+# Раскладка users до переноса счётчиков (индексы — как после миграции 0003)
+WIDE_DDL = [
+    """CREATE TABLE wide_users (
+        id INTEGER PRIMARY KEY,
+        telegram_id BIGINT UNIQUE,
+        thread_id VARCHAR,
+        free_messages_used INTEGER DEFAULT 0,
+        last_message_date DATE,
+        thread_message_count INTEGER DEFAULT 0,
+        thread_token_estimate INTEGER DEFAULT 0,
+        thread_summary TEXT,
+        has_paid BOOLEAN DEFAULT FALSE,
+        is_unlimited BOOLEAN DEFAULT FALSE,
+        subscription_expires_at TIMESTAMP,
+        referral_earned FLOAT DEFAULT 0,
+        referral_paid FLOAT DEFAULT 0,
+        referrer_code VARCHAR,
+        referral_code VARCHAR,
+        first_seen_at TIMESTAMP,
+        total_messages INTEGER DEFAULT 0
+    )""",
+    "CREATE INDEX ix_wide_referrer_code ON wide_users (referrer_code)",
+    "CREATE INDEX ix_wide_last_message_date ON wide_users (last_message_date)",
+    "CREATE INDEX ix_wide_first_seen_at ON wide_users (first_seen_at)",
+    "CREATE INDEX ix_wide_paid_first_seen ON wide_users (has_paid, first_seen_at)",
+    "CREATE INDEX ix_wide_free_messages_used ON wide_users (free_messages_used)",
+]
+
+NARROW_DDL = [
+    """CREATE TABLE narrow_activity (
+        telegram_id BIGINT PRIMARY KEY,
+        free_messages_used INTEGER NOT NULL DEFAULT 0,
+        last_message_date DATE,
+        total_messages INTEGER NOT NULL DEFAULT 0,
+        thread_message_count INTEGER NOT NULL DEFAULT 0,
+        thread_token_estimate INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX ix_narrow_last_message_date ON narrow_activity (last_message_date)",
+    "CREATE INDEX ix_narrow_free_messages_used ON narrow_activity (free_messages_used)",
+]
+
+
+def workload(users: int, updates: int) -> list[tuple[str, int, int]]:
+    """(вид, telegram_id, токены): активна примерно десятая часть пользователей."""
+    rnd = random.Random(SEED)
+    active = [1_000_000 + i for i in rnd.sample(range(users), max(users // 10, 1))]
+    events = []
+    for _ in range(updates):
+        telegram_id = rnd.choice(active)
+        events.append(("turn" if rnd.random() < 0.7 else "reserve", telegram_id, rnd.randint(50, 400)))
+    return events
+
+
+STATEMENTS = {
+    "wide_users": {
+        "turn": "UPDATE wide_users SET thread_message_count = thread_message_count + 2, "
+                "thread_token_estimate = thread_token_estimate + :tokens WHERE telegram_id = :tid",
+        "reserve": "UPDATE wide_users SET free_messages_used = free_messages_used + 1, last_message_date = :today "
+                   "WHERE telegram_id = :tid",
+    },
+    "narrow_activity": {
+        "turn": "UPDATE narrow_activity SET thread_message_count = thread_message_count + 2, "
+                "thread_token_estimate = thread_token_estimate + :tokens WHERE telegram_id = :tid",
+        "reserve": "UPDATE narrow_activity SET free_messages_used = free_messages_used + 1, last_message_date = :today "
+                   "WHERE telegram_id = :tid",
+    },
+}
+
+
+def total_size(conn, table: str, postgres: bool) -> int | None:
+    if not postgres:
+        return None
+    return conn.execute(text("SELECT pg_total_relation_size(:t)"), {"t": f"{SCHEMA}.{table}"}).scalar()
+
+
+def hot_share(conn, table: str, postgres: bool) -> float | None:
+    if not postgres:
+        return None
+    try:
+        conn.execute(text("SELECT pg_stat_force_next_flush()"))   # Postgres 15+
+    except Exception:
+        conn.rollback()
+        time.sleep(1.1)
+    row = conn.execute(text(
+        "SELECT n_tup_upd, n_tup_hot_upd FROM pg_stat_user_tables WHERE schemaname = :s AND relname = :t"
+    ), {"s": SCHEMA, "t": table}).first()
+    return row.n_tup_hot_upd / row.n_tup_upd if row and row.n_tup_upd else None
+
+
+def run(engine, table: str, events, postgres: bool) -> dict:
+    today = date.today()
+    with engine.connect() as conn:
+        size_before = total_size(conn, table, postgres)
+        conn.commit()
+
+        started = time.perf_counter()
+        for chunk in range(0, len(events), BATCH):
+            with conn.begin():
+                for kind, telegram_id, tokens in events[chunk:chunk + BATCH]:
+                    conn.execute(text(STATEMENTS[table][kind]), {"tid": telegram_id, "tokens": tokens, "today": today})
+        elapsed = time.perf_counter() - started
+
+        size_after = total_size(conn, table, postgres)
+        hot = hot_share(conn, table, postgres)
+        conn.commit()
+    return {
+        "rate": len(events) / elapsed,
+        "growth": None if size_before is None else (size_after - size_before) / 1024 / 1024,
+        "hot": hot,
+    }
+
+
+def main():
+    with bench_database(SCHEMA) as engine:
+        postgres = engine.dialect.name == "postgresql"
+        rows = [{**row, "id": i + 1} for i, row in enumerate(synthetic_users(USERS))]
+        with engine.begin() as conn:
+            for ddl in WIDE_DDL + NARROW_DDL:
+                conn.execute(text(ddl))
+            conn.execute(text(
+                "INSERT INTO wide_users (id, telegram_id, thread_id, free_messages_used, last_message_date, "
+                "thread_summary, has_paid, referrer_code, referral_code, first_seen_at, total_messages) "
+                "VALUES (:id, :telegram_id, :thread_id, :free_messages_used, :last_message_date, :thread_summary, "
+                ":has_paid, :referrer_code, :referral_code, :first_seen_at, :total_messages)"
+            ), rows)
+            conn.execute(text(
+                "INSERT INTO narrow_activity (telegram_id, free_messages_used, last_message_date, total_messages) "
+                "VALUES (:telegram_id, :free_messages_used, :last_message_date, :total_messages)"
+            ), rows)
+        vacuum_analyze(engine)
+
+        events = workload(USERS, UPDATES)
+        results = {
+            "users (широкая)": run(engine, "wide_users", events, postgres),
+            "user_activity": run(engine, "narrow_activity", events, postgres),
+        }
+
+    print(f"База: {describe(engine)}, пользователей: {USERS}, обновлений: {UPDATES}")
+    print(f"{'таблица':<18}{'UPDATE/с':>10}{'прирост, МБ':>14}{'HOT':>8}")
+    for name, r in results.items():
+        growth = "—" if r["growth"] is None else f"{r['growth']:.1f}"
+        hot = "—" if r["hot"] is None else f"{r['hot']:.0%}"
+        print(f"{name:<18}{r['rate']:>10.0f}{growth:>14}{hot:>8}")
+
+
+if __name__ == "__main__":
+    main()
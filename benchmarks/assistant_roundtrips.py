@@ -0,0 +1,174 @@
+"""
+benchmarks/assistant_roundtrips.py
+
+Микро-бенчмарк: сколько HTTP-запросов к OpenAI стоит один ответ ассистента.
+
+OpenAI API подменяется MockTransport, который считает запросы. Транспорт и ответы
+берутся из того httpx, на котором построен клиент SDK (новые openai — httpx2).
+Сравниваются старый путь (retrieve/create треда → messages.create → runs.create →
+опрос → полный messages.list) и новый (один run вместе с сообщением, опрос
+или стрим, чтение только последнего сообщения run'а).
+
+Запуск:  python -m benchmarks.assistant_roundtrips
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+import warnings
+from collections import Counter
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import assistant_runs  # noqa: E402
+
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+
+def _sdk_httpx():
+    """Модуль httpx, чей AsyncClient ожидает SDK: MockTransport другого модуля SDK не примет."""
+    client_cls = next(c for c in openai.DefaultAsyncHttpxClient.__mro__ if c.__name__ == "AsyncClient")
+    return importlib.import_module(client_cls.__module__.split(".")[0])
+
+
+httpx = _sdk_httpx()
+
+POLLS_UNTIL_DONE = 3   # сколько раз run отвечает "in_progress", прежде чем завершиться
+REPLY = "Я рядом. Расскажи, что случилось?"
+
+
+class FakeAssistantsAPI:
+    """Минимальная имитация Assistants API, достаточная для SDK."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.polls_left = {}
+        self.next_id = 0
+
+    def _id(self, prefix):
+        self.next_id += 1
+        return f"{prefix}_{self.next_id}"
+
+    def _run(self, thread_id, run_id, status):
+        return {"id": run_id, "object": "thread.run", "thread_id": thread_id, "status": status,
+                "assistant_id": "asst", "created_at": 0, "instructions": "", "model": "m", "tools": []}
+
+    def _message(self, thread_id, run_id):
+        return {"id": self._id("msg"), "object": "thread.message", "thread_id": thread_id, "run_id": run_id,
+                "role": "assistant", "created_at": 0, "status": "completed", "attachments": [], "metadata": {},
+                "content": [{"type": "text", "text": {"value": REPLY, "annotations": []}}]}
+
+    def _sse(self, thread_id, run_id):
+        events = [("thread.run.created", self._run(thread_id, run_id, "queued"))]
+        for word in REPLY.split(" "):
+            events.append(("thread.message.delta", {
+                "id": "msg", "object": "thread.message.delta",
+                "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word + " "}}]},
+            }))
+        events.append(("thread.run.completed", self._run(thread_id, run_id, "completed")))
+        body = "".join(f"event: {e}\ndata: {json.dumps(d)}\n\n" for e, d in events) + "event: done\ndata: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/v1")
+        body = json.loads(request.content) if request.content else {}
+        parts = path.strip("/").split("/")
+        method = request.method
+
+        if path == "/threads" and method == "POST":
+            self.calls["threads.create"] += 1
+            return httpx.Response(200, json={"id": self._id("thread"), "object": "thread", "created_at": 0})
+
+        if path == "/threads/runs" and method == "POST":
+            self.calls["threads.create_and_run"] += 1
+            thread_id, run_id = self._id("thread"), self._id("run")
+            return self._start(thread_id, run_id, body)
+
+        if len(parts) == 2 and method == "GET":
+            self.calls["threads.retrieve"] += 1
+            return httpx.Response(200, json={"id": parts[1], "object": "thread", "created_at": 0})
+
+        thread_id = parts[1]
+        if parts[2] == "messages" and method == "POST":
+            self.calls["messages.create"] += 1
+            return httpx.Response(200, json=self._message(thread_id, None))
+
+        if parts[2] == "messages" and method == "GET":
+            self.calls["messages.list"] += 1
+            limit = int(request.url.params.get("limit", 20))
+            data = [self._message(thread_id, request.url.params.get("run_id")) for _ in range(limit)]
+            return httpx.Response(200, json={"object": "list", "data": data, "has_more": False})
+
+        if parts[2] == "runs" and len(parts) == 3:
+            self.calls["runs.create"] += 1
+            return self._start(thread_id, self._id("run"), body)
+
+        if parts[2] == "runs" and method == "GET":
+            self.calls["runs.retrieve"] += 1
+            run_id = parts[3]
+            self.polls_left[run_id] -= 1
+            status = "completed" if self.polls_left[run_id] <= 0 else "in_progress"
+            return httpx.Response(200, json=self._run(thread_id, run_id, status))
+
+        return httpx.Response(404, json={"error": {"message": f"unexpected {method} {path}"}})
+
+    def _start(self, thread_id, run_id, body):
+        if body.get("stream"):
+            return self._sse(thread_id, run_id)
+        self.polls_left[run_id] = POLLS_UNTIL_DONE
+        return httpx.Response(200, json=self._run(thread_id, run_id, "queued"))
+
+
+async def legacy_reply(client, thread_id):
+    """Старый путь send_message_to_assistant (без busy-wait, чтобы не завышать счёт)."""
+    if thread_id:
+        thread = await client.beta.threads.retrieve(thread_id)
+    else:
+        thread = await client.beta.threads.create()
+    await client.beta.threads.messages.create(thread_id=thread.id, role="user", content="привет")
+    run = await client.beta.threads.runs.create(thread_id=thread.id, assistant_id="asst")
+    while run.status != "completed":
+        run = await client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+    await client.beta.threads.messages.list(thread_id=thread.id)
+    return thread.id
+
+
+async def lean_reply(client, thread_id):
+    messages = [{"role": "user", "content": "привет"}]
+    outcome = await assistant_runs.create_and_wait_run(client, thread_id, "asst", messages)
+    if outcome.text is None:
+        await assistant_runs.fetch_run_reply(client, outcome.thread_id, outcome.run_id)
+    return outcome.thread_id
+
+
+async def measure(name, reply_fn, streaming=False):
+    api = FakeAssistantsAPI()
+    client = openai.AsyncOpenAI(
+        api_key="test",
+        http_client=openai.DefaultAsyncHttpxClient(transport=httpx.MockTransport(api.handle)),
+    )
+    assistant_runs.RUN_STREAMING = streaming
+
+    thread_id = await reply_fn(client, None)      # первое сообщение нового пользователя
+    first = sum(api.calls.values())
+    api.calls.clear()
+    await reply_fn(client, thread_id)             # следующее сообщение в том же треде
+    following = sum(api.calls.values())
+    print(f"{name:<28} новый пользователь: {first:>2} запросов, дальше: {following:>2}  {dict(api.calls)}")
+    await client.close()
+
+
+async def main():
+    assistant_runs.RUN_POLL_INITIAL = assistant_runs.RUN_POLL_MAX = 0.001
+    print(f"Run завершается после {POLLS_UNTIL_DONE} опросов\n")
+    await measure("legacy", legacy_reply)
+    await measure("lean (polling)", lean_reply)
+    await measure("lean (streaming)", lean_reply, streaming=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,190 @@
+"""
+benchmarks/broadcast_throughput.py
+
+Бенчмарк рассылки против поддельного Bot API (aiohttp на 127.0.0.1).
+
+Сервер ведёт себя как Telegram с точки зрения лимитов:
+  • не больше FAKE_GLOBAL_LIMIT сообщений за скользящую секунду на бота,
+    иначе 429 с retry_after = FAKE_RETRY_AFTER;
+  • не больше одного сообщения в секунду в один чат, иначе тоже 429;
+  • каждый BLOCKED_EVERY-й чат «заблокировал бота» — 403;
+  • задержка ответа BENCH_LATENCY секунд.
+
+Сравниваются:
+  • старая схема — последовательная отправка со sleep(1.5) после каждого
+    сообщения, как было в scheduler_affirmations.py; прогоняется
+    на BENCH_OLD_SAMPLE сообщениях и пересчитывается на всю аудиторию;
+  • BroadcastEngine (broadcast.py) на BENCH_RECIPIENTS получателях,
+    а параллельно — «ответы в чатах» с частотой BENCH_INTERACTIVE_RATE/с
+    через ту же сессию бота с TelegramRateMeter: для них считаются
+    задержка и число 429.
+
+Запуск:  python -m benchmarks.broadcast_throughput
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+from aiohttp import web
+
+from benchmarks import fixtures  # noqa: F401  (sys.path для импорта модулей бота)
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from broadcast import BroadcastEngine, TelegramRateMeter, TokenBucket, TELEGRAM_GLOBAL_RATE
+
+RECIPIENTS = int(os.environ.get("BENCH_RECIPIENTS", 1500))
+OLD_SAMPLE = int(os.environ.get("BENCH_OLD_SAMPLE", 10))
+OLD_SLEEP_SECONDS = 1.5
+LATENCY = float(os.environ.get("BENCH_LATENCY", 0.05))
+INTERACTIVE_RATE = float(os.environ.get("BENCH_INTERACTIVE_RATE", 3))
+
+FAKE_GLOBAL_LIMIT = 30
+FAKE_RETRY_AFTER = 3
+BLOCKED_EVERY = 25
+TOKEN = "123456:BENCHMARK"
+FIRST_CHAT = 1_000_000
+INTERACTIVE_CHAT = 9_000_000
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self._window: deque = deque()
+        self._chat_last: dict[int, float] = {}
+        self.ok = 0
+        self.limited = 0
+        self.blocked = 0
+
+    def reset(self):
+        self.__init__()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        await asyncio.sleep(LATENCY)
+        chat_id = int(data["chat_id"])
+        now = time.monotonic()
+
+        while self._window and now - self._window[0] > 1.0:
+            self._window.popleft()
+        last = self._chat_last.get(chat_id)
+        if len(self._window) >= FAKE_GLOBAL_LIMIT or (last is not None and now - last < 1.0):
+            self.limited += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {FAKE_RETRY_AFTER}",
+                "parameters": {"retry_after": FAKE_RETRY_AFTER},
+            }, status=429)
+        self._window.append(now)
+        self._chat_last[chat_id] = now
+
+        if chat_id < INTERACTIVE_CHAT and chat_id % BLOCKED_EVERY == 0:
+            self.blocked += 1
+            return web.json_response(
+                {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, status=403)
+
+        self.ok += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.ok, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+
+async def start_server(api: FakeBotAPI) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/sendMessage", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+# ---------- Старая схема ----------
+async def old_loop(bot: Bot, n: int) -> float:
+    started = time.perf_counter()
+    for chat_id in range(FIRST_CHAT + 1, FIRST_CHAT + n + 1):
+        try:
+            await bot.send_message(chat_id, "🌞 Аффирмация дня")
+            await asyncio.sleep(OLD_SLEEP_SECONDS)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception:
+            pass
+    return (time.perf_counter() - started) / n
+
+
+# ---------- Движок ----------
+async def interactive_load(bot: Bot, stop: asyncio.Event) -> dict:
+    latencies, limited, i = [], 0, 0
+
+    async def reply(chat_id: int):
+        nonlocal limited
+        started = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, "ответ ассистента")
+            latencies.append(time.perf_counter() - started)
+        except TelegramRetryAfter:
+            limited += 1
+
+    tasks = []
+    while not stop.is_set():
+        i += 1
+        tasks.append(asyncio.create_task(reply(INTERACTIVE_CHAT + i)))
+        await asyncio.sleep(1 / INTERACTIVE_RATE)
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "count": len(latencies) + limited,
+        "limited": limited,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0,
+    }
+
+
+async def engine_run(bot: Bot, bucket: TokenBucket, n: int):
+    engine = BroadcastEngine(bucket=bucket)
+
+    async def send(chat_id: int):
+        await bot.send_message(chat_id, "🌞 Аффирмация дня")
+
+    stop = asyncio.Event()
+    interactive = asyncio.create_task(interactive_load(bot, stop))
+    report = await engine.run("bench", range(FIRST_CHAT + 1, FIRST_CHAT + n + 1), send)
+    stop.set()
+    return report, await interactive
+
+
+async def main():
+    api = FakeBotAPI()
+    runner, url = await start_server(api)
+    bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(url))
+    session.middleware(TelegramRateMeter(bucket))
+    bot = Bot(TOKEN, session=session)
+    try:
+        per_message = await old_loop(bot, OLD_SAMPLE)
+        api.reset()
+        report, interactive = await engine_run(bot, bucket, RECIPIENTS)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    old_total = per_message * RECIPIENTS
+    print(f"Получателей: {RECIPIENTS}, задержка API: {LATENCY * 1000:.0f} мс, "
+          f"лимит сервера: {FAKE_GLOBAL_LIMIT}/с и 1/с на чат")
+    print(f"{'схема':<28}{'сообщ./с':>10}{'время, с':>12}{'429':>6}")
+    print(f"{'sleep(1.5) последовательно':<28}{1 / per_message:>10.2f}{old_total:>12.0f}{'—':>6}  (расчёт по {OLD_SAMPLE})")
+    print(f"{'BroadcastEngine':<28}{report.rate:>10.2f}{report.elapsed:>12.1f}{api.limited:>6}")
+    print(f"\nРассылка: отправлено {report.sent}, заблокировали {report.blocked}, "
+          f"ошибок {report.failed}, повторов {report.retried}")
+    print(f"Ответы в чатах во время рассылки: {interactive['count']}, "
+          f"429: {interactive['limited']}, p95 задержки: {interactive['p95'] * 1000:.0f} мс")
+    print(f"Ускорение: ×{old_total / report.elapsed:.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
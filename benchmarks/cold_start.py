@@ -0,0 +1,96 @@
+"""
+benchmarks/cold_start.py
+
+Бенчмарк холодного старта: сколько SQL-запросов и времени уходит на
+проверку схемы БД при запуске процесса.
+
+Сравниваются старый путь (create_all в database.py, ещё раз create_all
+в main.py, затем add_missing_user_columns через inspector) и новый
+(migrate.ensure_schema при актуальной схеме — один SELECT версии).
+Каждый прогон — новый движок, как у свежего процесса. Старый путь идёт
+на отдельной базе: его add_missing_user_columns вернул бы в мигрированную
+users колонки, которые миграция 0004 перенесла в user_activity.
+
+База — BENCH_DATABASE_URL (по умолчанию временный файл SQLite; для честных
+цифр укажите локальный Postgres — см. fixtures.py).
+
+Запуск:  python -m benchmarks.cold_start
+"""
+
+import contextlib
+import os
+import statistics
+import time
+
+from sqlalchemy import create_engine, event, inspect, text
+
+from benchmarks.fixtures import bench_database, describe
+import models  # noqa: F401
+from database import Base
+from migrate import ensure_schema, migrate
+
+RUNS = int(os.environ.get("BENCH_RUNS", 20))
+
+LEGACY_USER_COLUMNS = {
+    "referrer_code": "VARCHAR",
+    "referral_code": "VARCHAR",
+    "is_unlimited": "BOOLEAN DEFAULT FALSE",
+    "has_paid": "BOOLEAN DEFAULT FALSE",
+    "subscription_expires_at": "TIMESTAMP",
+    "first_seen_at": "TIMESTAMP",
+    "total_messages": "INTEGER DEFAULT 0",
+    "thread_message_count": "INTEGER DEFAULT 0",
+    "thread_token_estimate": "INTEGER DEFAULT 0",
+    "thread_summary": "TEXT",
+}
+
+
+def legacy_startup(engine):
+    """Старая последовательность: create_all ×2 + интроспекция users."""
+    Base.metadata.create_all(bind=engine)   # database.py
+    Base.metadata.create_all(bind=engine)   # main.py
+    with engine.connect() as conn:          # main.add_missing_user_columns
+        columns = [c["name"] for c in inspect(engine).get_columns("users")]
+        for name, ddl in LEGACY_USER_COLUMNS.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} {ddl}"))
+        conn.commit()
+
+
+def new_startup(engine):
+    ensure_schema(bind=engine)
+
+
+def measure(base_engine, startup) -> tuple[list[float], int]:
+    timings, statements = [], 0
+    for _ in range(RUNS):
+        engine = create_engine(base_engine.url)
+        counter = {"n": 0}
+        event.listen(engine, "before_cursor_execute", lambda *a: counter.__setitem__("n", counter["n"] + 1))
+        started = time.perf_counter()
+        startup(engine)
+        timings.append(time.perf_counter() - started)
+        statements = counter["n"]
+        engine.dispose()
+    return timings, statements
+
+
+def main():
+    with bench_database("cold_start_legacy") as legacy_engine, bench_database("cold_start_bench") as base_engine:
+        # Обе схемы уже готовы — как на проде при обычном рестарте
+        legacy_startup(legacy_engine)
+        migrate(bind=base_engine)
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            legacy, legacy_sql = measure(legacy_engine, legacy_startup)
+            new, new_sql = measure(base_engine, new_startup)
+
+    print(f"База: {describe(base_engine)}, прогонов: {RUNS}")
+    print(f"{'путь':<10}{'SQL-запросов':>14}{'медиана, мс':>14}{'p95, мс':>10}")
+    for name, timings, sql in (("старый", legacy, legacy_sql), ("новый", new, new_sql)):
+        p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+        print(f"{name:<10}{sql:>14}{statistics.median(timings) * 1000:>14.1f}{p95 * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
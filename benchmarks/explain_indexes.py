@@ -0,0 +1,148 @@
+"""
+benchmarks/explain_indexes.py
+
+Проверка планов частых запросов: каждый должен читать users, user_activity
+и evening_ritual_logs через индекс, а не последовательным сканированием.
+
+Скрипт создаёт схему миграциями (migrate.py), заполняет её синтетическими
+пользователями (BENCH_USERS, по умолчанию 100 000; см. fixtures.py)
+и смотрит EXPLAIN каждого запроса.
+
+База — BENCH_DATABASE_URL, локальный Postgres (схема explain_bench).
+Без BENCH_DATABASE_URL — временный файл SQLite (планировщик другой,
+годится только для быстрой проверки, что индексы вообще подхватываются).
+
+Запросы намеренно не включают topic_stats: там десяток строк, и Postgres
+верно выбирает последовательное чтение.
+
+Запуск:  BENCH_DATABASE_URL=postgresql://localhost/empathai python -m benchmarks.explain_indexes
+"""
+
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+from benchmarks.fixtures import bench_database, describe, seed_users, vacuum_analyze
+from models import EveningRitualLog, User, UserActivity
+from migrate import migrate
+
+USERS = int(os.environ.get("BENCH_USERS", 100_000))
+SCHEMA = "explain_bench"
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+# ---------- Синтетические данные ----------
+def seed(conn, users: int) -> str:
+    """Пользователи из fixtures.py и записи вечернего ритуала; возвращает код реферера."""
+    rows = seed_users(conn, users)
+    logs = [{
+        "user_id": i,
+        "date": row["last_message_date"],
+        "emotion": "calm",
+        "action": "emotion_selected",
+        "is_premium": row["has_paid"],
+    } for i, row in enumerate(rows) if row["last_message_date"] and i % 5 == 0]
+    for chunk in range(0, len(logs), 5000):
+        conn.execute(EveningRitualLog.__table__.insert(), logs[chunk:chunk + 5000])
+    return next(row["referrer_code"] for row in rows if row["referrer_code"])
+
+
+# ---------- Частые запросы (как в коде бота) ----------
+def hot_queries(referrer: str) -> list[tuple[str, str, object]]:
+    now = datetime.utcnow()
+    today = now.date()
+    today_start = datetime.combine(today, datetime.min.time())
+    count = func.count(User.id)
+    return [
+        ("users", "пользователь по telegram_id",
+         select(User).where(User.telegram_id == 1_000_042)),
+        ("users", "приглашённые по коду (кабинет, /admin_user)",
+         select(count).where(User.referrer_code == referrer)),
+        ("users", "/admin_referrals: топ рефереров",
+         select(User.referrer_code, count).where(User.referrer_code.isnot(None))
+         .group_by(User.referrer_code).order_by(count.desc()).limit(10)),
+        ("users", "/admin_referrals: уникальные рефереры",
+         select(func.count(func.distinct(User.referrer_code))).where(User.referrer_code.isnot(None))),
+        ("users", "статистика: пришли по ссылке",
+         select(count).where(User.referrer_code != None)),  # noqa: E711
+        ("user_activity", "вечерний ритуал: активные за 5 дней",
+         select(UserActivity.telegram_id).where(UserActivity.last_message_date >= today - timedelta(days=5))),
+        ("user_activity", "статистика: активные за 24ч",
+         select(func.count(UserActivity.telegram_id)).where(
+             (UserActivity.last_message_date != None) & (UserActivity.last_message_date >= today - timedelta(days=1)))),  # noqa: E711
+        ("user_activity", "статистика: активные за 7 дней",
+         select(func.count(UserActivity.telegram_id)).where(
+             (UserActivity.last_message_date != None) & (UserActivity.last_message_date >= today - timedelta(days=7)))),  # noqa: E711
+        ("users", "статистика: новые сегодня",
+         select(count).where((User.first_seen_at != None) & (User.first_seen_at >= today_start))),  # noqa: E711
+        ("users", "статистика: новые за 30 дней",
+         select(count).where((User.first_seen_at != None) & (User.first_seen_at >= now - timedelta(days=30)))),  # noqa: E711
+        ("users", "статистика: платных всего",
+         select(count).where(User.has_paid == True)),  # noqa: E712
+        ("users", "статистика: платные за 30 дней",
+         select(count).where((User.has_paid == True) & (User.first_seen_at >= now - timedelta(days=30)))),  # noqa: E712
+        ("user_activity", "статистика: закончился лимит",
+         select(count).join(User.activity).where(
+             UserActivity.free_messages_used >= 7, User.has_paid == False, User.is_unlimited == False)),  # noqa: E712
+        ("evening_ritual_logs", "вечерний ритуал: записи пользователя за день",
+         select(EveningRitualLog).where(EveningRitualLog.user_id == 42, EveningRitualLog.date == today)),
+    ]
+
+
+# ---------- Разбор планов ----------
+def _sql(conn, stmt) -> str:
+    return str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def plan_postgres(conn, stmt, table: str) -> tuple[bool, list[str]]:
+    plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + _sql(conn, stmt))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    nodes, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get("Plans", []))
+
+    seq_scan = any(n["Node Type"] == "Seq Scan" and n.get("Relation Name") == table for n in nodes)
+    indexes = [n["Index Name"] for n in nodes if n["Node Type"] in INDEX_NODES]
+    return bool(indexes) and not seq_scan, indexes
+
+
+def plan_sqlite(conn, stmt, table: str) -> tuple[bool, list[str]]:
+    details = [row[3] for row in conn.execute(text("EXPLAIN QUERY PLAN " + _sql(conn, stmt)))]
+    indexes = [m.group(1) for d in details for m in [re.search(r"USING (?:COVERING )?INDEX (\w+)", d)] if m]
+    indexes += ["PRIMARY KEY" for d in details if "INTEGER PRIMARY KEY" in d]
+    seq_scan = any(re.fullmatch(rf"SCAN {table}", d) for d in details)
+    return bool(indexes) and not seq_scan, indexes
+
+
+def main():
+    failed = 0
+    with bench_database(SCHEMA) as engine:
+        migrate(bind=engine)
+        with engine.begin() as conn:
+            referrer = seed(conn, USERS)
+        vacuum_analyze(engine)
+
+        explain = plan_postgres if engine.dialect.name == "postgresql" else plan_sqlite
+        print(f"\nБаза: {describe(engine)}, пользователей: {USERS}")
+        with engine.connect() as conn:
+            for table, name, stmt in hot_queries(referrer):
+                ok, indexes = explain(conn, stmt, table)
+                failed += not ok
+                print(f"{'✅' if ok else '❌'} {name:<48} {', '.join(indexes) or 'seq scan'}")
+
+    if failed:
+        print(f"\n❌ Без индекса: {failed} запрос(ов)")
+        sys.exit(1)
+    print("\n✅ Все частые запросы идут через индексы")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+benchmarks/fixtures.py
+
+Общие заготовки для бенчмарков, чтобы все они запускались без сети.
+
+  bench_database(schema) — движок для BENCH_DATABASE_URL:
+      • локальный Postgres — всё создаётся в отдельной схеме и удаляется
+        в конце, рабочие таблицы не затрагиваются;
+      • без BENCH_DATABASE_URL — временный файл SQLite.
+  synthetic_users(n) — N пользователей с реалистичным распределением:
+      немного платных, часть по реферальным ссылкам, треть ни разу не писала,
+      остальные в основном давно.
+  seed_users(conn, n) — те же пользователи в users + user_activity.
+
+Импортируйте этот модуль до models/database: он подставляет DATABASE_URL
+(SQLite в памяти), если переменная не задана.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, make_url, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.py требует DATABASE_URL; бенчмарки работают со своим движком
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+SEED = 17
+BATCH = 5000
+
+
+@contextmanager
+def bench_database(schema: str):
+    url = os.environ.get("BENCH_DATABASE_URL")
+    tmp = None
+    if not url:
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        url = f"sqlite:///{tmp.name}"
+    url = url.replace("postgres://", "postgresql://", 1)
+    postgres = url.startswith("postgresql://")
+
+    if postgres:
+        with create_engine(url, isolation_level="AUTOCOMMIT").connect() as admin:
+            admin.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            admin.execute(text(f"CREATE SCHEMA {schema}"))
+        # search_path — в самом URL: create_engine(engine.url) даёт такой же движок
+        engine = create_engine(make_url(url).update_query_dict({"options": f"-csearch_path={schema}"}))
+    else:
+        engine = create_engine(url)
+
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        if postgres:
+            with create_engine(url, isolation_level="AUTOCOMMIT").connect() as admin:
+                admin.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        if tmp:
+            os.unlink(tmp.name)
+
+
+def describe(engine) -> str:
+    return engine.url.render_as_string(hide_password=True).split("@")[-1]
+
+
+def vacuum_analyze(engine):
+    """Статистика для планировщика (и карта видимости для index-only scan на Postgres)."""
+    postgres = engine.dialect.name == "postgresql"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE" if postgres else "ANALYZE"))
+
+
+def synthetic_users(n: int, seed: int = SEED) -> list[dict]:
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    today = now.date()
+    referrers = [str(1_000_000 + i) for i in range(max(n // 200, 1))]
+    summary = "Пользователь рассказывал о тревоге перед экзаменами и ссорах с близкими. " * 8
+
+    users = []
+    for i in range(n):
+        telegram_id = 1_000_000 + i
+        paid = rnd.random() < 0.05
+        users.append({
+            "telegram_id": telegram_id,
+            "thread_id": f"thread_{rnd.getrandbits(96):024x}",
+            "thread_summary": summary if rnd.random() < 0.3 else None,
+            "first_seen_at": now - timedelta(days=rnd.uniform(0, 730)),
+            "has_paid": paid,
+            "is_unlimited": not paid and rnd.random() < 0.01,
+            "subscription_expires_at": now + timedelta(days=rnd.randint(-60, 365)) if paid else None,
+            "referrer_code": rnd.choice(referrers) if rnd.random() < 0.15 else None,
+            "referral_code": f"ref{telegram_id}",
+            # user_activity
+            "last_message_date": None if rnd.random() < 0.35 else today - timedelta(days=int(rnd.expovariate(1 / 45))),
+            "free_messages_used": rnd.choice([0, 1, 2, 3, 4, 5, 6] * 3 + [7]),
+            "total_messages": rnd.randint(0, 500),
+        })
+    return users
+
+
+def seed_users(conn, n: int, seed: int = SEED) -> list[dict]:
+    """Заполняет users и user_activity (схема уже создана миграциями) и возвращает строки."""
+    from models import User, UserActivity
+
+    users = synthetic_users(n, seed)
+    user_columns = set(User.__table__.c.keys())
+    activity_columns = set(UserActivity.__table__.c.keys())
+    for chunk in range(0, len(users), BATCH):
+        rows = users[chunk:chunk + BATCH]
+        conn.execute(User.__table__.insert(), [{k: v for k, v in r.items() if k in user_columns} for r in rows])
+        conn.execute(UserActivity.__table__.insert(), [{k: v for k, v in r.items() if k in activity_columns} for r in rows])
+    return users
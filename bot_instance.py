@@ -1,5 +1,8 @@
 import os
 from aiogram import Bot, Dispatcher
+from broadcast import TelegramRateMeter
 
 bot = Bot(token=os.environ["TELEGRAM_TOKEN"])
+# Ответы в чатах учитываются в общем лимите Telegram, который делят с рассылками (broadcast.py)
+bot.session.middleware(TelegramRateMeter())
 dp = Dispatcher()
@@ -0,0 +1,388 @@
+"""
+broadcast.py
+
+Общий движок рассылок: аффирмации, реактивация, вечерний ритуал.
+
+Вместо «отправил — поспал секунду» сообщения отправляет пул из
+BROADCAST_CONCURRENCY воркеров, а темп задают два ведра токенов:
+
+  • telegram_bucket — общий лимит бота в Telegram (TELEGRAM_GLOBAL_RATE,
+    ~30 сообщений/с). Ответы в чатах берут из него токен без ожидания
+    (TelegramRateMeter в сессии бота), рассылки ждут и оставляют в ведре
+    BROADCAST_INTERACTIVE_RESERVE токенов про запас для ответов;
+  • ведро самих рассылок (BROADCAST_RATE, по умолчанию 25/с) — общее для
+    всех одновременно идущих рассылок, так что запас под ответы
+    пользователям остаётся всегда.
+
+В один чат рассылка пишет не чаще раза в BROADCAST_PER_CHAT_INTERVAL секунд.
+TelegramRetryAfter ставит на паузу все рассылки сразу (а не один воркер),
+после паузы сообщение отправляется повторно. Сетевые и 5xx-ошибки
+повторяются с нарастающей задержкой, всего не больше BROADCAST_MAX_ATTEMPTS
+попыток. Заблокировавшие бота и несуществующие чаты помечаются недоступными
+(reachability.py) и в следующие рассылки не попадают.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))
+BROADCAST_INTERACTIVE_RESERVE = float(os.environ.get("BROADCAST_INTERACTIVE_RESERVE", 5))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 8))
+BROADCAST_PER_CHAT_INTERVAL = float(os.environ.get("BROADCAST_PER_CHAT_INTERVAL", 1.0))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", 4))
+
+PROGRESS_EVERY = 500      # строка прогресса в логе каждые N отправленных
+SUPPRESS_BATCH = 100      # недоступных чатов на одну запись в users
+CHAT_PRUNE_SIZE = 4096    # после стольких чатов чистим устаревшие отметки per-chat
+
+SendFn = Callable[[int], Awaitable[Any]]
+ResultFn = Callable[[int, str, int, str | None], None]
+SuppressFn = Callable[[list[tuple[int, str | None]]], Awaitable[None]]
+
+# Запросы, отправленные воркерами рассылки (их учитывает сам движок)
+_broadcast_request = contextvars.ContextVar("broadcast_request", default=False)
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate в секунду, не больше capacity в запасе.
+
+    acquire() ждёт токен (и общую паузу после TelegramRetryAfter),
+    consume() берёт токен сразу — при нехватке ведро уходит в минус,
+    и ждущие acquire() пропускают соответствующее время.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+        # 📊 Метрики
+        self.acquired = 0
+        self.consumed = 0
+        self.pauses = 0
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount: float = 1.0):
+        self._refill()
+        self._tokens -= amount
+        self.consumed += 1
+
+    def pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.pauses += 1
+
+    async def acquire(self, reserve: float = 0.0):
+        """Ждёт, пока в ведре будет 1 + reserve токенов, и забирает один."""
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self._tokens >= 1 + reserve:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+        self.acquired += 1
+        self.waited += time.monotonic() - started
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "tokens": round(self._tokens, 2),
+            "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "acquired": self.acquired,
+            "consumed": self.consumed,
+            "pauses": self.pauses,
+            "waited_seconds": round(self.waited, 1),
+        }
+
+
+# Общий лимит бота: одно ведро на процесс
+telegram_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+
+
+def _is_message_send(method) -> bool:
+    name = type(method).__name__
+    return name.startswith(("Send", "Copy", "Forward")) and name != "SendChatAction"
+
+
+class TelegramRateMeter(BaseRequestMiddleware):
+    """
+    Мидлварь сессии бота: каждое сообщение, отправленное не рассылкой
+    (ответы в чатах, админ-команды), списывает токен из общего ведра,
+    а TelegramRetryAfter на любом запросе ставит рассылки на паузу.
+    """
+
+    def __init__(self, bucket: TokenBucket = telegram_bucket):
+        self.bucket = bucket
+
+    async def __call__(self, make_request, bot, method):
+        if not _broadcast_request.get() and _is_message_send(method):
+            self.bucket.consume()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            raise
+
+
+@dataclass
+class BroadcastReport:
+    name: str
+    total: int = 0
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    retried: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+class BroadcastEngine:
+    """
+    Пул отправителей с общим темпом. run() можно вызывать из нескольких
+    рассылок одновременно: у каждой свои воркеры, но ведра общие.
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket = telegram_bucket,
+        rate: float = BROADCAST_RATE,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL,
+        reserve: float = BROADCAST_INTERACTIVE_RESERVE,
+        max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+        suppress: SuppressFn | None = None,
+    ):
+        self.bucket = bucket
+        self.own_bucket = TokenBucket(rate, capacity=1)   # ровный темп, без всплеска на старте
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.reserve = reserve
+        self.max_attempts = max_attempts
+        self._suppress = suppress
+        self._chat_ready: dict[int, float] = {}
+        self._active: dict[str, BroadcastReport] = {}
+
+        # 📊 Метрики
+        self.runs = 0
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.retried = 0
+
+    # ---------- Запуск ----------
+    async def run(
+        self,
+        name: str,
+        recipients: Iterable[int] | AsyncIterable[int],
+        send: SendFn,
+        on_result: ResultFn | None = None,
+    ) -> BroadcastReport:
+        """
+        Отправляет send(chat_id) каждому получателю и возвращает отчёт.
+
+        recipients может быть асинхронным итератором: получатели читаются
+        по мере отправки, в памяти держится только небольшая очередь.
+        on_result(chat_id, status, attempts, error) вызывается по каждому
+        получателю; status — "sent", "retried" (доставлено после повторов),
+        "blocked" (заблокировал бота или чат не найден) или "failed".
+        Чаты со статусом blocked пачками передаются в suppress.
+        """
+        report = BroadcastReport(name)
+        self.runs += 1
+        self._active[name] = report
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        unreachable: list[tuple[int, str | None]] = []
+        workers = [
+            asyncio.create_task(self._worker(queue, send, report, on_result, unreachable))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            if hasattr(recipients, "__aiter__"):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+                    report.total += 1
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+                    report.total += 1
+            for _ in workers:
+                await queue.put(None)
+        except BaseException:
+            # Получатели не дочитались (ошибка БД, отмена) — отправленное остаётся в отчёте
+            for task in workers:
+                task.cancel()
+            raise
+        finally:
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._flush_unreachable(unreachable)
+            report.elapsed = time.monotonic() - report.started_at
+            self._active.pop(name, None)
+        return report
+
+    # ---------- Отправка ----------
+    async def _worker(
+        self,
+        queue: asyncio.Queue,
+        send: SendFn,
+        report: BroadcastReport,
+        on_result: ResultFn | None,
+        unreachable: list,
+    ):
+        _broadcast_request.set(True)
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            chat_id = int(chat_id)
+            try:
+                status, attempts, error = await self._deliver(chat_id, send, report)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status, attempts, error = "failed", 1, f"{type(e).__name__}: {e}"
+                print(f"⚠️ [{report.name}] Неизвестная ошибка при отправке {chat_id}: {error}")
+                traceback.print_exc()
+            self._count(report, status)
+            if on_result:
+                on_result(chat_id, status, attempts, error)
+            if status == "blocked":
+                unreachable.append((chat_id, error))
+                if len(unreachable) >= SUPPRESS_BATCH:
+                    await self._flush_unreachable(unreachable)
+
+    async def _deliver(self, chat_id: int, send: SendFn, report: BroadcastReport) -> tuple[str, int, str | None]:
+        """Отправляет одно сообщение с повторами; возвращает (статус, попыток, ошибка)."""
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_chat(chat_id)
+            await self.own_bucket.acquire()
+            await self.bucket.acquire(reserve=self.reserve)
+            self._chat_ready[chat_id] = time.monotonic() + self.per_chat_interval
+            try:
+                await send(chat_id)
+
+            except TelegramRetryAfter as e:
+                # Лимит общий для бота: тормозим все рассылки, а не один воркер
+                self.bucket.pause(e.retry_after)
+                print(f"⏳ [{report.name}] Telegram просит подождать {e.retry_after}s — пауза рассылок")
+                error = e
+
+            except TelegramForbiddenError as e:
+                return "blocked", attempt, str(e)
+
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "blocked", attempt, str(e)
+                print(f"🚫 [{report.name}] Некорректный запрос ({chat_id}): {e}")
+                return "failed", attempt, str(e)
+
+            except (TelegramNetworkError, TelegramServerError) as e:
+                await asyncio.sleep(min(2 ** (attempt - 1), 30))
+                error = e
+
+            else:
+                return ("sent" if attempt == 1 else "retried"), attempt, None
+
+            if attempt < self.max_attempts:
+                report.retried += 1
+                self.retried += 1
+
+        print(f"🚫 [{report.name}] Не доставлено после {self.max_attempts} попыток ({chat_id}): {error}")
+        return "failed", self.max_attempts, str(error)
+
+    async def _flush_unreachable(self, unreachable: list):
+        if not unreachable or not self._suppress:
+            return
+        batch = unreachable[:]
+        del unreachable[:]
+        try:
+            await self._suppress(batch)
+        except Exception as e:
+            print(f"⚠️ Не удалось отметить недоступных пользователей ({len(batch)}): {e}")
+
+    def _count(self, report: BroadcastReport, status: str):
+        if status in ("sent", "retried"):
+            report.sent += 1
+            self.sent += 1
+            if report.sent % PROGRESS_EVERY == 0:
+                print(f"✉️ [{report.name}] Отправлено {report.sent}/{report.total}+ "
+                      f"({report.sent / (time.monotonic() - report.started_at):.1f}/с)")
+        elif status == "blocked":
+            report.blocked += 1
+            self.blocked += 1
+        else:
+            report.failed += 1
+            self.failed += 1
+
+    async def _wait_chat(self, chat_id: int):
+        ready_at = self._chat_ready.get(chat_id)
+        if ready_at is not None:
+            delay = ready_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if len(self._chat_ready) > CHAT_PRUNE_SIZE:
+            now = time.monotonic()
+            self._chat_ready = {k: t for k, t in self._chat_ready.items() if t > now}
+
+    # ---------- Метрики ----------
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "per_chat_interval_seconds": self.per_chat_interval,
+            "interactive_reserve": self.reserve,
+            "runs": self.runs,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "retried": self.retried,
+            "active": {
+                name: {"total": r.total, "sent": r.sent, "blocked": r.blocked, "failed": r.failed}
+                for name, r in self._active.items()
+            },
+            "broadcast_bucket": self.own_bucket.stats(),
+            "telegram_bucket": self.bucket.stats(),
+        }
+
+
+async def _suppress_unreachable(entries: list[tuple[int, str | None]]):
+    # reachability тянет models и БД — импорт здесь, чтобы bot_instance оставался лёгким
+    from reachability import reason_for, suppress_many
+    await suppress_many([(chat_id, reason_for(error)) for chat_id, error in entries])
+
+
+broadcaster = BroadcastEngine(suppress=_suppress_unreachable)
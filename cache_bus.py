@@ -0,0 +1,142 @@
+"""
+cache_bus.py
+
+Шина сброса кэша пользователей между воркерами — на Postgres LISTEN/NOTIFY.
+
+Код, который меняет пользователя (оплата, /give_unlimited, /delete_user,
+сброс диалога…), вызывает publish_invalidation(db, telegram_id) до commit:
+запись сразу сбрасывается в своём процессе, а NOTIFY уходит вместе
+с транзакцией. Каждый воркер держит отдельное соединение с LISTEN и
+сбрасывает у себя запись для пришедшего telegram_id.
+
+Соединение с LISTEN переподключается с экспоненциальной паузой. Пока его
+не было, уведомления могли потеряться — поэтому при обрыве и после
+переподключения кэш сбрасывается целиком.
+"""
+
+import asyncio
+import os
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DATABASE_SSL
+from user_cache import user_cache
+
+CACHE_BUS_CHANNEL = "user_cache_invalidate"
+CACHE_BUS_KEEPALIVE_SECONDS = float(os.environ.get("CACHE_BUS_KEEPALIVE_SECONDS", 30))
+CACHE_BUS_RETRY_INITIAL = 1.0
+CACHE_BUS_RETRY_MAX = 60.0
+
+
+def _is_postgres(db: AsyncSession) -> bool:
+    return db.bind is not None and db.bind.dialect.name == "postgresql"
+
+
+async def publish_invalidation(db: AsyncSession, telegram_id):
+    """Сбрасывает запись в своём кэше и рассылает NOTIFY остальным воркерам (уйдёт при commit)."""
+    user_cache.invalidate(telegram_id)
+    if _is_postgres(db):
+        await db.execute(select(func.pg_notify(CACHE_BUS_CHANNEL, str(int(telegram_id)))))
+
+
+class InvalidationListener:
+    def __init__(self, dsn: str, ssl: str | None = DATABASE_SSL):
+        self.dsn = dsn
+        self.ssl = ssl
+        self._task: asyncio.Task | None = None
+
+        # 📊 Метрики
+        self.connected = False
+        self.connects = 0
+        self.disconnects = 0
+        self.received = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print(f"📡 Cache bus: LISTEN {CACHE_BUS_CHANNEL}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.received += 1
+        try:
+            user_cache.invalidate(int(payload))
+        except ValueError:
+            print(f"⚠️ Cache bus: непонятное уведомление {payload!r}")
+
+    def _flush(self):
+        user_cache.clear()
+        self.flushes += 1
+
+    async def _run(self):
+        import asyncpg
+
+        delay = CACHE_BUS_RETRY_INITIAL
+        while True:
+            try:
+                conn = await asyncpg.connect(self.dsn, ssl=self.ssl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Cache bus: не удалось подключиться ({e}), повтор через {delay:.0f}с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, CACHE_BUS_RETRY_MAX)
+                continue
+
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            try:
+                await conn.add_listener(CACHE_BUS_CHANNEL, self._on_notify)
+                if self.connects:
+                    self._flush()  # пропущенные за время обрыва уведомления
+                self.connects += 1
+                self.connected = True
+                delay = CACHE_BUS_RETRY_INITIAL
+
+                # Обрыв TCP без закрытия соединения замечаем по keepalive-запросу
+                while not lost.is_set():
+                    try:
+                        async with asyncio.timeout(CACHE_BUS_KEEPALIVE_SECONDS):
+                            await lost.wait()
+                    except TimeoutError:
+                        async with asyncio.timeout(CACHE_BUS_KEEPALIVE_SECONDS):
+                            await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Cache bus: соединение потеряно: {e}")
+            finally:
+                if self.connected:
+                    self.connected = False
+                    self.disconnects += 1
+                    self._flush()
+                conn.terminate()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CACHE_BUS_RETRY_MAX)
+
+    def stats(self) -> dict:
+        return {
+            "channel": CACHE_BUS_CHANNEL,
+            "connected": self.connected,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "received": self.received,
+            "flushes": self.flushes,
+        }
+
+
+def start_listener(database_url: str) -> InvalidationListener | None:
+    """Запускает LISTEN, если база — Postgres (с SQLite шина не нужна: воркер один)."""
+    if not database_url.startswith(("postgres://", "postgresql://")):
+        return None
+    listener = InvalidationListener(database_url)
+    listener.start()
+    return listener
@@ -0,0 +1,319 @@
+"""
+campaigns.py
+
+Рассылки как кампании: с контрольными точками, итогом по каждому
+получателю и продолжением после перезапуска.
+
+Каждый запуск рассылки — строка broadcast_campaigns. Получатели идут
+страницами по CAMPAIGN_PAGE_SIZE (audiences.pages, по возрастанию
+telegram_id). Перед отправкой страницы в кампании отмечается её последний
+id (page_end); после отправки одной транзакцией пишутся исходы всей
+страницы (пачкой в broadcast_deliveries) и контрольная точка (checkpoint).
+
+Процесс, который отправляет кампанию, раз в CAMPAIGN_HEARTBEAT_SECONDS
+обновляет heartbeat_at. Кампания, идущая в другом воркере, для остальных
+занята; брошенной она считается, только когда heartbeat_at старше
+CAMPAIGN_STALE_SECONDS (процесс упал или перестал быть ведущим, leader.py).
+Такую кампанию один процесс забирает условным UPDATE, а уникальный индекс
+не даёт двум процессам запустить две кампании одного вида.
+
+После перезапуска незавершённая кампания продолжается с checkpoint.
+Страница, прерванная на середине, повторно не отправляется: часть её
+сообщений уже могла уйти, поэтому её получатели записываются со статусом
+"interrupted". Так ни один пользователь не получает сообщение дважды,
+а потерять можно не больше одной страницы.
+
+Виды кампаний регистрируют планировщики (register): функция подготовки
+возвращает аудиторию и функцию отправки, on_done печатает отчёт,
+необязательный on_page отмечает получателей страницы (например, время
+реактивации) — в той же транзакции, что исходы и контрольная точка.
+Отчёт считается одним агрегирующим запросом по broadcast_deliveries.
+Недоступные пользователи (reachability.py) в кампанию не попадают, их
+число на момент запуска хранится в skipped.
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import audiences
+from audiences import Audience
+from broadcast import SendFn, broadcaster
+from database import AsyncSessionLocal
+from models import BroadcastCampaign, BroadcastDelivery, User
+
+CAMPAIGN_PAGE_SIZE = int(os.environ.get("CAMPAIGN_PAGE_SIZE", 200))
+CAMPAIGN_RESUME_HOURS = float(os.environ.get("CAMPAIGN_RESUME_HOURS", 6))
+CAMPAIGN_RETENTION_DAYS = int(os.environ.get("CAMPAIGN_RETENTION_DAYS", 30))
+CAMPAIGN_HEARTBEAT_SECONDS = float(os.environ.get("CAMPAIGN_HEARTBEAT_SECONDS", 30))
+CAMPAIGN_STALE_SECONDS = float(os.environ.get("CAMPAIGN_STALE_SECONDS", 120))
+
+OUTCOMES = ("sent", "retried", "blocked", "failed", "interrupted")
+# Исходы, при которых сообщение дошло или могло дойти — их получает on_page
+REACHED_OUTCOMES = ("sent", "retried", "interrupted")
+
+
+@dataclass
+class CampaignReport:
+    campaign_id: int
+    kind: str
+    status: str
+    total: int
+    skipped: int = 0
+    sent: int = 0
+    retried: int = 0
+    blocked: int = 0
+    failed: int = 0
+    interrupted: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def delivered(self) -> int:
+        return self.sent + self.retried
+
+    @property
+    def rate(self) -> float:
+        return self.delivered / self.elapsed if self.elapsed else 0.0
+
+
+PrepareFn = Callable[[], Awaitable[tuple[Audience, SendFn] | None]]
+ReportFn = Callable[[CampaignReport], None]
+PageFn = Callable[[AsyncSession, list[int]], Awaitable[None]]   # без commit
+
+
+@dataclass
+class CampaignKind:
+    prepare: PrepareFn
+    on_done: ReportFn | None = None
+    on_page: PageFn | None = None
+
+
+_kinds: dict[str, CampaignKind] = {}
+_running: dict[int, asyncio.Task] = {}   # кампании, которые отправляет этот процесс
+
+
+def register(kind: str, prepare: PrepareFn, on_done: ReportFn | None = None, on_page: PageFn | None = None):
+    _kinds[kind] = CampaignKind(prepare, on_done, on_page)
+
+
+def _stale():
+    """Условие: процесс, отправлявший кампанию, давно не подавал признаков жизни."""
+    return or_(
+        BroadcastCampaign.heartbeat_at.is_(None),
+        BroadcastCampaign.heartbeat_at < datetime.utcnow() - timedelta(seconds=CAMPAIGN_STALE_SECONDS),
+    )
+
+
+# ---------- Запуск ----------
+async def start(kind: str) -> CampaignReport | None:
+    """Новая кампания вида kind. None — рассылать нечего или такая уже идёт (в любом процессе)."""
+    async with AsyncSessionLocal() as db:
+        running = (BroadcastCampaign.kind == kind, BroadcastCampaign.status == "running")
+        if await db.scalar(select(BroadcastCampaign.id).where(*running, ~_stale())) is not None:
+            print(f"⚠️ [{kind}] Предыдущая кампания ещё идёт — новый запуск пропущен")
+            return None
+        # Незавершённая, и её процесс молчит — её заменяет новый запуск
+        await db.execute(
+            update(BroadcastCampaign).where(*running, _stale()).values(status="abandoned", finished_at=datetime.utcnow())
+        )
+        await db.execute(delete(BroadcastCampaign).where(
+            BroadcastCampaign.finished_at < datetime.utcnow() - timedelta(days=CAMPAIGN_RETENTION_DAYS)
+        ))
+        await db.commit()
+
+    prepared = await _kinds[kind].prepare()
+    if prepared is None:
+        return None
+    audience, send = prepared
+
+    total = await audiences.count(audience)
+    skipped = await audiences.count_skipped(audience)
+    async with AsyncSessionLocal() as db:
+        campaign = BroadcastCampaign(
+            kind=kind, audience=audience.name, total=total, skipped=skipped, heartbeat_at=datetime.utcnow()
+        )
+        db.add(campaign)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Другой процесс успел запустить кампанию этого вида (ux_broadcast_campaigns_running_kind)
+            print(f"⚠️ [{kind}] Кампания уже запущена другим процессом — новый запуск пропущен")
+            return None
+    print(f"📣 [{kind}] Кампания #{campaign.id}: {total} получателей ({audience.name}), "
+          f"{skipped} недоступных пропущено")
+    return await _process(campaign, audience, send)
+
+
+async def resume_unfinished():
+    """
+    При старте ведущего: продолжает брошенные кампании, слишком старые помечает abandoned.
+    Кампании с живым heartbeat ждёт: их ещё отправляет другой процесс или он только что упал.
+    """
+    while True:
+        async with AsyncSessionLocal() as db:
+            unfinished = (await db.scalars(
+                select(BroadcastCampaign).where(BroadcastCampaign.status == "running").order_by(BroadcastCampaign.id)
+            )).all()
+
+        alive = False
+        for campaign in unfinished:
+            if campaign.id in _running:
+                continue
+            if not await _claim(campaign.id):
+                alive = True
+                continue
+            await _resume(campaign)
+
+        if not alive:
+            return
+        await asyncio.sleep(CAMPAIGN_HEARTBEAT_SECONDS)
+
+
+async def _claim(campaign_id: int) -> bool:
+    """Забирает брошенную кампанию себе — одним условным UPDATE, без гонки между процессами."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(BroadcastCampaign)
+            .where(BroadcastCampaign.id == campaign_id, BroadcastCampaign.status == "running", _stale())
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        await db.commit()
+    return result.rowcount == 1
+
+
+async def _resume(campaign: BroadcastCampaign):
+    resume_after = datetime.utcnow() - timedelta(hours=CAMPAIGN_RESUME_HOURS)
+    prepared = None
+    if campaign.kind in _kinds and campaign.started_at >= resume_after:
+        prepared = await _kinds[campaign.kind].prepare()
+    if prepared is None:
+        print(f"⚠️ [{campaign.kind}] Кампания #{campaign.id} не будет продолжена")
+        await _update(campaign.id, status="abandoned", finished_at=datetime.utcnow())
+        return
+
+    audience, send = prepared
+    print(f"🔁 [{campaign.kind}] Продолжаем кампанию #{campaign.id} после telegram_id {campaign.checkpoint}")
+    await _process(campaign, audience, send)
+
+
+async def cancel_running():
+    """
+    Прерывает кампании этого процесса (процесс перестал быть ведущим, leader.py).
+    Их продолжит новый ведущий: текущая страница закроется как interrupted.
+    """
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ---------- Отправка по страницам ----------
+async def _process(campaign: BroadcastCampaign, audience: Audience, send: SendFn) -> CampaignReport:
+    _running[campaign.id] = asyncio.current_task()
+    heartbeat = asyncio.create_task(_heartbeat(campaign.id))
+    try:
+        checkpoint = campaign.checkpoint
+        if campaign.page_end is not None and (checkpoint is None or campaign.page_end > checkpoint):
+            await _close_interrupted_page(campaign, audience, checkpoint)
+            checkpoint = campaign.page_end
+
+        async for page in audiences.pages(audience, CAMPAIGN_PAGE_SIZE, after=checkpoint):
+            await _update(campaign.id, page_end=page[-1])
+            outcomes = []
+            await broadcaster.run(
+                campaign.kind, page, send,
+                on_result=lambda tg, status, attempts, error: outcomes.append({
+                    "campaign_id": campaign.id, "telegram_id": tg,
+                    "status": status, "attempts": attempts, "error": error and error[:500],
+                }),
+            )
+            await _save_page(campaign, page[-1], outcomes)
+
+        await _update(campaign.id, status="done", finished_at=datetime.utcnow())
+    finally:
+        heartbeat.cancel()
+        _running.pop(campaign.id, None)
+
+    result = await report(campaign.id)
+    on_done = _kinds[campaign.kind].on_done if campaign.kind in _kinds else None
+    if on_done:
+        on_done(result)
+    return result
+
+
+async def _save_page(campaign: BroadcastCampaign, last_id: int, outcomes: list[dict]):
+    """Исходы страницы, отметка получателей (on_page) и контрольная точка — одной транзакцией."""
+    kind = _kinds.get(campaign.kind)
+    reached = [o["telegram_id"] for o in outcomes if o["status"] in REACHED_OUTCOMES]
+    async with AsyncSessionLocal() as db:
+        if outcomes:
+            await db.execute(insert(BroadcastDelivery), outcomes)
+        if reached and kind and kind.on_page:
+            await kind.on_page(db, reached)
+        await db.execute(
+            update(BroadcastCampaign).where(BroadcastCampaign.id == campaign.id).values(checkpoint=last_id)
+        )
+        await db.commit()
+
+
+async def _close_interrupted_page(campaign: BroadcastCampaign, audience: Audience, after: int | None):
+    stmt = audience.select_ids().where(User.telegram_id <= campaign.page_end)
+    if after is not None:
+        stmt = stmt.where(User.telegram_id > after)
+    async with AsyncSessionLocal() as db:
+        ids = list(await db.scalars(stmt))
+    print(f"⚠️ Кампания #{campaign.id}: страница до telegram_id {campaign.page_end} прервана, "
+          f"{len(ids)} получателей без повторной отправки")
+    await _save_page(campaign, campaign.page_end, [
+        {"campaign_id": campaign.id, "telegram_id": int(tg), "status": "interrupted", "attempts": 0, "error": None}
+        for tg in ids
+    ])
+
+
+async def _heartbeat(campaign_id: int):
+    """Пока кампания отправляется, другие процессы видят, что она не брошена."""
+    while True:
+        await asyncio.sleep(CAMPAIGN_HEARTBEAT_SECONDS)
+        try:
+            await _update(campaign_id, heartbeat_at=datetime.utcnow())
+        except Exception as e:
+            print(f"⚠️ Кампания #{campaign_id}: не удалось обновить heartbeat: {e}")
+
+
+async def _update(campaign_id: int, **values):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(BroadcastCampaign).where(BroadcastCampaign.id == campaign_id).values(**values))
+        await db.commit()
+
+
+# ---------- Отчёт ----------
+async def report(campaign_id: int) -> CampaignReport:
+    """Итоги кампании одним запросом: строка кампании + COUNT(*) FILTER по статусам."""
+    counts = [
+        func.count(BroadcastDelivery.telegram_id).filter(BroadcastDelivery.status == status).label(status)
+        for status in OUTCOMES
+    ]
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(BroadcastCampaign.kind, BroadcastCampaign.status, BroadcastCampaign.total,
+                   BroadcastCampaign.skipped, BroadcastCampaign.started_at, BroadcastCampaign.finished_at, *counts)
+            .outerjoin(BroadcastDelivery, BroadcastDelivery.campaign_id == BroadcastCampaign.id)
+            .where(BroadcastCampaign.id == campaign_id)
+            .group_by(BroadcastCampaign.id)
+        )).one()
+    finished = row.finished_at or datetime.utcnow()
+    return CampaignReport(
+        campaign_id=campaign_id,
+        kind=row.kind,
+        status=row.status,
+        total=row.total,
+        skipped=row.skipped,
+        elapsed=(finished - row.started_at).total_seconds(),
+        **{status: getattr(row, status) for status in OUTCOMES},
+    )
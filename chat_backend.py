@@ -0,0 +1,161 @@
+"""
+chat_backend.py
+
+Второй бэкенд ассистента: история диалога хранится у нас в Postgres
+(таблица conversation_turns), промпт собирается локально из окна последних
+реплик, а ответ — один потоковый запрос к chat.completions. Без тредов,
+run'ов и опроса.
+
+Бэкенд выбирается на деплой переменной ASSISTANT_BACKEND=chat
+(по умолчанию — assistants).
+"""
+
+import os
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import ConversationTurn
+from openai_api import async_client, apply_free_tier_limit, AssistantRunFailed
+
+ASSISTANT_BACKEND = os.environ.get("ASSISTANT_BACKEND", "assistants")
+
+CHAT_MODEL = os.environ.get("CHAT_MODEL", "gpt-4o-mini")
+CHAT_SYSTEM_PROMPT_FILE = os.environ.get("CHAT_SYSTEM_PROMPT_FILE", "texts/system_prompt.txt")
+CHAT_HISTORY_TURNS = int(os.environ.get("CHAT_HISTORY_TURNS", 20))
+CHAT_HISTORY_MAX_CHARS = int(os.environ.get("CHAT_HISTORY_MAX_CHARS", 12000))
+CHAT_MAX_TOKENS = int(os.environ.get("CHAT_MAX_TOKENS", 800))
+
+# 🧹 Хранение: не больше N реплик на пользователя и не старше D дней
+CHAT_MAX_TURNS_PER_USER = int(os.environ.get("CHAT_MAX_TURNS_PER_USER", 200))
+CHAT_RETENTION_DAYS = int(os.environ.get("CHAT_RETENTION_DAYS", 90))
+
+
+def use_chat_backend() -> bool:
+    return ASSISTANT_BACKEND == "chat"
+
+
+def _load_system_prompt() -> str:
+    try:
+        with open(CHAT_SYSTEM_PROMPT_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        print(f"⚠️ Файл {CHAT_SYSTEM_PROMPT_FILE} не найден — используем короткий промпт.")
+        return "Ты — Ила, тёплая и внимательная собеседница и психологический помощник."
+
+
+SYSTEM_PROMPT = _load_system_prompt()
+
+
+# ---------- История ----------
+async def load_history(db: AsyncSession, telegram_id: int, limit: int = CHAT_HISTORY_TURNS) -> list[ConversationTurn]:
+    """Последние реплики пользователя в хронологическом порядке — один запрос по индексу."""
+    rows = (await db.scalars(
+        select(ConversationTurn)
+        .where(ConversationTurn.telegram_id == telegram_id)
+        .order_by(ConversationTurn.turn.desc())
+        .limit(limit)
+    )).all()
+    return list(reversed(rows))
+
+
+async def append_turns(db: AsyncSession, telegram_id: int, next_turn: int, turns: list[tuple[str, str]]):
+    """Добавляет реплики (role, content) и обрезает историю пользователя до CHAT_MAX_TURNS_PER_USER."""
+    for i, (role, content) in enumerate(turns):
+        db.add(ConversationTurn(telegram_id=telegram_id, turn=next_turn + i, role=role, content=content))
+
+    last_turn = next_turn + len(turns) - 1
+    await db.execute(
+        delete(ConversationTurn).where(
+            ConversationTurn.telegram_id == telegram_id,
+            ConversationTurn.turn <= last_turn - CHAT_MAX_TURNS_PER_USER
+        )
+    )
+    await db.commit()
+
+
+async def clear_history(db: AsyncSession, telegram_id: int):
+    await db.execute(delete(ConversationTurn).where(ConversationTurn.telegram_id == telegram_id))
+    await db.commit()
+
+
+def build_prompt(history: list[ConversationTurn], user_message: str, summary: str | None = None) -> list[dict]:
+    """System-промпт + окно истории в пределах CHAT_HISTORY_MAX_CHARS + новое сообщение."""
+    window = []
+    budget = CHAT_HISTORY_MAX_CHARS - len(user_message)
+    for turn in reversed(history):
+        budget -= len(turn.content)
+        if budget < 0:
+            break
+        window.append({"role": turn.role, "content": turn.content})
+    window.reverse()
+
+    system = SYSTEM_PROMPT
+    if summary:
+        system += f"\n\nКраткое содержание прошлого разговора: {summary}"
+
+    return [{"role": "system", "content": system}, *window, {"role": "user", "content": user_message}]
+
+
+# ---------- Ответ ----------
+async def send_message_via_chat(
+    db: AsyncSession,
+    telegram_id: int,
+    user_message: str,
+    is_paid: bool = False,
+    is_unlimited: bool = False,
+    on_text=None,
+    summary: str | None = None
+) -> str:
+    """Один потоковый запрос к chat.completions; реплики сохраняются в conversation_turns."""
+    history = await load_history(db, telegram_id)
+    await db.commit()  # не держим соединение на время генерации
+    next_turn = history[-1].turn + 1 if history else 1
+
+    stream = await async_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=build_prompt(history, user_message, summary),
+        max_tokens=CHAT_MAX_TOKENS,
+        stream=True,
+    )
+
+    parts = []
+    async with stream:  # ответ HTTP закрывается и при ошибке или отмене посреди стрима
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                if on_text is not None:
+                    await on_text(delta)
+
+    response = "".join(parts).strip()
+    if not response:
+        raise AssistantRunFailed("chat.completions: пустой ответ")
+
+    # Сохраняем полный ответ: обрезка для бесплатного тарифа — только при показе
+    await append_turns(db, telegram_id, next_turn, [("user", user_message), ("assistant", response)])
+    return apply_free_tier_limit(response, is_paid, is_unlimited)
+
+
+# ---------- Хранение ----------
+async def prune_old_turns():
+    """Удаляет реплики старше CHAT_RETENTION_DAYS."""
+    async with AsyncSessionLocal() as db:
+        cutoff = datetime.utcnow() - timedelta(days=CHAT_RETENTION_DAYS)
+        result = await db.execute(delete(ConversationTurn).where(ConversationTurn.created_at < cutoff))
+        await db.commit()
+        print(f"🧹 [Chat history] удалено реплик старше {CHAT_RETENTION_DAYS} дней: {result.rowcount}")
+
+
+def start_retention_scheduler():
+    """Ежедневная чистка истории (04:00 по Алматы)."""
+    scheduler = AsyncIOScheduler(timezone="Asia/Almaty")
+    scheduler.add_job(prune_old_turns, "cron", hour=4, minute=0)
+    scheduler.start()
+    print("🕒 Chat history retention started: daily at 04:00 Asia/Almaty")
+    return scheduler
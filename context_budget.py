@@ -0,0 +1,132 @@
+"""
+context_budget.py
+
+Бюджет контекста для тредов ассистента.
+
+Для каждого треда считаем сообщения и примерное число токенов (колонки
+thread_message_count / thread_token_estimate в user_activity):
+  • после CONTEXT_TRUNCATE_AFTER сообщений run'ы идут с truncation_strategy —
+    модель видит только последние CONTEXT_LAST_MESSAGES сообщений;
+  • после CONTEXT_ROLLOVER_AFTER сообщений (или CONTEXT_ROLLOVER_TOKENS токенов)
+    старый тред сжимается в краткое резюме (users.thread_summary) и удаляется
+    в OpenAI, а следующий ответ начинается в новом треде, засеянном этим резюме.
+
+Ответы, которых не было (run не удался — AssistantRunFailed), в бюджет не идут.
+"""
+
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+from openai_api import async_client
+from cache_bus import publish_invalidation
+
+CONTEXT_TRUNCATE_AFTER = int(os.environ.get("CONTEXT_TRUNCATE_AFTER", 30))
+CONTEXT_LAST_MESSAGES = int(os.environ.get("CONTEXT_LAST_MESSAGES", 20))
+CONTEXT_ROLLOVER_AFTER = int(os.environ.get("CONTEXT_ROLLOVER_AFTER", 80))
+CONTEXT_ROLLOVER_TOKENS = int(os.environ.get("CONTEXT_ROLLOVER_TOKENS", 24000))
+CONTEXT_SUMMARY_MODEL = os.environ.get("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+CONTEXT_SUMMARY_SOURCE_MESSAGES = 40
+CONTEXT_SUMMARY_MAX_CHARS = 2000
+
+SUMMARY_PROMPT = (
+    "Ты помогаешь психологическому ассистенту Иле. Сожми диалог с пользователем "
+    "в краткое резюме на русском (до 150 слов): о чём человек рассказывал, что его "
+    "беспокоит, какие темы и договорённости важны для продолжения разговора. "
+    "Если есть резюме более раннего разговора — объедини их. Без вступлений."
+)
+SEED_PREFIX = "Краткое содержание нашего прошлого разговора (для контекста):\n"
+
+
+def estimate_tokens(text: str) -> int:
+    # Для русского текста ~3 символа на токен — точности хватает для бюджета
+    return len(text or "") // 3 + 1
+
+
+def truncation_for(user: User) -> dict | None:
+    """Параметр truncation_strategy для run'а, если тред уже длинный."""
+    if (user.thread_message_count or 0) >= CONTEXT_TRUNCATE_AFTER:
+        return {"type": "last_messages", "last_messages": CONTEXT_LAST_MESSAGES}
+    return None
+
+
+def seed_messages(user: User) -> list[dict]:
+    """Первое сообщение нового треда — резюме прошлого разговора, если оно есть."""
+    if user.thread_id or not user.thread_summary:
+        return []
+    return [{"role": "assistant", "content": SEED_PREFIX + user.thread_summary}]
+
+
+def record_turn(user: User, user_text: str, reply_text: str, messages: int = 1):
+    """Учитывает в бюджете треда сообщения пользователя и ответ ассистента (без commit)."""
+    user.thread_message_count = (user.thread_message_count or 0) + messages + 1
+    user.thread_token_estimate = (
+        (user.thread_token_estimate or 0) + estimate_tokens(user_text) + estimate_tokens(reply_text)
+    )
+
+
+def needs_rollover(user: User) -> bool:
+    return bool(user.thread_id) and (
+        (user.thread_message_count or 0) >= CONTEXT_ROLLOVER_AFTER
+        or (user.thread_token_estimate or 0) >= CONTEXT_ROLLOVER_TOKENS
+    )
+
+
+async def summarize_thread(thread_id: str, previous_summary: str | None = None) -> str:
+    """Сжимает последние сообщения треда (и прошлое резюме) в короткий текст."""
+    page = await async_client.beta.threads.messages.list(
+        thread_id=thread_id,
+        order="desc",
+        limit=CONTEXT_SUMMARY_SOURCE_MESSAGES
+    )
+    lines = []
+    for m in reversed(page.data):
+        text = "".join(c.text.value for c in m.content if c.type == "text").strip()
+        if text:
+            who = "Пользователь" if m.role == "user" else "Ила"
+            lines.append(f"{who}: {text}")
+
+    transcript = "\n".join(lines)
+    if previous_summary:
+        transcript = f"Резюме более раннего разговора: {previous_summary}\n\n{transcript}"
+
+    completion = await async_client.chat.completions.create(
+        model=CONTEXT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        max_tokens=400,
+    )
+    return (completion.choices[0].message.content or "").strip()[:CONTEXT_SUMMARY_MAX_CHARS]
+
+
+async def rollover_thread(db: AsyncSession, user: User):
+    """
+    Переводит пользователя на новый тред с резюме старого и удаляет старый.
+    Ошибка резюме — просто остаёмся в старом.
+    """
+    try:
+        summary = await summarize_thread(user.thread_id, user.thread_summary)
+    except Exception as e:
+        print(f"⚠️ Не удалось сжать тред {user.thread_id}: {e}")
+        return
+
+    print(
+        f"🗜 Тред {user.thread_id} пользователя {user.telegram_id} закрыт: "
+        f"{user.thread_message_count} сообщений, ~{user.thread_token_estimate} токенов"
+    )
+    old_thread_id = user.thread_id
+    user.thread_summary = summary or user.thread_summary
+    user.thread_id = None
+    user.thread_message_count = 0
+    user.thread_token_estimate = 0
+    await publish_invalidation(db, user.telegram_id)
+    await db.commit()
+
+    # Резюме уже у нас — старый тред больше не нужен, не копим их в OpenAI
+    try:
+        await async_client.beta.threads.delete(old_thread_id)
+    except Exception as e:
+        print(f"⚠️ Не удалось удалить тред {old_thread_id}: {e}")
@@ -0,0 +1,90 @@
+"""
+conversation.py
+
+«Актор» диалога на каждого пользователя: не больше одного run'а ассистента
+на тред одновременно.
+
+Если актор свободен, run начинается сразу — без ожидания, чтобы «печатает…»
+и первые токены ответа приходили без задержки. Сообщения, пришедшие, пока
+run идёт, копятся и уходят в следующий run одним объединённым сообщением:
+на серию сообщений пользователь получает один ответ, а тред и история
+не теряются.
+"""
+
+import asyncio
+import traceback
+
+
+def combine_texts(texts: list[str]) -> str:
+    """Склеивает серию сообщений пользователя в одно."""
+    return "\n\n".join(t.strip() for t in texts if t and t.strip())
+
+
+class ConversationActor:
+    """Очередь сообщений одного пользователя и задача, которая отвечает на них по очереди."""
+
+    def __init__(self, manager, key):
+        self._manager = manager
+        self.key = key
+        self._pending: list = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self._task is not None
+
+    def submit(self, item):
+        self._pending.append(item)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                self._manager.runs += 1
+                self._manager.coalesced += len(batch) - 1
+                try:
+                    await self._manager.respond(batch)
+                except Exception as e:
+                    print(f"❌ Ошибка при ответе пользователю {self.key}:", e)
+                    traceback.print_exc()
+        finally:
+            self._task = None
+            self._manager._release(self)
+
+
+class ConversationManager:
+    """
+    Раздаёт акторов по ключу (telegram_id).
+    respond(batch) — async-функция, которая отвечает на список накопленных сообщений.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self._actors: dict[int, ConversationActor] = {}
+
+        # 📊 Метрики
+        self.submitted = 0
+        self.runs = 0
+        self.coalesced = 0
+
+    def submit(self, key, item):
+        """Ставит сообщение в очередь пользователя и сразу возвращает управление."""
+        actor = self._actors.get(key)
+        if actor is None:
+            actor = self._actors[key] = ConversationActor(self, key)
+        self.submitted += 1
+        actor.submit(item)
+
+    def _release(self, actor: ConversationActor):
+        if not actor._pending and self._actors.get(actor.key) is actor:
+            del self._actors[actor.key]
+
+    def stats(self) -> dict:
+        return {
+            "active_users": len(self._actors),
+            "submitted": self.submitted,
+            "runs": self.runs,
+            "coalesced": self.coalesced,
+        }
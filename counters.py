@@ -0,0 +1,233 @@
+"""
+counters.py
+
+Счётчики с отложенной записью (write-behind): выбор темы, total_messages и
+другие частые «+1».
+
+Вместо SELECT → +1 → COMMIT на каждое нажатие приращения копятся в памяти
+процесса и раз в COUNTER_FLUSH_INTERVAL секунд сбрасываются в БД одним
+пакетом: upsert для topic_stats, пакетный UPDATE для user_activity. Одновременные
+нажатия больше не спорят за одну строку и не теряются.
+
+Сброс начинается сразу, как только на счётчике накопилось
+COUNTER_MAX_PENDING приращений, — при работающей БД при падении процесса
+теряются приращения примерно за COUNTER_FLUSH_INTERVAL секунд и не более
+порога. При остановке приложения всё накопленное сбрасывается (stop).
+
+Если запись в БД не удалась, приращения возвращаются в буфер, а следующая
+попытка ждёт всё дольше (до COUNTER_RETRY_MAX секунд) — порог её
+не ускоряет. Пока БД недоступна, буфер счётчика ограничен
+COUNTER_MAX_BUFFERED приращениями: сверх него новые отбрасываются
+(метрика dropped). Это и есть верхняя граница потерь при падении.
+
+Чтение для админ-статистики: значение из БД + pending() своего процесса.
+"""
+
+import asyncio
+import os
+from collections import Counter
+from typing import Awaitable, Callable
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+
+COUNTER_FLUSH_INTERVAL = float(os.environ.get("COUNTER_FLUSH_INTERVAL", 5))
+COUNTER_MAX_PENDING = int(os.environ.get("COUNTER_MAX_PENDING", 500))
+COUNTER_MAX_BUFFERED = int(os.environ.get("COUNTER_MAX_BUFFERED", 20000))
+COUNTER_RETRY_MAX = float(os.environ.get("COUNTER_RETRY_MAX", 60))
+
+FlushFn = Callable[[AsyncSession, dict], Awaitable[None]]
+
+
+class BufferedCounter:
+    def __init__(self, name: str, flush_fn: FlushFn, wakeup: asyncio.Event, max_pending: int, max_buffered: int):
+        self.name = name
+        self._flush_fn = flush_fn
+        self._wakeup = wakeup
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self._pending: Counter = Counter()
+        self._inflight: Counter = Counter()   # уже взято на запись, но ещё не закоммичено
+        self._pending_total = 0
+        self._inflight_total = 0
+        self._dropping = False
+
+        # 📊 Метрики
+        self.added = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, key, amount: int = 1):
+        if self._pending_total + self._inflight_total + amount > self.max_buffered:
+            # БД давно недоступна — буфер не растёт без предела
+            if not self._dropping:
+                self._dropping = True
+                print(f"⚠️ Счётчик {self.name}: буфер заполнен ({self.max_buffered}), новые приращения отбрасываются")
+            self.dropped += amount
+            return
+        self._pending[key] += amount
+        self._pending_total += amount
+        self.added += amount
+        if self._pending_total >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self) -> dict:
+        """Несброшенные приращения этого процесса (включая те, что пишутся прямо сейчас)."""
+        return dict(self._pending + self._inflight)
+
+    async def flush(self, db: AsyncSession) -> bool:
+        """Записывает накопленное. False — запись не удалась, приращения вернулись в буфер."""
+        if not self._pending or self._inflight:
+            return True
+        self._inflight, self._pending = self._pending, Counter()
+        self._inflight_total, self._pending_total = self._pending_total, 0
+        try:
+            await self._flush_fn(db, dict(self._inflight))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            self.failures += 1
+            self._pending.update(self._inflight)
+            self._pending_total = sum(self._pending.values())
+            print(f"⚠️ Счётчик {self.name}: не удалось записать ({e}), повтор при следующем сбросе")
+            return False
+        else:
+            self.flushes += 1
+            self.flushed += self._inflight_total
+            if self._dropping:
+                self._dropping = False
+                print(f"🧮 Счётчик {self.name}: запись восстановлена, всего отброшено приращений: {self.dropped}")
+            return True
+        finally:
+            self._inflight = Counter()
+            self._inflight_total = 0
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(self._pending.values()) + sum(self._inflight.values()),
+            "pending_keys": len(self._pending),
+            "added": self.added,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+
+class CounterAggregator:
+    def __init__(
+        self,
+        interval: float = COUNTER_FLUSH_INTERVAL,
+        max_pending: int = COUNTER_MAX_PENDING,
+        max_buffered: int = COUNTER_MAX_BUFFERED,
+        retry_max: float = COUNTER_RETRY_MAX,
+    ):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self.retry_max = retry_max
+        self.counters: dict[str, BufferedCounter] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._retry_delay: float | None = None   # задана, пока сбросы не удаются
+
+    def register(self, name: str, flush_fn: FlushFn) -> BufferedCounter:
+        counter = BufferedCounter(name, flush_fn, self._wakeup, self.max_pending, self.max_buffered)
+        self.counters[name] = counter
+        return counter
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+            print(f"🧮 Counters: сброс раз в {self.interval:g}с или по {self.max_pending} приращений")
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает всё накопленное."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_all()
+
+    async def flush_all(self) -> bool:
+        """Сбрасывает все счётчики. False — хотя бы один не записался."""
+        ok = True
+        async with self._lock:
+            for counter in self.counters.values():
+                async with AsyncSessionLocal() as db:
+                    ok = await counter.flush(db) and ok
+        return ok
+
+    async def _flush_loop(self):
+        while True:
+            if self._retry_delay is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # После ошибки ждём паузу целиком — порог не запускает повтор раньше
+                await asyncio.sleep(self._retry_delay)
+            self._wakeup.clear()
+            try:
+                ok = await self.flush_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Counters: ошибка сброса: {e}")
+                ok = False
+            if ok:
+                self._retry_delay = None
+            else:
+                self._retry_delay = min((self._retry_delay or self.interval) * 2, self.retry_max)
+
+    def stats(self) -> dict:
+        return {
+            "flush_interval_seconds": self.interval,
+            "max_pending": self.max_pending,
+            "max_buffered": self.max_buffered,
+            "retry_delay_seconds": self._retry_delay,
+            **{name: counter.stats() for name, counter in self.counters.items()},
+        }
+
+
+# ---------- Способы записи ----------
+def _dialect_insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+async def _flush_topic_stats(db: AsyncSession, deltas: dict):
+    """INSERT … ON CONFLICT (topic) DO UPDATE SET count = count + excluded.count — одним запросом."""
+    from models import TopicStat
+    insert = _dialect_insert(db)
+    stmt = insert(TopicStat).values([{"topic": topic, "count": n} for topic, n in sorted(deltas.items())])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[TopicStat.topic],
+        set_={"count": func.coalesce(TopicStat.count, 0) + stmt.excluded.count},
+    ))
+
+
+async def _flush_total_messages(db: AsyncSession, deltas: dict):
+    """Пакетный UPDATE user_activity SET total_messages = total_messages + :delta (строки уже есть)."""
+    from models import UserActivity
+    activity = UserActivity.__table__
+    await db.execute(
+        update(activity)
+        .where(activity.c.telegram_id == bindparam("tid"))
+        .values(total_messages=activity.c.total_messages + bindparam("delta")),
+        [{"tid": int(tid), "delta": n} for tid, n in sorted(deltas.items())]
+    )
+
+
+counters = CounterAggregator()
+topic_stats = counters.register("topic_stats", _flush_topic_stats)
+user_total_messages = counters.register("user_activity.total_messages", _flush_total_messages)
@@ -1,14 +1,99 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import atexit
+import hashlib
 import os
+import shutil
+import tempfile
 
+# 🗄 Режим БД выбирается DATABASE_URL:
+#   postgresql://…        — Postgres; SSL задаёт DATABASE_SSL (require по умолчанию,
+#                           disable — для локального Postgres без SSL)
+#   sqlite:///empathai.db — файл SQLite (локальная разработка, бенчмарки)
+#   sqlite://             — временная SQLite в памяти (tmpfs): своя у каждого процесса,
+#                           общая для синхронного и асинхронного движков, удаляется при выходе
 DATABASE_URL = os.environ["DATABASE_URL"]
+DATABASE_SSL = os.environ.get("DATABASE_SSL", "require")
 
-engine = create_engine(DATABASE_URL, connect_args={"sslmode": "require"})
+SQLITE_MEMORY_URLS = ("sqlite://", "sqlite:///:memory:")
+
+
+def _sqlite_memory_url() -> str:
+    """
+    Файл во временном каталоге в RAM (/dev/shm, если есть). Не :memory: с общим
+    кэшем: там одновременные записи падают с «database table is locked» сразу,
+    без busy_timeout. Файлу подходят обычные пулы — по соединению на сессию.
+    """
+    directory = tempfile.mkdtemp(prefix="empathai-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return f"sqlite:///{directory}/empathai.db"
+
+
+SQLITE_MEMORY_URL = _sqlite_memory_url() if DATABASE_URL in SQLITE_MEMORY_URLS else None
+
+
+def _sync_url(url: str) -> str:
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url in SQLITE_MEMORY_URLS:
+        url = SQLITE_MEMORY_URL
+    return url
+
+
+def _async_url(url: str) -> str:
+    """postgresql://… → postgresql+asyncpg://…, sqlite://… → sqlite+aiosqlite://… для асинхронного движка."""
+    url = _sync_url(url)
+    if url.startswith("postgresql://"):
+        url = "postgresql+asyncpg://" + url[len("postgresql://"):]
+    elif url.startswith("sqlite://"):
+        url = "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def is_sqlite(url: str = DATABASE_URL) -> bool:
+    return url.startswith("sqlite")
+
+
+def advisory_lock_key(name: str) -> int:
+    """
+    Ключ pg_advisory_lock по имени блокировки («empathai:migrations») — первые 8 байт
+    SHA-256 как bigint. Одинаков во всех процессах (в отличие от hash()), а префикс
+    проекта в имени не даёт пересечься с блокировками других приложений в общей базе.
+    """
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+
+
+def _engine_options(url: str, driver_ssl_arg: str) -> dict:
+    if is_sqlite(url):
+        return {"connect_args": {"check_same_thread": False}}
+    return {"connect_args": {driver_ssl_arg: DATABASE_SSL}}
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")      # ON DELETE CASCADE для user_activity
+    cursor.execute("PRAGMA busy_timeout=5000")    # синхронный и асинхронный движки пишут в один файл
+    cursor.close()
+
+
+# 🐢 Синхронный движок — для скриптов, миграций (migrate.py) и кода вне event loop
+engine = create_engine(_sync_url(DATABASE_URL), **_engine_options(DATABASE_URL, "sslmode"))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 
-# ---------- Создаём таблицу статистики, если её нет ----------
-from models import TopicStat  # импорт модели статистики
-Base.metadata.create_all(bind=engine)
+# ⚡ Асинхронный движок (asyncpg / aiosqlite) — для aiogram-хэндлеров и планировщиков
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True, **_engine_options(DATABASE_URL, "ssl"))
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # объекты остаются читаемыми после commit без повторного запроса
+)
+
+if is_sqlite():
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+Base = declarative_base()
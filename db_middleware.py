@@ -0,0 +1,139 @@
+"""
+db_middleware.py
+
+Одна сессия БД на апдейт Telegram.
+
+Outer-middleware диспетчера открывает AsyncSession, передаёт её хэндлерам
+аргументом `db`, в конце делает один commit (или rollback при ошибке)
+и всегда возвращает соединение в пул — хэндлерам больше не нужно
+открывать и закрывать сессии самим.
+
+Заодно считаем, сколько соединений занято, сколько апдейт ждал соединение
+из пула и сколько SQL-запросов он сделал: утечки и N+1 видны в /db/stats
+и в логах (DB_QUERY_WARN).
+"""
+
+import os
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal, async_engine
+
+DB_QUERY_WARN = int(os.environ.get("DB_QUERY_WARN", 15))
+DB_SAMPLES = 500
+
+STATS_KEY = "update_stats"
+
+
+class _UpdateStats:
+    """Счётчики одного апдейта; живут в session.info и connection.info."""
+
+    __slots__ = ("queries", "wait", "_begin_requested")
+
+    def __init__(self):
+        self.queries = 0
+        self.wait = 0.0
+        self._begin_requested = None
+
+
+DB_STATS = {
+    "updates": 0,
+    "committed": 0,
+    "rolled_back": 0,
+    "queries": 0,
+    "max_queries": 0,
+    "max_checked_out": 0,
+    "slow_updates": 0,
+}
+_query_samples: deque = deque(maxlen=DB_SAMPLES)
+_wait_samples: deque = deque(maxlen=DB_SAMPLES)
+
+
+# ---------- События SQLAlchemy ----------
+# Транзакция сессии создаётся перед запросом соединения из пула, after_begin —
+# уже с соединением: разница между ними и есть ожидание пула.
+@event.listens_for(Session, "after_transaction_create")
+def _on_transaction_create(session, transaction):
+    stats = session.info.get(STATS_KEY)
+    if stats is not None and transaction.parent is None:
+        stats._begin_requested = time.monotonic()
+
+
+@event.listens_for(Session, "after_begin")
+def _on_begin(session, transaction, connection):
+    stats = session.info.get(STATS_KEY)
+    if stats is None:
+        return
+    if stats._begin_requested is not None:
+        stats.wait += time.monotonic() - stats._begin_requested
+        stats._begin_requested = None
+    connection.info[STATS_KEY] = stats
+    DB_STATS["max_checked_out"] = max(DB_STATS["max_checked_out"], async_engine.sync_engine.pool.checkedout())
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = conn.info.get(STATS_KEY)
+    if stats is not None:
+        stats.queries += 1
+
+
+@event.listens_for(async_engine.sync_engine.pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    # Соединение вернулось в пул — следующий апдейт начнёт счёт заново
+    connection_record.info.pop(STATS_KEY, None)
+
+
+# ---------- Middleware ----------
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает сессию на апдейт и передаёт её хэндлерам как `db`."""
+
+    async def __call__(self, handler, event, data):
+        stats = _UpdateStats()
+        async with AsyncSessionLocal(info={STATS_KEY: stats}) as db:
+            data["db"] = db
+            try:
+                result = await handler(event, data)
+                await db.commit()
+                DB_STATS["committed"] += 1
+                return result
+            except Exception:
+                await db.rollback()
+                DB_STATS["rolled_back"] += 1
+                raise
+            finally:
+                _record(event, stats)
+
+
+def _record(update, stats: _UpdateStats):
+    DB_STATS["updates"] += 1
+    DB_STATS["queries"] += stats.queries
+    DB_STATS["max_queries"] = max(DB_STATS["max_queries"], stats.queries)
+    _query_samples.append(stats.queries)
+    if stats.queries:
+        _wait_samples.append(stats.wait)
+    if stats.queries > DB_QUERY_WARN:
+        DB_STATS["slow_updates"] += 1
+        print(
+            f"⚠️ Апдейт {getattr(update, 'update_id', '?')} ({getattr(update, 'event_type', '?')}) "
+            f"сделал {stats.queries} SQL-запросов — похоже на N+1"
+        )
+
+
+def db_stats() -> dict:
+    pool = async_engine.sync_engine.pool
+    queries = sorted(_query_samples)
+    waits = sorted(_wait_samples)
+    return {
+        **DB_STATS,
+        "pool_size": pool.size() if hasattr(pool, "size") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "avg_queries": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        "p95_queries": queries[int(len(queries) * 0.95)] if queries else 0,
+        "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+        "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+    }
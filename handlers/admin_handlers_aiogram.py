@@ -1,13 +1,14 @@
 from aiogram import types, Router, F
 from aiogram.filters import Command 
-from sqlalchemy import func
-from database import SessionLocal
-from models import get_user_by_telegram_id, create_user, User
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_user_by_telegram_id_async, create_user_async, User
 from datetime import datetime
 from utils import get_stats_summary
-from asyncio import sleep
-from datetime import timedelta
-from aiogram.exceptions import TelegramForbiddenError
+from cache_bus import publish_invalidation
+from collections import Counter
+import audiences
+from broadcast import broadcaster
 
 from scheduler_reactivation import send_reactivation_messages
 
@@ -22,7 +23,7 @@ MIN_PAYOUT_AMOUNT = 5000  # Минимальная сумма, необходи
 ADMIN_IDS = ["944583273", "396497806"]
 
 @router.message(Command("admin_user"))
-async def handle_admin_user(message: types.Message):
+async def handle_admin_user(message: types.Message, db: AsyncSession):
     if str(message.from_user.id) not in ADMIN_IDS:
         return await message.answer("🚫 У вас нет доступа к этой команде.")
 
@@ -32,13 +33,14 @@ async def handle_admin_user(message: types.Message):
 
     telegram_id = parts[1].strip()
 
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
     if not user:
         return await message.answer("❌ Пользователь не найден.")
 
     # 👥 Подсчёт приглашённых
-    invited_count = db.query(User).filter(User.referrer_code == str(telegram_id)).count()
+    invited_count = await db.scalar(
+        select(func.count(User.id)).where(User.referrer_code == str(telegram_id))
+    )
 
     earned = round(user.referral_earned or 0.0, 2)
     paid = round(user.referral_paid or 0.0, 2)
@@ -69,13 +71,12 @@ async def handle_admin_user(message: types.Message):
 
 
 @router.message(Command("admin_stats"))
-async def handle_admin_stats(message: types.Message):
+async def handle_admin_stats(message: types.Message, db: AsyncSession):
     if str(message.from_user.id) not in ADMIN_IDS:
         return await message.answer("🚫 У вас нет доступа к этой команде.")
 
     try:
-        db = SessionLocal()
-        stats = get_stats_summary(db)
+        stats = await db.run_sync(get_stats_summary)
 
         print("📊 Ответ статистики:")
         print(stats)
@@ -92,24 +93,26 @@ async def handle_admin_stats(message: types.Message):
 
 # 🤝 /admin_referrals — топ-рефералы
 @router.message(Command("admin_referrals"))
-async def admin_referrals(message: types.Message):
+async def admin_referrals(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
     if telegram_id not in ADMIN_IDS:
         await message.answer("⛔ У вас нет доступа к этой команде.")
         return
 
-    db = SessionLocal()
-    top_referrers = (
-        db.query(User.referrer_code, func.count(User.id).label("ref_count"))
-        .filter(User.referrer_code.isnot(None))
+    top_referrers = (await db.execute(
+        select(User.referrer_code, func.count(User.id).label("ref_count"))
+        .where(User.referrer_code.isnot(None))
         .group_by(User.referrer_code)
         .order_by(func.count(User.id).desc())
         .limit(10)
-        .all()
-    )
+    )).all()
 
-    total_referrals = db.query(User).filter(User.referrer_code.isnot(None)).count()
-    unique_referrers = db.query(User.referrer_code).distinct().count()
+    total_referrals = await db.scalar(
+        select(func.count(User.id)).where(User.referrer_code.isnot(None))
+    )
+    unique_referrers = await db.scalar(
+        select(func.count(func.distinct(User.referrer_code))).where(User.referrer_code.isnot(None))
+    )
 
     message_text = "📊 Реферальная статистика (ТОП 10):\n"
     for i, (ref_code, count) in enumerate(top_referrers, start=1):
@@ -122,18 +125,19 @@ async def admin_referrals(message: types.Message):
 
 # 📊 /stats_topics — статистика выбора тем
 @router.message(Command("stats_topics"))
-async def handle_stats_topics(message: types.Message):
+async def handle_stats_topics(message: types.Message, db: AsyncSession):
     if str(message.from_user.id) not in ADMIN_IDS:
         return await message.answer("🚫 У вас нет доступа к этой команде.")
 
     try:
-        db = SessionLocal()
 
-        # Таблица topic_stats из models.py
+        # Таблица topic_stats из models.py + ещё не записанные выборы (counters.py)
         from models import TopicStat
+        from counters import topic_stats
 
-        stats = db.query(TopicStat).all()
-        if not stats:
+        counts = Counter({stat.topic: stat.count or 0 for stat in await db.scalars(select(TopicStat))})
+        counts.update(topic_stats.pending())
+        if not counts:
             return await message.answer("📊 Пока нет данных по выбору тем.")
 
         emoji_map = {
@@ -146,10 +150,10 @@ async def handle_stats_topics(message: types.Message):
 
         text = "📊 *Статистика выбора тем:*\n\n"
         total = 0
-        for stat in stats:
-            label = emoji_map.get(stat.topic, stat.topic)
-            text += f"{label} — {stat.count}\n"
-            total += stat.count
+        for topic, count in counts.items():
+            label = emoji_map.get(topic, topic)
+            text += f"{label} — {count}\n"
+            total += count
 
         text += f"\n📈 Всего выборов тем: {total}"
 
@@ -162,7 +166,7 @@ async def handle_stats_topics(message: types.Message):
 
 # ♾ /give_unlimited <id> — выдать безлимит
 @router.message(Command("give_unlimited"))
-async def give_unlimited(message: types.Message):
+async def give_unlimited(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
     if telegram_id not in ADMIN_IDS:
         await message.answer("⛔ У вас нет доступа к этой команде.")
@@ -174,20 +178,20 @@ async def give_unlimited(message: types.Message):
         return
 
     target_id = parts[1]
-    db = SessionLocal()
-    target_user = get_user_by_telegram_id(db, target_id)
+    target_user = await get_user_by_telegram_id_async(db, target_id)
 
     if not target_user:
-        target_user = create_user(db, target_id)
+        target_user = await create_user_async(db, target_id)
 
     target_user.is_unlimited = True
-    db.commit()
+    await publish_invalidation(db, target_id)
+    await db.commit()
 
     await message.answer(f"✅ Пользователю {target_id} выдан безлимитный доступ.")
 
 
 @router.callback_query(F.data.startswith("confirm_payout:"))
-async def confirm_referral_payout(callback: types.CallbackQuery):
+async def confirm_referral_payout(callback: types.CallbackQuery, db: AsyncSession):
     parts = callback.data.split(":")
     if len(parts) != 3:
         return await callback.message.answer("❌ Ошибка: некорректные данные кнопки.")
@@ -195,8 +199,7 @@ async def confirm_referral_payout(callback: types.CallbackQuery):
     telegram_id = parts[1]
     payout_amount = float(parts[2])
 
-    db = SessionLocal()
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
     if not user:
         return await callback.message.answer("❌ Пользователь не найден.")
 
@@ -208,7 +211,7 @@ async def confirm_referral_payout(callback: types.CallbackQuery):
         return await callback.message.answer("⚠️ Сумма выплаты превышает доступный остаток.")
 
     user.referral_paid = paid + payout_amount
-    db.commit()
+    await db.commit()
 
     new_balance = round(earned - user.referral_paid, 2)
     username_display = getattr(user, "username", "неизвестен")
@@ -223,8 +226,7 @@ async def confirm_referral_payout(callback: types.CallbackQuery):
 
 
 @router.message(Command("delete_user"))
-async def delete_user_handler(message: types.Message):
-    db = SessionLocal()
+async def delete_user_handler(message: types.Message, db: AsyncSession):
 
     # Проверка доступа
     if str(message.from_user.id) not in ADMIN_IDS:
@@ -235,14 +237,15 @@ async def delete_user_handler(message: types.Message):
         return await message.answer("⚠ Укажите Telegram ID: /delete_user 123456789")
 
     telegram_id = args[1]
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
 
     if not user:
         return await message.answer("❌ Пользователь не найден.")
 
     # Удаление из базы
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await publish_invalidation(db, telegram_id)
+    await db.commit()
 
     # Запись в лог
     log_entry = f"[{datetime.utcnow()}] 🗑 Удалён пользователь {telegram_id} админом {message.from_user.id}\n"
@@ -254,7 +257,7 @@ async def delete_user_handler(message: types.Message):
 
 
 @router.message(Command("admin_ping_inactive"))
-async def handle_admin_ping_inactive(message: types.Message):
+async def handle_admin_ping_inactive(message: types.Message, db: AsyncSession):
     if str(message.from_user.id) not in ADMIN_IDS:
         return await message.answer("🚫 У вас нет доступа к этой команде.")
 
@@ -264,29 +267,21 @@ async def handle_admin_ping_inactive(message: types.Message):
 
     text_to_send = parts[1].strip()
 
-    db = SessionLocal()
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    users = db.query(User).filter(User.last_message_at < seven_days_ago).all()
-
-    if not users:
+    audience = audiences.inactive(7)
+    total = await audiences.count(audience)
+    if not total:
         return await message.answer("👥 Нет пользователей, не писавших более 7 дней.")
 
+    async def send(telegram_id: int):
+        await message.bot.send_message(chat_id=telegram_id, text=text_to_send)
 
-    count_sent = 0
-    for user in users:
-        try:
-            await message.bot.send_message(chat_id=int(user.telegram_id), text=text_to_send)
-            print(f"📤 Sent to {user.telegram_id}")
-            count_sent += 1
-            await sleep(0.5)
-        except TelegramForbiddenError:
-            print(f"⚠️ Пользователь {user.telegram_id} заблокировал бота, пропускаем")
-            continue
-        except Exception as e:
-            print(f"⚠️ Ошибка при отправке {user.telegram_id}: {e}")
-            continue
-
-    await message.answer(f"✅ Сообщение отправлено {count_sent} пользователям.")
+    skipped = await audiences.count_skipped(audience)
+    report = await broadcaster.run("Admin ping", audiences.stream(audience), send)
+    await message.answer(
+        f"✅ Сообщение отправлено {report.sent} пользователям.\n"
+        f"⛔ Заблокировали бота: {report.blocked}, 🚫 ошибок: {report.failed}\n"
+        f"⏭ Пропущено (бот заблокирован ранее): {skipped}"
+    )
 
 # 🌙 /evening_test — запуск вечернего ритуала вручную
 
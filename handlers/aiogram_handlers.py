@@ -2,10 +2,9 @@
 from aiogram import types, F, Router
 from aiogram.filters import Command, CommandStart
 from bot_instance import dp, bot
-from models import get_user_by_telegram_id, create_user
+from models import get_user_by_telegram_id_async, create_user_async, reset_user_thread_async
 from ui import main_menu, subscription_plan_keyboard
-from database import SessionLocal
-from openai_api import reset_user_thread
+from sqlalchemy.ext.asyncio import AsyncSession
 from referral import generate_cabinet_message
 from cloudpayments import generate_payment_link
 
@@ -19,12 +18,11 @@ router = Router()
 
 # 📂 Личный кабинет
 @router.message(F.text == "👤 Личный кабинет")
-async def show_cabinet(message: types.Message):
-    db = SessionLocal()
+async def show_cabinet(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
 
-    text, markup = generate_cabinet_message(user, telegram_id, db)
+    text, markup = await db.run_sync(lambda s: generate_cabinet_message(user, telegram_id, s))
     await message.answer(text, reply_markup=markup)
 
 # 💳 Купить подписку
@@ -80,11 +78,10 @@ async def send_static_text(message: types.Message):
 
 # 🔄 Сбросить диалог
 @router.message(F.text == "🔄 Сбросить диалог")
-async def reset_dialog(message: types.Message):
-    db = SessionLocal()
+async def reset_dialog(message: types.Message, db: AsyncSession):
     user_id = str(message.from_user.id)
-    user = get_user_by_telegram_id(db, user_id)
-    reset_user_thread(db, user)
+    user = await get_user_by_telegram_id_async(db, user_id)
+    await reset_user_thread_async(db, user)
 
     await message.answer("🔁 Диалог сброшен. Можешь начать новый разговор.", reply_markup=main_menu())
 
@@ -106,11 +103,10 @@ async def back_to_main(message: types.Message):
 
 # 🚀 Хендлер /start с реф-кодом
 @router.message(CommandStart())
-async def handle_start(message: types.Message):
-    db = SessionLocal()
+async def handle_start(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
 
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
     if not user:
         # Извлекаем реф. код из /start ref123
         ref_code = None
@@ -120,7 +116,7 @@ async def handle_start(message: types.Message):
             if not ref_code.isdigit():
                 ref_code = None
 
-        user = create_user(db, int(telegram_id), referrer_code=ref_code)
+        user = await create_user_async(db, int(telegram_id), referrer_code=ref_code)
         print(f"[👤] Новый пользователь создан по ссылке ref: {ref_code}")
     else:
         print(f"[ℹ️] Пользователь уже есть: {telegram_id}")
@@ -0,0 +1,32 @@
+# handlers/chat_member_handlers.py
+"""
+Блокировка и разблокировка бота пользователем (апдейты my_chat_member).
+
+Telegram присылает my_chat_member, когда пользователь блокирует бота
+(новый статус kicked) и когда разблокирует или снова нажимает «Старт»
+(member). По ним сразу обновляется доступность пользователя
+(reachability.py): заблокировавший выпадает из рассылок, вернувшийся —
+снова в них попадает.
+"""
+
+from aiogram import F, Router
+from aiogram.filters import ChatMemberUpdatedFilter, KICKED, MEMBER
+from aiogram.types import ChatMemberUpdated
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from reachability import BLOCKED, set_reachable, set_unreachable
+
+router = Router()
+router.my_chat_member.filter(F.chat.type == "private")
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def handle_bot_blocked(event: ChatMemberUpdated, db: AsyncSession):
+    await set_unreachable(db, event.from_user.id, BLOCKED)
+    print(f"⛔ Пользователь {event.from_user.id} заблокировал бота — исключён из рассылок")
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def handle_bot_unblocked(event: ChatMemberUpdated, db: AsyncSession):
+    await set_reachable(db, event.from_user.id)
+    print(f"✅ Пользователь {event.from_user.id} снова доступен для рассылок")
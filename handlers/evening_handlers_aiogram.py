@@ -9,9 +9,9 @@ from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import EveningRitualLog
-from utils import is_user_premium
+from utils import is_user_premium_async
 
 router = Router()
 
@@ -86,7 +86,7 @@ async def test_evening(message: types.Message):
 async def start_evening_ritual(query: types.CallbackQuery):
     try:
         user_id = query.from_user.id
-        is_premium = is_user_premium(user_id)
+        is_premium = await is_user_premium_async(user_id)
 
         # ✨ Новый текст, наполненный эмоцией
         question_text = (
@@ -111,12 +111,11 @@ async def start_evening_ritual(query: types.CallbackQuery):
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith(CB_EMOTION_PREFIX))
-async def handle_emotion(query: types.CallbackQuery):
-    db = SessionLocal()
+async def handle_emotion(query: types.CallbackQuery, db: AsyncSession):
     try:
         user_id = query.from_user.id
         emotion_key = query.data.split(":")[1]
-        is_premium = is_user_premium(user_id)
+        is_premium = await is_user_premium_async(user_id)
         today = datetime.date.today()
 
         emotion_data = EMOTION_MAP[emotion_key]
@@ -132,7 +131,7 @@ async def handle_emotion(query: types.CallbackQuery):
             is_premium=is_premium
         )
         db.add(new_log)
-        db.commit()
+        await db.commit()
 
         # 🌙 1️⃣ Шаг: эмоциональный отклик
         formatted_reply = (
@@ -175,33 +174,27 @@ async def handle_emotion(query: types.CallbackQuery):
 
     except Exception as e:
         print(f"❌ Ошибка при обработке эмоции: {e}")
-    finally:
-        db.close()
 
 
 @router.callback_query(lambda c: c.data == CB_WRITE_NOTE)
-async def handle_write_note(query: types.CallbackQuery, state: FSMContext):
-    db = SessionLocal()
-    try:
-        user_id = query.from_user.id
-        is_premium = is_user_premium(user_id)
-        today = datetime.date.today()
-
-        new_log = EveningRitualLog(
-            user_id=user_id,
-            date=today,
-            emotion=None,
-            action="wrote_note",
-            is_premium=is_premium
-        )
-        db.add(new_log)
-        db.commit()
+async def handle_write_note(query: types.CallbackQuery, state: FSMContext, db: AsyncSession):
+    user_id = query.from_user.id
+    is_premium = await is_user_premium_async(user_id)
+    today = datetime.date.today()
+
+    new_log = EveningRitualLog(
+        user_id=user_id,
+        date=today,
+        emotion=None,
+        action="wrote_note",
+        is_premium=is_premium
+    )
+    db.add(new_log)
+    await db.commit()
 
-        await query.message.edit_text("Опиши свой день в одном предложении (до 80 символов).")
-        await state.set_state(EveningState.waiting_for_note)
-        await query.answer()
-    finally:
-        db.close()
+    await query.message.edit_text("Опиши свой день в одном предложении (до 80 символов).")
+    await state.set_state(EveningState.waiting_for_note)
+    await query.answer()
 
 
 @router.message(EveningState.waiting_for_note)
@@ -1,24 +1,36 @@
+import asyncio
 from aiogram import types, F, Router
-from database import SessionLocal
-from datetime import datetime
-import os
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
 from aiogram.exceptions import TelegramForbiddenError
 
-from models import (
-    get_user_by_telegram_id,
-    increment_message_count,
-    update_user_thread_id,
-    create_user  # ← добавь, если не импортировал
-)
-from openai_api import send_message_to_assistant, reset_user_thread
+from models import get_user_by_telegram_id_async, create_user_async
+from openai_api import send_message_to_assistant_async, AssistantRunFailed, ERROR_RESPONSE
 from utils import clean_markdown
 from filters import classify_crisis_level, log_crisis_message
 from ui import main_menu
+from telegram_stream import StreamingReply, STREAM_REPLIES, send_typing
+from conversation import ConversationManager, combine_texts
+from assistant_scheduler import assistant_scheduler, priority_for, AssistantOverloaded
+from context_budget import seed_messages, truncation_for, record_turn, needs_rollover, rollover_thread
+from chat_backend import use_chat_backend, send_message_via_chat
+from thread_pool import thread_pool
+from user_cache import user_cache, UserSnapshot
+from cache_bus import publish_invalidation
+from quota import reserve_message, refund_messages, REASON_EXPIRED, REASON_LIMIT
+from counters import user_total_messages
+from reachability import BLOCKED, set_unreachable
 
 # Инициализация router
 router = Router()
 
-FREE_MESSAGES_LIMIT = int(os.environ.get("FREE_MESSAGES_LIMIT", 7))
+FREE_TEXT_LIMIT = 400  # символов в сообщении на бесплатном тарифе
+RUN_ACTIVE_RETRY_SECONDS = 3
+
+OVERLOADED_TEXT = (
+    "🌿 Я сейчас немного перегружена — очень много разговоров одновременно.\n"
+    "Напиши мне, пожалуйста, ещё раз через минуту, я обязательно отвечу 💙"
+)
 
 # Обрабатываем только произвольные сообщения, исключая кнопки
 @router.message(
@@ -37,13 +49,12 @@ FREE_MESSAGES_LIMIT = int(os.environ.get("FREE_MESSAGES_LIMIT", 7))
     & ~F.text.startswith("/start")
 )
 
-async def handle_gpt_message(message: types.Message):
-    db = SessionLocal()
+async def handle_gpt_message(message: types.Message, db: AsyncSession):
     telegram_id = int(message.from_user.id)
-    user = get_user_by_telegram_id(db, telegram_id)
+    user = await user_cache.load(db, telegram_id)
 
     if not user:
-        user = create_user(db, int(telegram_id))
+        user = user_cache.put(UserSnapshot.from_row(await create_user_async(db, int(telegram_id))))
         print(f"[👤] Автоматически создан пользователь в GPT: {telegram_id}")
 
     from datetime import date
@@ -56,34 +67,28 @@ async def handle_gpt_message(message: types.Message):
                 "🌿 Рада снова тебя видеть! Хочешь продолжить с того места, где мы остановились?"
             )
     
-    # ⏰ Обновим дату последней активности
-    user.last_message_date = date.today()
-    db.commit()
-
-    
     text = message.text or ""
 
-    # 🔐 Проверка лимитов (срок подписки / количество бесплатных сообщений)
-    if not user.is_unlimited:
-        if user.has_paid:
-            if user.subscription_expires_at and user.subscription_expires_at < datetime.utcnow():
-                user.has_paid = False
-                db.commit()
-                await message.answer(
-                    "📭 Срок вашей подписки истёк. Пожалуйста, оформите новую подписку.",
-                    reply_markup=main_menu()
-                )
-                return
-        else:
-            if user.free_messages_used >= FREE_MESSAGES_LIMIT:
-                await message.answer(
-                    "⚠️ Превышен лимит бесплатных сообщений.\nОформите подписку для продолжения.",
-                    reply_markup=main_menu()
-                )
-                return
+    # 🔐 Лимиты и активность — один условный UPDATE: проверка тарифа, резерв
+    # бесплатного сообщения и дата последней активности
+    crisis_level = classify_crisis_level(text)
+    too_long = not user.is_unlimited and not user.has_paid and len(text) > FREE_TEXT_LIMIT
+    reservation = await reserve_message(db, user, reserve=crisis_level != "high" and not too_long)
+
+    if reservation.reason == REASON_EXPIRED:
+        await message.answer(
+            "📭 Срок вашей подписки истёк. Пожалуйста, оформите новую подписку.",
+            reply_markup=main_menu()
+        )
+        return
+    if reservation.reason == REASON_LIMIT:
+        await message.answer(
+            "⚠️ Превышен лимит бесплатных сообщений.\nОформите подписку для продолжения.",
+            reply_markup=main_menu()
+        )
+        return
 
     # ⚠️ Кризисные слова — оставляем обработку в любом случае
-    crisis_level = classify_crisis_level(text)
     if crisis_level in ["high", "medium", "low"]:
         log_crisis_message(telegram_id, text, level=crisis_level)
         if crisis_level == "high":
@@ -96,7 +101,7 @@ async def handle_gpt_message(message: types.Message):
 
     # === НОВАЯ ПРОВЕРКА: длина сообщения для бесплатного тарифа ===
     # Проверяем после кризисного анализа, чтобы важные сигналы не терялись
-    if not user.is_unlimited and not user.has_paid and len(text) > 400:
+    if too_long:
         await message.answer(
             "В бесплатном тарифе можно отправлять до 400 символов. Оформите подписку, чтобы писать более длинные сообщения.",
             reply_markup=main_menu()
@@ -104,43 +109,147 @@ async def handle_gpt_message(message: types.Message):
         return
     # =============================================================
 
-    # 🤖 Отправка в OpenAI
-    try:
-        assistant_response, thread_id = send_message_to_assistant(
-            user.thread_id,
-            text,
-            is_paid=user.has_paid,
-            is_unlimited=user.is_unlimited
-        )
+    user_total_messages.add(telegram_id)  # total_messages — пакетом, раз в несколько секунд
+
+    # 💬 «Печатает…» — сразу при приёме, не дожидаясь начала run'а
+    typing_sent_at = await send_typing(message)
+
+    # 🧵 Отвечает актор диалога: не больше одного run'а на пользователя,
+    # сообщения, пришедшие во время run'а, уходят ассистенту следующим одним сообщением
+    conversations.submit(telegram_id, (message, reservation.reserved, typing_sent_at))
 
-    except Exception as e:
-        print("❌ Ошибка в GPT:", e)
-        if "run is active" in str(e):
-            user.thread_id = None
-            db.commit()
-            assistant_response, thread_id = send_message_to_assistant(
-                None,
+
+async def respond_to_messages(batch: list[tuple[types.Message, int, float]]):
+    """Один run ассистента на серию сообщений пользователя. Отвечаем на последнее из них."""
+    messages = [m for m, _, _ in batch]
+    reserved = sum(r for _, r, _ in batch)
+    typing_sent_at = batch[-1][2]
+    message = messages[-1]
+    telegram_id = int(message.from_user.id)
+    text = combine_texts([m.text for m in messages])
+    if len(messages) > 1:
+        print(f"🧵 Объединено {len(messages)} сообщений пользователя {telegram_id} в один запрос")
+
+    async with AsyncSessionLocal() as db:
+        user = await get_user_by_telegram_id_async(db, telegram_id)
+        # Отдаём соединение в пул, пока ждём ответ ассистента (expire_on_commit=False — user остаётся загруженным)
+        await db.commit()
+
+        # 💬 Потоковый ответ: «печатает…» сразу, текст — по мере генерации
+        reply = None
+        if STREAM_REPLIES:
+            reply = StreamingReply(message, user.has_paid, user.is_unlimited, reply_markup=main_menu())
+            await reply.start(typing_sent_at)
+        on_text = reply.feed if reply else None
+
+        # 🤖 Отправка в OpenAI — через общий лимит одновременных запросов
+        priority = priority_for(classify_crisis_level(text), user.has_paid, user.is_unlimited)
+
+        # Нет треда — берём готовый из пула один раз: и для повтора, и чтобы на любом
+        # выходе сохранить его пользователю или вернуть в пул
+        pooled_thread_id = None
+        if not use_chat_backend() and not user.thread_id:
+            pooled_thread_id = thread_pool.take()
+        sent_to_openai = False
+
+        async def keep_thread(thread_id: str | None):
+            if use_chat_backend() or user.thread_id or not thread_id:
+                return
+            user.thread_id = thread_id
+            await publish_invalidation(db, telegram_id)
+            await db.commit()
+
+        async def ask_assistant():
+            if use_chat_backend():
+                response = await send_message_via_chat(
+                    db,
+                    telegram_id,
+                    text,
+                    is_paid=user.has_paid,
+                    is_unlimited=user.is_unlimited,
+                    on_text=on_text,
+                    summary=user.thread_summary
+                )
+                return response, user.thread_id
+            # Резюме прошлого разговора уходит в новый тред первым
+            nonlocal sent_to_openai
+            sent_to_openai = True
+            seeds = seed_messages(user)
+            return await send_message_to_assistant_async(
+                user.thread_id or pooled_thread_id,
                 text,
                 is_paid=user.has_paid,
-                is_unlimited=user.is_unlimited
+                is_unlimited=user.is_unlimited,
+                on_text=on_text,
+                seed_messages=seeds,
+                truncation_strategy=truncation_for(user)
             )
-        else:
+
+        try:
+            try:
+                assistant_response, thread_id = await assistant_scheduler.run(priority, ask_assistant)
+            except AssistantOverloaded:
+                raise
+            except Exception as e:
+                # Run мог остаться от отменённого по таймауту запроса — ждём и повторяем в том же треде
+                if "run is active" not in str(e):
+                    raise
+                print("⏳ В треде ещё идёт run — повторяем через паузу:", e)
+                await asyncio.sleep(RUN_ACTIVE_RETRY_SECONDS)
+                assistant_response, thread_id = await assistant_scheduler.run(priority, ask_assistant)
+        except AssistantOverloaded:
+            print(f"🚦 Очередь к ассистенту переполнена — пользователь {telegram_id} получил отказ")
+            if reply:
+                reply.close()
+            if sent_to_openai:
+                await keep_thread(pooled_thread_id)  # первая попытка уже писала в тред
+            else:
+                thread_pool.give_back(pooled_thread_id)  # до OpenAI запрос не дошёл
+            await refund_messages(db, telegram_id, reserved)
+            await message.answer(OVERLOADED_TEXT, reply_markup=main_menu())
+            return
+        except AssistantRunFailed as e:
+            # Ответа нет — резерв возвращаем, в бюджет треда ход не записываем
+            print(f"❌ Ассистент не ответил пользователю {telegram_id}: {e}")
+            if reply:
+                reply.close()
+            await refund_messages(db, telegram_id, reserved)
+            await keep_thread(e.thread_id or pooled_thread_id)  # тред уже занят этим пользователем
+            await message.answer(ERROR_RESPONSE, reply_markup=main_menu())
+            return
+        except Exception as e:
+            print("❌ Ошибка в GPT:", e)
+            if reply:
+                reply.close()
+            await refund_messages(db, telegram_id, reserved)
+            await keep_thread(pooled_thread_id)  # сообщение могло уже попасть в тред
             await message.answer("⚠️ Произошла ошибка. Попробуй ещё раз позже.")
             return
 
-
-    if not user.thread_id:
-        update_user_thread_id(db, user, thread_id)
-
-    increment_message_count(db, user)
-
-    assistant_response = clean_markdown(assistant_response)
-
-    try:
-        await message.answer(assistant_response, reply_markup=main_menu())
-    except TelegramForbiddenError:
-        print(f"⚠️ Пользователь {telegram_id} заблокировал бота — сообщение не доставлено.")
-    except Exception as e:
-        print(f"⚠️ Не удалось отправить сообщение пользователю {telegram_id}: {e}")
-
-
+        # Бесплатные сообщения списаны при приёме (quota.py) — по одному на сообщение.
+        # Ответ на серию один, поэтому лишние резервы серии возвращаем
+        if reserved > 1:
+            await refund_messages(db, telegram_id, reserved - 1)
+
+        if not use_chat_backend():
+            record_turn(user, text, assistant_response, messages=len(messages))
+            await keep_thread(thread_id)
+            await db.commit()
+
+        try:
+            if reply:
+                await reply.finish(assistant_response)
+            else:
+                await message.answer(clean_markdown(assistant_response), reply_markup=main_menu())
+        except TelegramForbiddenError:
+            print(f"⚠️ Пользователь {telegram_id} заблокировал бота — сообщение не доставлено.")
+            await set_unreachable(db, telegram_id, BLOCKED)
+        except Exception as e:
+            print(f"⚠️ Не удалось отправить сообщение пользователю {telegram_id}: {e}")
+
+        # 🗜 Тред разросся — сжимаем его уже после ответа, чтобы пользователь не ждал
+        if not use_chat_backend() and needs_rollover(user):
+            await rollover_thread(db, user)
+
+
+conversations = ConversationManager(respond_to_messages)
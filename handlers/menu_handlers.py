@@ -3,9 +3,8 @@ from bot_instance import dp, bot
 from utils import clean_markdown
 from ui import main_menu, subscription_plan_keyboard
 from referral import generate_cabinet_message
-from openai_api import send_message_to_assistant, reset_user_thread
-from models import get_user_by_telegram_id, update_user_thread_id, increment_message_count
-from database import SessionLocal
+from models import get_user_by_telegram_id_async, reset_user_thread_async
+from sqlalchemy.ext.asyncio import AsyncSession
 from filters import classify_crisis_level, log_crisis_message
 from datetime import datetime
 from cloudpayments import generate_payment_link 
@@ -59,19 +58,17 @@ async def handle_info_files(message: types.Message):
     await message.answer(response, reply_markup=main_menu())
 
 @router.message(F.text == "🔄 Сбросить диалог")
-async def handle_reset(message: types.Message):
-    db = SessionLocal()
+async def handle_reset(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
-    user = get_user_by_telegram_id(db, telegram_id)
-    reset_user_thread(db, user)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
+    await reset_user_thread_async(db, user)
     await message.answer("🔁 Диалог сброшен. Ты можешь начать новый разговор.", reply_markup=main_menu())
 
 @router.message(F.text.in_(["👤 Личный кабинет", "👥 Кабинет", "Личный кабинет"]))
-async def handle_cabinet(message: types.Message):
-    db = SessionLocal()
+async def handle_cabinet(message: types.Message, db: AsyncSession):
     telegram_id = str(message.from_user.id)
-    user = get_user_by_telegram_id(db, telegram_id)
-    message_text, markup = generate_cabinet_message(user, telegram_id, db)
+    user = await get_user_by_telegram_id_async(db, telegram_id)
+    message_text, markup = await db.run_sync(lambda s: generate_cabinet_message(user, telegram_id, s))
     await message.answer(message_text, reply_markup=markup)
 
 @router.message(F.text == "🤝 Партнёрская программа")
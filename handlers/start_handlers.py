@@ -1,6 +1,7 @@
 from aiogram import Router, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 import random
+from counters import topic_stats
 
 router = Router()
 
@@ -80,10 +81,7 @@ anxiety_breathing = InlineKeyboardMarkup(inline_keyboard=[
 # ---------- ТРЕВОГА И БЕСПОКОЙСТВО ----------
 @router.callback_query(F.data == "topic_anxiety")
 async def handle_anxiety(callback: CallbackQuery):
-    from models import increment_topic_stat
-    from database import SessionLocal
-    db = SessionLocal()
-    increment_topic_stat(db, "topic_anxiety")  # 👈 вот эта строка добавляет запись
+    topic_stats.add("topic_anxiety")  # счётчик с отложенной записью (counters.py)
 
     await callback.message.answer(
         "Иногда тревога просто хочет, чтобы её услышали 🌿\n"
@@ -164,10 +162,7 @@ relationships_options = InlineKeyboardMarkup(inline_keyboard=[
 # ---------- ПЕРВИЧНЫЙ ВХОД В ТЕМУ ----------
 @router.callback_query(F.data == "topic_relationships")
 async def handle_relationships(callback: CallbackQuery):
-    from models import increment_topic_stat
-    from database import SessionLocal
-    db = SessionLocal()
-    increment_topic_stat(db, "topic_relationships")
+    topic_stats.add("topic_relationships")
 
     await callback.message.answer(
         "Отношения — это важно 💛\n"
@@ -246,10 +241,7 @@ selfesteem_options = InlineKeyboardMarkup(inline_keyboard=[
 # ---------- ПЕРВИЧНЫЙ ВХОД В ТЕМУ ----------
 @router.callback_query(F.data == "topic_selfesteem")
 async def handle_selfesteem(callback: CallbackQuery):
-    from models import increment_topic_stat
-    from database import SessionLocal
-    db = SessionLocal()
-    increment_topic_stat(db, "topic_selfesteem")
+    topic_stats.add("topic_selfesteem")
 
     await callback.message.answer(
         "Бывает, уверенность теряется даже у самых сильных 🌱\n"
@@ -318,10 +310,7 @@ burnout_options = InlineKeyboardMarkup(inline_keyboard=[
 # ---------- ПЕРВИЧНЫЙ ВХОД В ТЕМУ ----------
 @router.callback_query(F.data == "topic_burnout")
 async def handle_burnout(callback: CallbackQuery):
-    from models import increment_topic_stat
-    from database import SessionLocal
-    db = SessionLocal()
-    increment_topic_stat(db, "topic_burnout")
+    topic_stats.add("topic_burnout")
 
     await callback.message.answer(
         "Ты, похоже, очень устал(а) 😞\n"
@@ -444,10 +433,7 @@ chat_options = InlineKeyboardMarkup(inline_keyboard=[
 # ---------- ПЕРВИЧНЫЙ ВХОД В ТЕМУ ----------
 @router.callback_query(F.data == "topic_chat")
 async def handle_chat(callback: CallbackQuery):
-    from models import increment_topic_stat
-    from database import SessionLocal
-    db = SessionLocal()
-    increment_topic_stat(db, "topic_chat")
+    topic_stats.add("topic_chat")
 
     await callback.message.answer(
         "🌿 Иногда не нужно выбирать тему.\n"
@@ -1,10 +1,9 @@
-from models import Base
-from database import engine
+from migrate import migrate
 
 def init_db():
-    print("✅ Creating tables...")
-    Base.metadata.create_all(bind=engine)
-    print("✅ Tables created.")
+    print("✅ Applying migrations...")
+    version = migrate()
+    print(f"✅ Schema at version {version}.")
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,157 @@
+"""
+leader.py
+
+Выбор ведущего процесса для планировщиков рассылок — на advisory lock Postgres.
+
+Если воркеров uvicorn или реплик несколько, cron-задачи (аффирмации,
+реактивация, вечерний ритуал, чистка истории) должен вести ровно один
+процесс, иначе каждый пользователь получит рассылку N раз.
+
+Каждый процесс держит отдельное соединение и пробует взять
+pg_try_advisory_lock по имени SCHEDULER_LOCK. Взял — он ведущий и запускает
+планировщики (on_elected). Остальные повторяют попытку раз
+в LEADER_RETRY_SECONDS. Блокировка живёт, пока живо соединение: процесс
+упал или соединение оборвалось — Postgres снимает её сам, и её забирает
+следующий процесс. Ведущий проверяет своё соединение раз
+в LEADER_KEEPALIVE_SECONDS; потеряв его, сразу останавливает планировщики
+и идущие рассылки (on_demoted) — новый ведущий продолжит их с контрольной
+точки, как только их heartbeat устареет (campaigns.py).
+
+С SQLite процесс один — он сразу ведущий, без блокировки.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+from database import DATABASE_SSL, advisory_lock_key
+
+SCHEDULER_LOCK = "empathai:schedulers"
+SCHEDULER_LOCK_KEY = advisory_lock_key(SCHEDULER_LOCK)
+LEADER_RETRY_SECONDS = float(os.environ.get("LEADER_RETRY_SECONDS", 15))
+LEADER_KEEPALIVE_SECONDS = float(os.environ.get("LEADER_KEEPALIVE_SECONDS", 10))
+LEADER_RECONNECT_MAX = 60.0
+
+Callback = Callable[[], Awaitable[None]]
+
+
+class SchedulerLeader:
+    def __init__(self, dsn: str, on_elected: Callback, on_demoted: Callback, ssl: str | None = DATABASE_SSL):
+        self.dsn = dsn
+        self.ssl = ssl
+        self.postgres = dsn.startswith(("postgres://", "postgresql://"))
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task: asyncio.Task | None = None
+
+        # 📊 Метрики
+        self.is_leader = False
+        self.elected_at: float | None = None
+        self.elections = 0
+        self.demotions = 0
+        self.attempts = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            mode = f"advisory lock {SCHEDULER_LOCK}" if self.postgres else "один процесс (SQLite)"
+            print(f"👑 Scheduler leader: выбор ведущего — {mode}")
+
+    async def stop(self):
+        """Останавливает планировщики и отпускает блокировку (закрывая соединение)."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._demote()
+
+    # ---------- Смена ролей ----------
+    async def _elect(self):
+        self.is_leader = True
+        self.elected_at = time.monotonic()
+        self.elections += 1
+        print(f"👑 Процесс {os.getpid()} — ведущий: запускаем планировщики")
+        try:
+            await self._on_elected()
+        except Exception as e:
+            print(f"⚠️ Scheduler leader: ошибка запуска планировщиков: {e}")
+
+    async def _demote(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        self.elected_at = None
+        self.demotions += 1
+        print(f"👑 Процесс {os.getpid()} больше не ведущий: планировщики остановлены")
+        try:
+            await self._on_demoted()
+        except Exception as e:
+            print(f"⚠️ Scheduler leader: ошибка остановки планировщиков: {e}")
+
+    # ---------- Цикл ----------
+    async def _run(self):
+        if not self.postgres:
+            await self._elect()
+            return
+
+        import asyncpg
+
+        delay = LEADER_RETRY_SECONDS
+        while True:
+            try:
+                conn = await asyncpg.connect(self.dsn, ssl=self.ssl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Scheduler leader: не удалось подключиться ({e}), повтор через {delay:.0f}с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LEADER_RECONNECT_MAX)
+                continue
+
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            try:
+                delay = LEADER_RETRY_SECONDS
+                # Ведомый: пробуем взять блокировку, пока она занята другим процессом
+                while not lost.is_set():
+                    self.attempts += 1
+                    async with asyncio.timeout(LEADER_KEEPALIVE_SECONDS):
+                        if await conn.fetchval("SELECT pg_try_advisory_lock($1)", SCHEDULER_LOCK_KEY):
+                            break
+                    try:
+                        async with asyncio.timeout(LEADER_RETRY_SECONDS):
+                            await lost.wait()
+                    except TimeoutError:
+                        pass
+
+                if not lost.is_set():
+                    await self._elect()
+                    # Ведущий: блокировка наша, пока живо соединение — проверяем его
+                    while not lost.is_set():
+                        try:
+                            async with asyncio.timeout(LEADER_KEEPALIVE_SECONDS):
+                                await lost.wait()
+                        except TimeoutError:
+                            async with asyncio.timeout(LEADER_KEEPALIVE_SECONDS):
+                                await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Scheduler leader: соединение потеряно: {e}")
+            finally:
+                await self._demote()
+                conn.terminate()
+
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "mode": "advisory_lock" if self.postgres else "single",
+            "pid": os.getpid(),
+            "is_leader": self.is_leader,
+            "leader_for_seconds": round(time.monotonic() - self.elected_at) if self.elected_at else None,
+            "elections": self.elections,
+            "demotions": self.demotions,
+            "lock_attempts": self.attempts,
+        }
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 import traceback
+import asyncio
 import json
 import aiogram
 from aiogram.types import Update
@@ -16,23 +17,39 @@ from handlers import (
     aiogram_handlers,
     admin_handlers_aiogram,
     start_handlers,
-    evening_handlers_aiogram  # важно, чтобы этот модуль был в handlers/
+    evening_handlers_aiogram,  # важно, чтобы этот модуль был в handlers/
+    chat_member_handlers,
 )
 
 # 💳 CloudPayments
 from cloudpayments import verify_signature
 
 # 🗄️ База данных и модели
-from database import SessionLocal
-from models import get_user_by_telegram_id
+from database import AsyncSessionLocal, async_engine, DATABASE_URL
+from db_middleware import DbSessionMiddleware, db_stats
+from user_cache import user_cache
+from cache_bus import start_listener, publish_invalidation
+from counters import counters
+from broadcast import broadcaster
+from leader import SchedulerLeader
+import campaigns
+from models import get_user_by_telegram_id_async
 
 # 🎨 Интерфейс
 from ui import main_menu
 
+# 📥 Очередь апдейтов webhook
+import os
+from update_queue import UpdateQueue, WEBHOOK_QUEUE_OVERFLOW
+from assistant_runs import run_stats
+from assistant_scheduler import assistant_scheduler
+
 # 🕯 Планировщики
 from scheduler_affirmations import start_scheduler as start_affirmations
 from scheduler_reactivation import start_scheduler as start_reactivation
 from scheduler_evening_ritual import start_scheduler as start_evening_ritual
+from chat_backend import use_chat_backend, start_retention_scheduler as start_chat_retention
+from thread_pool import thread_pool
 
 # ----------------------
 # Подключаем роутеры
@@ -44,50 +61,17 @@ dp.include_routers(
     aiogram_handlers.router,
     start_handlers.router,
     evening_handlers_aiogram.router,  # ← теперь используется напрямую из импорта
+    chat_member_handlers.router,      # блокировка/разблокировка бота (my_chat_member)
 )
 
+# 🗄 Одна сессия БД на апдейт: хэндлеры получают её аргументом `db`
+dp.update.outer_middleware(DbSessionMiddleware())
 
-# --- Создание таблиц при первом запуске ---
-from database import engine, Base
-
-print("🗄 Проверка и создание таблиц (если отсутствуют)...")
-Base.metadata.create_all(bind=engine)
-print("✅ Все таблицы синхронизированы.")
-
-# --- Проверка и добавление недостающих колонок в таблицу users ---
-from sqlalchemy import inspect, text
-
-def add_missing_user_columns():
-    with engine.connect() as conn:
-        inspector = inspect(engine)
-        columns = [col["name"] for col in inspector.get_columns("users")]
-
-        alter_statements = []
-
-        # 🔗 Добавляем отсутствующие колонки по мере необходимости
-        if "referrer_code" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN referrer_code VARCHAR;")
-        if "referral_code" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN referral_code VARCHAR;")
-        if "is_unlimited" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN is_unlimited BOOLEAN DEFAULT FALSE;")
-        if "has_paid" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN has_paid BOOLEAN DEFAULT FALSE;")
-        if "subscription_expires_at" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN subscription_expires_at TIMESTAMP;")
-        if "first_seen_at" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN first_seen_at TIMESTAMP;")
-        if "total_messages" not in columns:
-            alter_statements.append("ALTER TABLE users ADD COLUMN total_messages INTEGER DEFAULT 0;")
-
-        for stmt in alter_statements:
-            print(f"🧩 Добавляем недостающую колонку: {stmt}")
-            conn.execute(text(stmt))
 
-        conn.commit()
-        print("✅ Проверка и обновление структуры users завершено.")
+# --- Схема БД: версионные миграции (migrate.py) ---
+from migrate import ensure_schema
 
-add_missing_user_columns()
+ensure_schema()
 
 app = FastAPI()
 print("💡 AIOGRAM VERSION:", aiogram.__version__)
@@ -157,42 +141,43 @@ async def cloudpayments_result(request: Request):
             return {"code": 0}
 
         # Обновление пользователя
-        db = SessionLocal()
-        user = get_user_by_telegram_id(db, str(telegram_id))
-        if user:
-            now = datetime.utcnow()
-            days = 30 if plan == "monthly" else 365
-            user.has_paid = True
-
-            current_expiry = user.subscription_expires_at or now
-            base_date = max(current_expiry, now)
-            user.subscription_expires_at = base_date + timedelta(days=days)
-
-            # Реферальная логика
-            if user.referrer_code:
-                try:
-                    referrer = get_user_by_telegram_id(db, str(user.referrer_code))
-                    if referrer:
-                        amount = float(data.get("Amount", "0").replace(",", "."))
-                        reward = round(amount * 0.3, 2)
-                        referrer.referral_earned = (referrer.referral_earned or 0.0) + reward
-                        print(f"🎉 Начислено {reward}₽ рефералу {referrer.telegram_id}")
-                except Exception as e:
-                    print("⚠️ Ошибка при начислении бонуса:", e)
-
-            db.commit()
-            print(f"📆 Подписка продлена до: {user.subscription_expires_at}")
+        async with AsyncSessionLocal() as db:
+            user = await get_user_by_telegram_id_async(db, telegram_id)
+            if user:
+                now = datetime.utcnow()
+                days = 30 if plan == "monthly" else 365
+                user.has_paid = True
+
+                current_expiry = user.subscription_expires_at or now
+                base_date = max(current_expiry, now)
+                user.subscription_expires_at = base_date + timedelta(days=days)
+
+                # Реферальная логика
+                if user.referrer_code:
+                    try:
+                        referrer = await get_user_by_telegram_id_async(db, user.referrer_code)
+                        if referrer:
+                            amount = float(data.get("Amount", "0").replace(",", "."))
+                            reward = round(amount * 0.3, 2)
+                            referrer.referral_earned = (referrer.referral_earned or 0.0) + reward
+                            print(f"🎉 Начислено {reward}₽ рефералу {referrer.telegram_id}")
+                    except Exception as e:
+                        print("⚠️ Ошибка при начислении бонуса:", e)
+
+                await publish_invalidation(db, user.telegram_id)
+                await db.commit()
+                print(f"📆 Подписка продлена до: {user.subscription_expires_at}")
 
-            try:
-                await bot.send_message(
-                    chat_id=int(telegram_id),
-                    text="✅ Ваша подписка активирована!\nСпасибо за доверие 💙",
-                    reply_markup=main_menu()
-                )
-            except Exception as send_err:
-                print("⚠️ Не удалось отправить сообщение пользователю:", send_err)
-        else:
-            print("⚠️ Пользователь не найден в базе.")
+                try:
+                    await bot.send_message(
+                        chat_id=int(telegram_id),
+                        text="✅ Ваша подписка активирована!\nСпасибо за доверие 💙",
+                        reply_markup=main_menu()
+                    )
+                except Exception as send_err:
+                    print("⚠️ Не удалось отправить сообщение пользователю:", send_err)
+            else:
+                print("⚠️ Пользователь не найден в базе.")
 
         return {"code": 0}
 
@@ -202,9 +187,38 @@ async def cloudpayments_result(request: Request):
         return JSONResponse(content={"code": 2, "message": "Internal error"}, status_code=500)
 
 
+# ----------------------
+# Метрики ассистента
+# ----------------------
+@app.get("/assistant/stats")
+async def assistant_stats():
+    return {
+        "runs": run_stats(),
+        "conversations": gptchat.conversations.stats(),
+        "scheduler": assistant_scheduler.stats(),
+        "thread_pool": thread_pool.stats(),
+    }
+
+
 # ----------------------
 # Telegram webhook
 # ----------------------
+# "queue" — быстро отвечаем Telegram и обрабатываем апдейт в фоне,
+# "inline" — старое поведение: ответ только после всей цепочки хэндлеров
+WEBHOOK_MODE = os.environ.get("WEBHOOK_MODE", "queue")
+
+
+async def process_update(update: Update):
+    await dp.feed_update(bot, update)
+
+
+update_queue = UpdateQueue(process_update)
+cache_listener = None  # LISTEN на сброс кэша пользователей (cache_bus.py), только для Postgres
+campaign_resume_task = None  # продолжение рассылок, прерванных перезапуском (campaigns.py)
+scheduler_leader = None  # выбор процесса, который ведёт рассылки (leader.py)
+leader_schedulers = []  # планировщики, запущенные этим процессом как ведущим
+
+
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
     try:
@@ -212,36 +226,139 @@ async def telegram_webhook(request: Request):
         print("✅ /webhook вызван\n📨 Raw data:", data)
 
         update = Update(**data)
-        await dp.feed_update(bot, update)
+
+        if WEBHOOK_MODE != "queue":
+            await process_update(update)
+            return {"ok": True}
+
+        if not update_queue.submit(update):
+            if WEBHOOK_QUEUE_OVERFLOW == "inline":
+                print("⚠️ Очередь апдейтов заполнена — обрабатываем апдейт в запросе")
+                await process_update(update)
+                return {"ok": True}
+
+            print("⚠️ Очередь апдейтов заполнена — просим Telegram повторить позже")
+            return JSONResponse(
+                status_code=503,
+                content={"error": "update queue is full"},
+                headers={"Retry-After": "1"}
+            )
+
         return {"ok": True}
     except Exception as e:
         print("❌ Ошибка в webhook:", e)
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+
+@app.get("/webhook/stats")
+async def telegram_webhook_stats():
+    return {"mode": WEBHOOK_MODE, "queue": update_queue.stats()}
+
+
+@app.get("/broadcast/stats")
+async def broadcast_stats():
+    return broadcaster.stats()
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler_leader.stats() if scheduler_leader else None
+
+
+@app.get("/db/stats")
+async def database_stats():
+    return {
+        **db_stats(),
+        "user_cache": user_cache.stats(),
+        "cache_bus": cache_listener.stats() if cache_listener else None,
+        "counters": counters.stats(),
+    }
+
+
+@app.on_event("startup")
+async def startup_update_queue():
+    global cache_listener
+    if WEBHOOK_MODE == "queue":
+        update_queue.start()
+    cache_listener = start_listener(DATABASE_URL)
+    counters.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_update_queue():
+    await update_queue.stop()
+    await thread_pool.stop()
+    if cache_listener:
+        await cache_listener.stop()
+    if scheduler_leader:
+        await scheduler_leader.stop()   # отпускаем блокировку — ведущим сразу станет другой процесс
+    await counters.stop()   # дописываем накопленные счётчики до закрытия пула
+    await async_engine.dispose()
+
 # --- Запуск планировщиков рассылок ---
 
 @app.on_event("startup")
 async def startup_schedulers():
     """
-    Запуск всех планировщиков (утренние аффирмации, реактивация, вечерний ритуал).
+    Запуск планировщиков. Рассылки и чистку истории ведёт только ведущий
+    процесс (leader.py) — при нескольких воркерах/репликах они не дублируются.
     """
+    if not use_chat_backend():
+        thread_pool.start()
+
+    global scheduler_leader
+    scheduler_leader = SchedulerLeader(DATABASE_URL, on_elected=start_leader_jobs, on_demoted=stop_leader_jobs)
+    scheduler_leader.start()
+
+
+async def start_leader_jobs():
+    """Этот процесс стал ведущим: утренние аффирмации, реактивация, вечерний ритуал."""
+    if use_chat_backend():
+        try:
+            leader_schedulers.append(start_chat_retention())
+        except Exception as e:
+            print("⚠️ Ошибка при запуске чистки истории диалогов:", e)
+
     try:
-        start_affirmations()
+        leader_schedulers.append(start_affirmations())
         print("✅ Affirmations scheduler подключен (ежедневно 09:00 Asia/Almaty)")
     except Exception as e:
         print("⚠️ Ошибка при запуске планировщика аффирмаций:", e)
 
     try:
-        start_reactivation()
+        leader_schedulers.append(start_reactivation())
         print("✅ Reactivation scheduler подключен (ежедневно 22:00 Asia/Almaty)")
     except Exception as e:
         print("⚠️ Ошибка при запуске планировщика реактивации:", e)
 
     try:
-        start_evening_ritual()
+        leader_schedulers.append(start_evening_ritual())
         print("✅ Evening ritual scheduler подключен (ежедневно 23:00 Asia/Almaty)")
     except Exception as e:
         print("⚠️ Ошибка при запуске вечернего ритуала:", e)
 
+    # 🔁 Рассылки, прерванные перезапуском или сменой ведущего, продолжаются в фоне с контрольной точки
+    global campaign_resume_task
+    campaign_resume_task = asyncio.create_task(resume_campaigns())
+
+
+async def stop_leader_jobs():
+    """Ведущим стал другой процесс: останавливаем cron и прерываем свои рассылки."""
+    for scheduler in leader_schedulers:
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+    leader_schedulers.clear()
+    if campaign_resume_task:
+        campaign_resume_task.cancel()
+    await campaigns.cancel_running()
+
+
+async def resume_campaigns():
+    try:
+        await campaigns.resume_unfinished()
+    except Exception as e:
+        print("⚠️ Ошибка при продолжении незавершённых рассылок:", e)
+        traceback.print_exc()
+
 
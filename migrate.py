@@ -0,0 +1,146 @@
+"""
+migrate.py
+
+Версионные миграции схемы БД.
+
+Миграции лежат в migrations/ — файлы NNNN_описание.py с функцией
+upgrade(conn). Применённые версии записываются в таблицу schema_version,
+каждая миграция идёт в своей транзакции вместе с записью о ней.
+DDL миграции описан в её файле явно (SQL или копия таблиц на момент версии),
+а не берётся из models.py: правка моделей не меняет уже выпущенные миграции.
+
+При старте приложения (ensure_schema) читается только номер версии:
+если схема актуальна, больше запросов к каталогу БД нет. Отставшая схема
+догоняется сразу (MIGRATE_ON_STARTUP=1, по умолчанию) или только
+командой вручную.
+
+Запуск:  python migrate.py            — применить недостающие миграции
+         python migrate.py --status   — текущая и последняя версии
+"""
+
+import importlib
+import os
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from database import advisory_lock_key, engine
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "1") == "1"
+MIGRATIONS_LOCK = "empathai:migrations"   # pg_advisory_lock: миграции выполняет один воркер
+MIGRATIONS_LOCK_KEY = advisory_lock_key(MIGRATIONS_LOCK)
+
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    description: str
+    upgrade: callable
+
+
+def discover() -> list[Migration]:
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("[0-9]*.py")):
+        match = re.match(r"^(\d{4})_\w+\.py$", path.name)
+        if not match:
+            continue
+        module = importlib.import_module(f"migrations.{path.stem}")
+        description = (module.__doc__ or path.stem).strip().splitlines()[0]
+        migrations.append(Migration(int(match.group(1)), path.stem, description, module.upgrade))
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций: {versions}")
+    return migrations
+
+
+def head_version() -> int:
+    return max((m.version for m in discover()), default=0)
+
+
+def current_version(conn) -> int:
+    """Последняя применённая версия; 0 — если таблицы schema_version ещё нет."""
+    try:
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        conn.rollback()
+        return 0
+
+
+def migrate(target: int | None = None, bind=engine) -> int:
+    """Применяет недостающие миграции (до target включительно) и возвращает версию схемы."""
+    migrations = discover()
+    with bind.connect() as lock_conn:
+        postgres = bind.dialect.name == "postgresql"
+        if postgres:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(CREATE_VERSION_TABLE))
+                version = current_version(conn)
+
+            for migration in migrations:
+                if migration.version <= version or (target is not None and migration.version > target):
+                    continue
+                print(f"🧩 Миграция {migration.name}: {migration.description}")
+                with bind.begin() as conn:
+                    migration.upgrade(conn)
+                    conn.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                        {"v": migration.version, "d": migration.description}
+                    )
+                version = migration.version
+        finally:
+            if postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+                lock_conn.commit()
+    return version
+
+
+def ensure_schema(bind=engine) -> int:
+    """Проверка при старте: один SELECT, если схема актуальна."""
+    head = head_version()
+    with bind.connect() as conn:
+        version = current_version(conn)
+    if version >= head:
+        print(f"✅ Схема БД актуальна (версия {version}).")
+        return version
+    if not MIGRATE_ON_STARTUP:
+        print(f"⚠️ Схема БД отстаёт: версия {version}, последняя {head}. Запустите python migrate.py")
+        return version
+    version = migrate(bind=bind)
+    print(f"✅ Схема БД обновлена до версии {version}.")
+    return version
+
+
+# ---------- Помощники для миграций ----------
+def add_missing_columns(conn, table: str, columns: dict[str, str]):
+    """Добавляет колонки {имя: SQL-тип с DEFAULT}, которых ещё нет в таблице."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    for name, ddl in columns.items():
+        if name not in existing:
+            print(f"   + {table}.{name}")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        with engine.connect() as c:
+            print(f"Версия схемы: {current_version(c)}, последняя миграция: {head_version()}")
+    else:
+        print(f"✅ Схема БД: версия {migrate()}")
@@ -0,0 +1,81 @@
+"""Базовая схема: таблицы моделей и колонки users, которые раньше добавлял add_missing_user_columns
+
+На существующей базе создаёт только отсутствующие таблицы и колонки,
+на пустой — всю схему. Таблицы — копия моделей на момент этой версии:
+дальнейшие изменения делают следующие миграции.
+"""
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, DateTime, Float, Integer, MetaData, String, Table, Text, UniqueConstraint,
+)
+
+from migrate import add_missing_columns
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("telegram_id", BigInteger, unique=True),
+    Column("thread_id", String),
+    Column("free_messages_used", Integer),
+    Column("last_message_date", Date),
+    Column("thread_message_count", Integer),
+    Column("thread_token_estimate", Integer),
+    Column("thread_summary", Text),
+    Column("has_paid", Boolean),
+    Column("is_unlimited", Boolean),
+    Column("subscription_expires_at", DateTime),
+    Column("referral_earned", Float),
+    Column("referral_paid", Float),
+    Column("referrer_code", String),
+    Column("referral_code", String),
+    Column("first_seen_at", DateTime),
+    Column("total_messages", Integer),
+)
+
+evening_ritual_logs = Table(
+    "evening_ritual_logs", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("user_id", Integer, nullable=False),
+    Column("date", Date, nullable=False),
+    Column("emotion", String),
+    Column("action", String, nullable=False),
+    Column("is_premium", Boolean),
+    Column("created_at", DateTime),
+)
+
+topic_stats = Table(
+    "topic_stats", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("topic", String, unique=True),
+    Column("count", Integer),
+)
+
+conversation_turns = Table(
+    "conversation_turns", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("telegram_id", BigInteger, nullable=False),
+    Column("turn", Integer, nullable=False),
+    Column("role", String(16), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("created_at", DateTime, index=True),
+    UniqueConstraint("telegram_id", "turn", name="uq_conversation_turns_user_turn"),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+
+    add_missing_columns(conn, "users", {
+        "referrer_code": "VARCHAR",
+        "referral_code": "VARCHAR",
+        "is_unlimited": "BOOLEAN DEFAULT FALSE",
+        "has_paid": "BOOLEAN DEFAULT FALSE",
+        "subscription_expires_at": "TIMESTAMP",
+        "first_seen_at": "TIMESTAMP",
+        "total_messages": "INTEGER DEFAULT 0",
+        "thread_message_count": "INTEGER DEFAULT 0",
+        "thread_token_estimate": "INTEGER DEFAULT 0",
+        "thread_summary": "TEXT",
+    })
@@ -0,0 +1,17 @@
+"""Индексы, объявленные в моделях, на таблицах, созданных до их появления
+
+create_all не добавлял индексы в уже существующие таблицы — например,
+conversation_turns.created_at для ежедневной чистки истории.
+"""
+
+from sqlalchemy import text
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_conversation_turns_created_at ON conversation_turns (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_topic_stats_id ON topic_stats (id)",
+]
+
+
+def upgrade(conn):
+    for ddl in INDEXES:
+        conn.execute(text(ddl))
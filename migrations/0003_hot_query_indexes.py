@@ -0,0 +1,49 @@
+"""Индексы под частые запросы к users, evening_ritual_logs и topic_stats
+
+  • users: referrer_code (частичный, только пришедшие по ссылке),
+    last_message_date, first_seen_at, (has_paid, first_seen_at),
+    free_messages_used (частичный, только бесплатный тариф);
+  • evening_ritual_logs: (user_id, date);
+  • topic_stats: убран ix_topic_stats_id — дублировал первичный ключ.
+
+Частичные индексы — только на Postgres; на SQLite это обычные индексы.
+Проверка планов запросов: python -m benchmarks.explain_indexes
+"""
+
+from sqlalchemy import Boolean, Column, Date, DateTime, Index, Integer, MetaData, String, Table, text
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("referrer_code", String),
+    Column("last_message_date", Date),
+    Column("first_seen_at", DateTime),
+    Column("has_paid", Boolean),
+    Column("is_unlimited", Boolean),
+    Column("free_messages_used", Integer),
+)
+
+evening_ritual_logs = Table(
+    "evening_ritual_logs", metadata,
+    Column("user_id", Integer),
+    Column("date", Date),
+)
+
+NEW_INDEXES = [
+    Index("ix_users_referrer_code", users.c.referrer_code, postgresql_where=text("referrer_code IS NOT NULL")),
+    Index("ix_users_last_message_date", users.c.last_message_date),
+    Index("ix_users_first_seen_at", users.c.first_seen_at),
+    Index("ix_users_paid_first_seen", users.c.has_paid, users.c.first_seen_at),
+    Index(
+        "ix_users_free_messages_used", users.c.free_messages_used,
+        postgresql_where=text("has_paid = false AND is_unlimited = false")
+    ),
+    Index("ix_evening_ritual_logs_user_date", evening_ritual_logs.c.user_id, evening_ritual_logs.c.date),
+]
+
+
+def upgrade(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_topic_stats_id"))
+    for index in NEW_INDEXES:
+        index.create(conn, checkfirst=True)
@@ -0,0 +1,59 @@
+"""Часто меняющиеся счётчики пользователя — из users в узкую таблицу user_activity
+
+Переносятся free_messages_used, last_message_date, total_messages,
+thread_message_count и thread_token_estimate: данные копируются, колонки
+и их индексы в users удаляются. Каждое сообщение ассистенту больше
+не переписывает широкую строку users.
+"""
+
+from sqlalchemy import BigInteger, Column, Date, ForeignKey, Index, Integer, MetaData, Table, inspect, text
+
+metadata = MetaData()
+
+users = Table("users", metadata, Column("telegram_id", BigInteger, unique=True))
+
+user_activity = Table(
+    "user_activity", metadata,
+    Column("telegram_id", BigInteger, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True),
+    Column("free_messages_used", Integer, nullable=False, server_default=text("0")),
+    Column("last_message_date", Date),
+    Column("total_messages", Integer, nullable=False, server_default=text("0")),
+    Column("thread_message_count", Integer, nullable=False, server_default=text("0")),
+    Column("thread_token_estimate", Integer, nullable=False, server_default=text("0")),
+    Index("ix_user_activity_last_message_date", "last_message_date"),
+    Index("ix_user_activity_free_messages_used", "free_messages_used"),
+)
+
+MOVED_COLUMNS = [
+    "free_messages_used",
+    "last_message_date",
+    "total_messages",
+    "thread_message_count",
+    "thread_token_estimate",
+]
+OLD_INDEXES = ["ix_users_last_message_date", "ix_users_free_messages_used"]
+
+
+def upgrade(conn):
+    user_activity.create(conn, checkfirst=True)
+    for index in user_activity.indexes:
+        index.create(conn, checkfirst=True)
+
+    columns = {c["name"] for c in inspect(conn).get_columns("users")}
+    moved = [name for name in MOVED_COLUMNS if name in columns]
+    values = [name if name == "last_message_date" else f"COALESCE({name}, 0)" for name in moved]
+
+    # Строка активности — для каждого пользователя, даже если колонок уже нет
+    conn.execute(text(f"""
+        INSERT INTO user_activity (telegram_id{''.join(', ' + n for n in moved)})
+        SELECT telegram_id{''.join(', ' + v for v in values)}
+        FROM users u
+        WHERE telegram_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM user_activity a WHERE a.telegram_id = u.telegram_id)
+    """))
+
+    for index in OLD_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    for name in moved:
+        print(f"   - users.{name} → user_activity")
+        conn.execute(text(f"ALTER TABLE users DROP COLUMN {name}"))
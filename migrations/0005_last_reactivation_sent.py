@@ -0,0 +1,12 @@
+"""Отметка последней реактивации в user_activity
+
+Реактивация уходит только тем, кто не получал её последние дни
+(audiences.inactive). Раньше scheduler_reactivation.py пытался записать
+поле, которого в схеме не было, и напоминание приходило повторно.
+"""
+
+from migrate import add_missing_columns
+
+
+def upgrade(conn):
+    add_missing_columns(conn, "user_activity", {"last_reactivation_sent": "TIMESTAMP"})
@@ -0,0 +1,41 @@
+"""Кампании рассылок и итог по каждому получателю
+
+broadcast_campaigns — запуск рассылки с контрольной точкой по страницам
+получателей, broadcast_deliveries — исход отправки каждому получателю
+(пишется пачкой на страницу). После перезапуска незавершённая кампания
+продолжается с контрольной точки (campaigns.py).
+"""
+
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+broadcast_campaigns = Table(
+    "broadcast_campaigns", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("kind", String, nullable=False),
+    Column("audience", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("total", Integer, nullable=False),
+    Column("checkpoint", BigInteger),
+    Column("page_end", BigInteger),
+    Column("started_at", DateTime, nullable=False),
+    Column("finished_at", DateTime),
+    Index("ix_broadcast_campaigns_kind_status", "kind", "status"),
+)
+
+broadcast_deliveries = Table(
+    "broadcast_deliveries", metadata,
+    Column("campaign_id", Integer, ForeignKey("broadcast_campaigns.id", ondelete="CASCADE"), primary_key=True),
+    Column("telegram_id", BigInteger, primary_key=True),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("error", String),
+)
+
+
+def upgrade(conn):
+    for table in (broadcast_campaigns, broadcast_deliveries):
+        table.create(conn, checkfirst=True)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
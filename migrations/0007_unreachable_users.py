@@ -0,0 +1,32 @@
+"""Недоступные пользователи: users.unreachable_since / unreachable_reason
+
+Ставится, когда отправка падает с Forbidden или «chat not found», и по
+апдейтам my_chat_member (reachability.py). Рассылки таких пользователей
+пропускают, число пропущенных пишется в broadcast_campaigns.skipped.
+
+Отметка сразу ставится тем, у кого последняя рассылка закончилась
+статусом blocked.
+"""
+
+from sqlalchemy import text
+
+from migrate import add_missing_columns
+
+
+def upgrade(conn):
+    add_missing_columns(conn, "users", {
+        "unreachable_since": "TIMESTAMP",
+        "unreachable_reason": "VARCHAR",
+    })
+    add_missing_columns(conn, "broadcast_campaigns", {"skipped": "INTEGER NOT NULL DEFAULT 0"})
+
+    conn.execute(text("""
+        UPDATE users SET unreachable_since = CURRENT_TIMESTAMP, unreachable_reason = 'blocked'
+        WHERE unreachable_since IS NULL AND telegram_id IN (
+            SELECT d.telegram_id FROM broadcast_deliveries d
+            WHERE d.status = 'blocked'
+              AND d.campaign_id = (
+                  SELECT MAX(d2.campaign_id) FROM broadcast_deliveries d2 WHERE d2.telegram_id = d.telegram_id
+              )
+        )
+    """))
@@ -0,0 +1,31 @@
+"""Признак жизни кампании и одна идущая кампания на вид
+
+broadcast_campaigns.heartbeat_at обновляет процесс, который отправляет
+кампанию. Кампанию с давним heartbeat_at можно продолжить или заменить
+новой — без этого кампания, идущая в другом воркере, считалась брошенной.
+
+Уникальный частичный индекс по kind для status = 'running' не даёт двум
+процессам одновременно запустить кампанию одного вида. Лишние идущие
+кампании (кроме последней каждого вида) перед этим помечаются abandoned.
+"""
+
+from sqlalchemy import text
+
+from migrate import add_missing_columns
+
+
+def upgrade(conn):
+    add_missing_columns(conn, "broadcast_campaigns", {"heartbeat_at": "TIMESTAMP"})
+
+    conn.execute(text("""
+        UPDATE broadcast_campaigns SET status = 'abandoned', finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND id < (
+            SELECT MAX(b2.id) FROM broadcast_campaigns b2
+            WHERE b2.kind = broadcast_campaigns.kind AND b2.status = 'running'
+        )
+    """))
+
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_broadcast_campaigns_running_kind
+        ON broadcast_campaigns (kind) WHERE status = 'running'
+    """))
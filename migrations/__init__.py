@@ -0,0 +1 @@
+"""Миграции схемы БД — см. migrate.py."""
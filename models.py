@@ -1,17 +1,31 @@
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Boolean, Date
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Boolean, Date, Text, UniqueConstraint, Index, ForeignKey, text
 from database import Base
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from datetime import datetime
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import relationship
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache_bus import publish_invalidation
 
 # ---------- ПОЛЬЗОВАТЕЛИ ----------
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Приглашённые по коду реферера (кабинет, /admin_user, /admin_referrals);
+        # в индексе только пришедшие по ссылке
+        Index("ix_users_referrer_code", "referrer_code", postgresql_where=text("referrer_code IS NOT NULL")),
+        # Новые пользователи за период
+        Index("ix_users_first_seen_at", "first_seen_at"),
+        # Платные/бесплатные и платные за период
+        Index("ix_users_paid_first_seen", "has_paid", "first_seen_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     telegram_id = Column(BigInteger, unique=True)
     thread_id = Column(String)
-    free_messages_used = Column(Integer, default=0)
-    last_message_date = Column(Date, default=None)
+
+    # 🧠 Резюме прошлых тредов (см. context_budget.py)
+    thread_summary = Column(Text, nullable=True)
 
     # 💳 Подписка и тариф
     has_paid = Column(Boolean, default=False)
@@ -26,12 +40,52 @@ class User(Base):
 
     # 🕒 Логирование
     first_seen_at = Column(DateTime, default=datetime.utcnow)
-    total_messages = Column(Integer, default=0)
+
+    # 📭 Недоступен для сообщений: заблокировал бота / чат не найден (reachability.py).
+    # Такие пользователи не попадают в аудитории рассылок
+    unreachable_since = Column(DateTime, nullable=True)
+    unreachable_reason = Column(String, nullable=True)   # blocked / chat_not_found
+
+    # ⚡ Часто меняющиеся счётчики живут в узкой таблице user_activity,
+    # но читаются и пишутся как прежде: user.free_messages_used += 1 и т.п.
+    activity = relationship("UserActivity", uselist=False, lazy="joined", cascade="all, delete-orphan")
+    free_messages_used = association_proxy("activity", "free_messages_used", creator=lambda v: UserActivity(free_messages_used=v))
+    last_message_date = association_proxy("activity", "last_message_date", creator=lambda v: UserActivity(last_message_date=v))
+    total_messages = association_proxy("activity", "total_messages", creator=lambda v: UserActivity(total_messages=v))
+    thread_message_count = association_proxy("activity", "thread_message_count", creator=lambda v: UserActivity(thread_message_count=v))
+    thread_token_estimate = association_proxy("activity", "thread_token_estimate", creator=lambda v: UserActivity(thread_token_estimate=v))
+
+
+# ---------- АКТИВНОСТЬ ПОЛЬЗОВАТЕЛЯ ----------
+# Счётчики, которые меняются почти с каждым сообщением: лимит бесплатных
+# сообщений, дата активности, бюджет контекста треда. Узкая строка обновляется
+# отдельно от широкой users — меньше мёртвых версий строк и обновлений её индексов.
+class UserActivity(Base):
+    __tablename__ = "user_activity"
+    __table_args__ = (
+        # Активная аудитория (вечерний ритуал, статистика активности)
+        Index("ix_user_activity_last_message_date", "last_message_date"),
+        # Исчерпавшие бесплатный лимит
+        Index("ix_user_activity_free_messages_used", "free_messages_used"),
+    )
+
+    telegram_id = Column(BigInteger, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True)
+    free_messages_used = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    last_message_date = Column(Date, nullable=True)
+    total_messages = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    thread_message_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    thread_token_estimate = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    # Когда пользователю последний раз ушла реактивация (scheduler_reactivation.py)
+    last_reactivation_sent = Column(DateTime, nullable=True)
 
 
 # ---------- ВЕЧЕРНИЙ РИТУАЛ ----------
 class EveningRitualLog(Base):
     __tablename__ = "evening_ritual_logs"
+    __table_args__ = (
+        # Записи пользователя за день
+        Index("ix_evening_ritual_logs_user_date", "user_id", "date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
@@ -42,73 +96,107 @@ class EveningRitualLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+# ---------- РАССЫЛКИ ----------
+# Каждый запуск рассылки — кампания (campaigns.py). checkpoint — последний
+# telegram_id полностью записанной страницы, page_end — последний id страницы,
+# которая отправляется сейчас: после перезапуска с неё продолжать нельзя.
+class BroadcastCampaign(Base):
+    __tablename__ = "broadcast_campaigns"
+    __table_args__ = (
+        # Незавершённые кампании при старте и перед новым запуском
+        Index("ix_broadcast_campaigns_kind_status", "kind", "status"),
+        # Не больше одной идущей кампании каждого вида — во всех процессах сразу
+        Index(
+            "ux_broadcast_campaigns_running_kind", "kind", unique=True,
+            postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)                       # affirmations / reactivation / evening_ritual
+    audience = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running / done / abandoned
+    total = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)        # недоступные пользователи сегмента
+    checkpoint = Column(BigInteger, nullable=True)
+    page_end = Column(BigInteger, nullable=True)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)              # процесс, который отправляет, ещё жив
+
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+
+    campaign_id = Column(Integer, ForeignKey("broadcast_campaigns.id", ondelete="CASCADE"), primary_key=True)
+    telegram_id = Column(BigInteger, primary_key=True)
+    status = Column(String, nullable=False)     # sent / retried / blocked / failed / interrupted
+    attempts = Column(Integer, nullable=False, default=1)
+    error = Column(String, nullable=True)
+
+
 # ---------- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ----------
-def get_user_by_telegram_id(db: Session, telegram_id: int):
-    return db.query(User).filter(User.telegram_id == telegram_id).first()
+def _pooled_thread_id():
+    # Готовый тред из пула (thread_pool.py), чтобы первое сообщение не ждало его создания
+    from thread_pool import thread_pool
+    return thread_pool.take()
+
 
+async def get_user_by_telegram_id_async(db: AsyncSession, telegram_id: int):
+    # asyncpg строго типизирован — telegram_id часто приходит строкой
+    result = await db.execute(select(User).where(User.telegram_id == int(telegram_id)))
+    return result.scalars().first()
 
-def create_user(db: Session, telegram_id: int, referrer_code: str = None):
+
+async def create_user_async(db: AsyncSession, telegram_id: int, referrer_code: str = None):
     user = User(
-        telegram_id=telegram_id,
+        telegram_id=int(telegram_id),
         referrer_code=referrer_code,
         first_seen_at=datetime.utcnow(),
-        free_messages_used=0,
-        total_messages=0,
-        thread_id=None
+        activity=UserActivity(free_messages_used=0, total_messages=0),
+        thread_id=_pooled_thread_id()
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
-def update_user_thread_id(db: Session, user: User, thread_id: str):
-    user.thread_id = thread_id
-    db.commit()
-
-
-def increment_message_count(db: Session, user: User):
-    user.free_messages_used += 1
-    db.commit()
-
-
-def reset_user_thread(db: Session, user: User):
-    user.thread_id = None
-    db.commit()
-
-
-def update_user_subscription(db: Session, user: User, plan: str):
-    now = datetime.utcnow()
-    if plan == "monthly":
-        expires = now + timedelta(days=30)
-    elif plan == "yearly":
-        expires = now + timedelta(days=365)
-    else:
-        expires = now
-    user.has_paid = True
-    user.subscription_expires_at = expires
-    user.free_messages_used = 0
-    db.commit()
+async def reset_user_thread_async(db: AsyncSession, user: User):
+    user.thread_id = _pooled_thread_id()
+    user.thread_summary = None
+    user.thread_message_count = 0
+    user.thread_token_estimate = 0
+    await db.execute(delete(ConversationTurn).where(ConversationTurn.telegram_id == user.telegram_id))
+    await publish_invalidation(db, user.telegram_id)
+    await db.commit()
 
 
 # ---------- СТАТИСТИКА ВЫБОРА ТЕМ ----------
 class TopicStat(Base):
     __tablename__ = "topic_stats"
 
-    id = Column(Integer, primary_key=True, index=True)
-    topic = Column(String, unique=True)
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, unique=True)   # уникальный индекс — поиск темы при +1
     count = Column(Integer, default=0)
 
 
-def increment_topic_stat(db: Session, topic_key: str):
-    stat = db.query(TopicStat).filter_by(topic=topic_key).first()
-    if not stat:
-        stat = TopicStat(topic=topic_key, count=1)
-        db.add(stat)
-    else:
-        stat.count += 1
-    db.commit()
+async def get_all_stats_async(db: AsyncSession):
+    result = await db.execute(select(TopicStat))
+    return result.scalars().all()
 
 
-def get_all_stats(db: Session):
-    return db.query(TopicStat).all()
+# ---------- ИСТОРИЯ ДИАЛОГОВ (бэкенд chat, см. chat_backend.py) ----------
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+    __table_args__ = (
+        # Индекс (telegram_id, turn) — окно истории читается одним запросом
+        UniqueConstraint("telegram_id", "turn", name="uq_conversation_turns_user_turn"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    turn = Column(Integer, nullable=False)          # порядковый номер реплики пользователя/ассистента
+    role = Column(String(16), nullable=False)       # "user" | "assistant"
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
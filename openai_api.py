@@ -1,64 +1,83 @@
 # openai_api.py
 
+import httpx
 import openai
 import os
-from sqlalchemy.orm import Session
-from models import User, update_user_thread_id
+from assistant_runs import create_and_wait_run, fetch_run_reply
 
-client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 ASSISTANT_ID = os.environ["ASSISTANT_ID"]
 
-def send_message_to_assistant(
+# ⏱ Таймаут одного HTTP-запроса к OpenAI и размер пула соединений
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 30))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20))
+
+FREE_RESPONSE_LIMIT = 700
+FREE_RESPONSE_SUFFIX = "… (ответ сокращён из-за лимита бесплатного тарифа)"
+ERROR_RESPONSE = "Что-то пошло не так. Попробуйте позже."
+
+
+class AssistantRunFailed(Exception):
+    """Ассистент не дал ответа: run failed / expired / requires_action / дедлайн или пустой ответ."""
+
+    def __init__(self, reason: str, thread_id: str | None = None):
+        super().__init__(reason)
+        self.thread_id = thread_id  # тред уже создан — его стоит сохранить пользователю
+
+
+# Асинхронный клиент: не блокирует event loop, держит пул keep-alive соединений
+async_client = openai.AsyncOpenAI(
+    api_key=os.environ["OPENAI_API_KEY"],
+    timeout=OPENAI_TIMEOUT,
+    http_client=openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        ),
+        timeout=OPENAI_TIMEOUT,
+    ),
+)
+
+
+def apply_free_tier_limit(response: str, is_paid: bool, is_unlimited: bool) -> str:
+    # ✂️ если пользователь бесплатный — обрезаем ответ до 700 символов
+    if not is_paid and not is_unlimited and len(response) > FREE_RESPONSE_LIMIT:
+        response = response[:FREE_RESPONSE_LIMIT].rstrip() + FREE_RESPONSE_SUFFIX
+    return response
+
+async def send_message_to_assistant_async(
     thread_id: str | None,
     user_message: str,
     is_paid: bool = False,
-    is_unlimited: bool = False
+    is_unlimited: bool = False,
+    on_text=None,
+    seed_messages: list[dict] | None = None,
+    truncation_strategy: dict | None = None
 ) -> tuple[str, str]:
-    # если у пользователя есть старый thread_id — берём его, иначе создаём новый
-    if thread_id:
-        thread = client.beta.threads.retrieve(thread_id)
-    else:
-        thread = client.beta.threads.create()
-
-    # добавляем сообщение пользователя в поток
-    client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=user_message
-    )
-
-    # запускаем ассистента
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=ASSISTANT_ID
-    )
-
-    # ждём завершения работы
-    while True:
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-        if run.status == "completed":
-            break
-        elif run.status in ["failed", "cancelled", "expired"]:
-            return "Что-то пошло не так. Попробуйте позже.", thread.id
-
-    # получаем только последний ответ ассистента
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-
-    response = ""
-    for m in messages.data:
-        if m.role == "assistant":
-            response = "".join(
-                c.text.value for c in m.content if c.type == "text"
-            ).strip()
-            break  # берём только первый найденный ответ (самый свежий)
+    """
+    Ответ ассистента на сообщение пользователя (для aiogram-хэндлеров).
+    on_text(delta) — необязательный async-колбэк: если передан, run стримится,
+    и каждая новая порция текста сразу уходит в колбэк.
+    seed_messages — сообщения, которые идут в тред перед сообщением пользователя
+    (резюме прошлого разговора), truncation_strategy — ограничение контекста run'а.
 
-    # ✂️ если пользователь бесплатный — обрезаем ответ до 700 символов
-    if not is_paid and not is_unlimited and len(response) > 700:
-        response = response[:700].rstrip() + "… (ответ сокращён из-за лимита бесплатного тарифа)"
+    Запросы к OpenAI на один ответ: один run (вместе с сообщением, а для нового
+    пользователя — и с тредом) плюс, в режиме опроса, опросы и одно чтение ответа.
+    """
+    messages = (seed_messages or []) + [{"role": "user", "content": user_message}]
+    run_params = {"truncation_strategy": truncation_strategy} if truncation_strategy else {}
+
+    outcome = await create_and_wait_run(async_client, thread_id, ASSISTANT_ID, messages, on_text=on_text, **run_params)
+    print(f"🤖 Run {outcome.run_id}: {outcome.status}, {outcome.polls} опросов, {outcome.elapsed:.1f}с")
+    thread_id = outcome.thread_id or thread_id
+    if not outcome.ok:
+        raise AssistantRunFailed(f"run {outcome.run_id}: {outcome.status} {outcome.error or ''}".strip(), thread_id)
 
-    return response, thread.id
+    response = outcome.text
+    if response is None:
+        response = await fetch_run_reply(async_client, thread_id, outcome.run_id)
+    if not response:
+        raise AssistantRunFailed(f"run {outcome.run_id}: пустой ответ", thread_id)
 
+    return apply_free_tier_limit(response, is_paid, is_unlimited), thread_id
 
-def reset_user_thread(db: Session, user: User):
-    user.thread_id = None
-    db.commit()
@@ -0,0 +1,160 @@
+"""
+quota.py
+
+Учёт лимитов и активности для сообщений ассистенту — одним условным
+UPDATE … RETURNING на сообщение, по узкой таблице user_activity.
+
+  • бесплатный тариф: сообщение резервируется атомарно
+    (free_messages_used + 1 только пока не достигнут лимит), поэтому серия
+    одновременных сообщений не может превысить FREE_MESSAGES_LIMIT;
+  • подписка: истёкшая (по снимку) снимается условным UPDATE users —
+    широкая строка users меняется только в этот момент. Если её уже снял
+    (или продлил) другой воркер, тариф перечитывается и сообщение идёт
+    по актуальному тарифу;
+  • платные и безлимитные сообщения тоже считаются в free_messages_used,
+    как и раньше, — без проверки лимита;
+  • дата последней активности ставится в том же запросе; если сообщение
+    не резервируется — отдельным UPDATE и только если она изменилась.
+
+Работает со снимком пользователя из user_cache.py и обновляет его теми же
+значениями, что записал в БД. Commit делает middleware сессии
+(db_middleware.py) — один на апдейт.
+Если ассистент не ответил, резерв возвращается (refund_messages); на серию
+сообщений, объединённых в один ответ (conversation.py), остаётся списанным одно.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, UserActivity
+from user_cache import UserSnapshot, user_cache
+from cache_bus import publish_invalidation
+
+FREE_MESSAGES_LIMIT = int(os.environ.get("FREE_MESSAGES_LIMIT", 7))
+
+REASON_EXPIRED = "expired"
+REASON_LIMIT = "limit"
+
+
+@dataclass
+class Reservation:
+    allowed: bool
+    reserved: int = 0            # сколько бесплатных сообщений списано
+    reason: str | None = None    # REASON_EXPIRED / REASON_LIMIT при отказе
+
+
+def _stale_activity(today: date):
+    return or_(UserActivity.last_message_date.is_(None), UserActivity.last_message_date != today)
+
+
+async def reserve_message(db: AsyncSession, user: UserSnapshot, reserve: bool = True) -> Reservation:
+    """
+    Проверяет доступ пользователя, списывает бесплатное сообщение (если reserve)
+    и отмечает активность. Тариф берётся из снимка, но сами условия повторно
+    проверяются в WHERE — гонка двух сообщений не проходит мимо лимита.
+    """
+    now = datetime.utcnow()
+    today = date.today()
+
+    if not user.is_unlimited and user.has_paid and user.subscription_expires_at and user.subscription_expires_at < now:
+        row = (await db.execute(
+            update(User)
+            .where(
+                User.telegram_id == user.telegram_id,
+                User.has_paid.is_(True),
+                User.subscription_expires_at < now,
+            )
+            .values(has_paid=False)
+            .returning(User.telegram_id)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row is not None:
+            await publish_invalidation(db, user.telegram_id)
+            user.has_paid = False
+            await _stamp_activity(db, user, today)
+            return Reservation(allowed=False, reason=REASON_EXPIRED)
+        # Строку уже изменил другой воркер (подписку сняли или продлили) — снимок отстал
+        await _reload_tariff(db, user)
+
+    if user.is_unlimited or user.has_paid:
+        if not reserve:
+            await _stamp_activity(db, user, today)
+            return Reservation(allowed=True)
+        row = (await db.execute(
+            update(UserActivity)
+            .where(UserActivity.telegram_id == user.telegram_id)
+            .values(last_message_date=today, free_messages_used=UserActivity.free_messages_used + 1)
+            .returning(UserActivity.free_messages_used)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row is not None:
+            user.last_message_date = today
+            user.free_messages_used = row.free_messages_used
+        return Reservation(allowed=True, reserved=1 if row is not None else 0)
+
+    if reserve:
+        row = (await db.execute(
+            update(UserActivity)
+            .where(
+                UserActivity.telegram_id == user.telegram_id,
+                UserActivity.free_messages_used < FREE_MESSAGES_LIMIT,
+            )
+            .values(last_message_date=today, free_messages_used=UserActivity.free_messages_used + 1)
+            .returning(UserActivity.free_messages_used)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row is not None:
+            user.last_message_date = today
+            user.free_messages_used = row.free_messages_used
+            return Reservation(allowed=True, reserved=1)
+        user_cache.invalidate(user.telegram_id)  # снимок отстал от БД
+        return Reservation(allowed=False, reason=REASON_LIMIT)
+
+    # Ответа ассистента не будет (кризис, слишком длинный текст) — только активность
+    await _stamp_activity(db, user, today)
+    if (user.free_messages_used or 0) >= FREE_MESSAGES_LIMIT:
+        return Reservation(allowed=False, reason=REASON_LIMIT)
+    return Reservation(allowed=True)
+
+
+async def _reload_tariff(db: AsyncSession, user: UserSnapshot):
+    row = (await db.execute(
+        select(User.has_paid, User.is_unlimited, User.subscription_expires_at)
+        .where(User.telegram_id == user.telegram_id)
+    )).first()
+    if row is not None:
+        user.has_paid = bool(row.has_paid)
+        user.is_unlimited = bool(row.is_unlimited)
+        user.subscription_expires_at = row.subscription_expires_at
+    else:
+        user_cache.invalidate(user.telegram_id)
+
+
+async def _stamp_activity(db: AsyncSession, user: UserSnapshot, today: date):
+    if user.last_message_date == today:
+        return
+    await db.execute(
+        update(UserActivity)
+        .where(UserActivity.telegram_id == user.telegram_id, _stale_activity(today))
+        .values(last_message_date=today)
+        .execution_options(synchronize_session=False)
+    )
+    user.last_message_date = today
+
+
+async def refund_messages(db: AsyncSession, telegram_id: int, count: int):
+    """Возвращает зарезервированные сообщения: ассистент не ответил или ответил на серию одним ответом."""
+    if count <= 0:
+        return
+    await db.execute(
+        update(UserActivity)
+        .where(UserActivity.telegram_id == int(telegram_id), UserActivity.free_messages_used >= count)
+        .values(free_messages_used=UserActivity.free_messages_used - count)
+        .execution_options(synchronize_session=False)
+    )
+    await publish_invalidation(db, telegram_id)
+    await db.commit()
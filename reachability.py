@@ -0,0 +1,62 @@
+"""
+reachability.py
+
+Доступность пользователя для сообщений бота (users.unreachable_since).
+
+Пользователь становится недоступным, когда отправка падает с
+TelegramForbiddenError (заблокировал бота, удалил аккаунт) или
+«chat not found», и когда приходит my_chat_member со статусом kicked.
+Доступным снова — по my_chat_member со статусом member (разблокировал бота).
+
+Недоступные не попадают ни в одну аудиторию рассылок (audiences.py):
+они не тратят лимит Telegram и время рассылки.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import User
+
+BLOCKED = "blocked"
+CHAT_NOT_FOUND = "chat_not_found"
+
+
+def reason_for(error: str | None) -> str:
+    """Причина недоступности по тексту ошибки Telegram."""
+    return CHAT_NOT_FOUND if error and "chat not found" in error.lower() else BLOCKED
+
+
+async def suppress_many(entries: list[tuple[int, str]]):
+    """Пакетно помечает недоступными [(telegram_id, причина), …] — одним UPDATE."""
+    if not entries:
+        return
+    users = User.__table__
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(users)
+            .where(users.c.telegram_id == bindparam("tid"), users.c.unreachable_since.is_(None))
+            .values(unreachable_since=bindparam("since"), unreachable_reason=bindparam("reason")),
+            [{"tid": tid, "reason": reason, "since": datetime.utcnow()} for tid, reason in entries]
+        )
+        await db.commit()
+
+
+async def set_unreachable(db: AsyncSession, telegram_id: int, reason: str = BLOCKED):
+    await db.execute(
+        update(User)
+        .where(User.telegram_id == telegram_id, User.unreachable_since.is_(None))
+        .values(unreachable_since=datetime.utcnow(), unreachable_reason=reason)
+    )
+    await db.commit()
+
+
+async def set_reachable(db: AsyncSession, telegram_id: int):
+    await db.execute(
+        update(User)
+        .where(User.telegram_id == telegram_id, User.unreachable_since.isnot(None))
+        .values(unreachable_since=None, unreachable_reason=None)
+    )
+    await db.commit()
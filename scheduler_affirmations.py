@@ -2,146 +2,87 @@
 scheduler_affirmations.py
 
 Ежедневная рассылка аффирмаций всем пользователям в 09:00 Asia/Almaty.
-Отправка 1 сообщения в секунду, чтобы не перегружать Telegram API.
+Отправляет общий движок рассылок (broadcast.py) — с лимитами Telegram и
+запасом под ответы в чатах. Запуск — кампания (campaigns.py): после
+перезапуска процесса рассылка продолжается, а не начинается заново.
 Ведётся краткий отчёт в логах: всего / получили / ошибки / заблокировали.
 """
 
-import asyncio
 import random
 from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from database import SessionLocal
+import audiences
+import campaigns
+from campaigns import CampaignReport
 from bot_instance import bot
 
 from html import escape
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.exceptions import (
-    TelegramForbiddenError,
-    TelegramBadRequest,
-    TelegramRetryAfter,
-    TelegramNetworkError,
-)
 
 AFFIRMATIONS_FILE = "affirmations.txt"
-SEND_SLEEP_SECONDS = 1.5  # 1 сообщение в 1,5 секунду — безопасно
 
 # TEST_RUN = True  # <-- включи для локальной/ручной проверки (не конфликтует с планировщиком)
 
 
-def _fetch_all_user_ids():
-    """Берём всех пользователей из базы и возвращаем список их telegram_id."""
-    session = SessionLocal()
-    try:
-        from models import User
-        users = session.query(User).all()
-        ids = []
-        for u in users:
-            tg = getattr(u, "telegram_id", None)
-            if tg:
-                ids.append(tg)
-        return ids
-    finally:
-        session.close()
-
-
-async def send_affirmations():
-    """Основная функция рассылки"""
-    start_ts = datetime.utcnow()
-    print("⏰ [Affirmations] start:", start_ts.isoformat())
-
+async def _prepare_affirmations():
+    """Аудитория и отправка для кампании (и для продолжения после перезапуска)."""
     # Читаем все аффирмации из файла
     try:
         with open(AFFIRMATIONS_FILE, "r", encoding="utf-8") as f:
             lines = [line.strip() for line in f if line.strip()]
     except Exception as e:
         print("❗ Не удалось прочитать affirmations.txt:", e)
-        return
+        return None
 
     if not lines:
         print("❗ Файл affirmations.txt пуст — рассылка пропущена.")
-        return
-
-    loop = asyncio.get_running_loop()
-    try:
-        user_ids = await loop.run_in_executor(None, _fetch_all_user_ids)
-    except Exception as e:
-        print("❗ Ошибка получения пользователей из БД:", e)
-        return
-
-    total_users = len(user_ids)
-    sent_count = 0
-    failed_count = 0
-    blocked_count = 0
-
-    print(f"🔍 Найдено пользователей для рассылки: {total_users}")
+        return None
 
     # Клавиатура с callback (будет одинаковая для всех пользователей)
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="💬 Поговорить с Илой", callback_data="start_chat_from_affirmation")]
         ],
-        # row_width можно опустить, но оставлю, если потребуется
     )
 
-    for idx, tg_id in enumerate(user_ids, start=1):
-        try:
-            raw = random.choice(lines)
-            safe = escape(raw)
-            formatted = (
-                "🌞 <b>Аффирмация дня от Илы</b> 🌿\n\n"
-                f"<i>{safe}</i>\n\n"
-                "Если хочешь обсудить это — нажми кнопку ниже и начни диалог."
-            )
-
-            # отправляем
-            await bot.send_message(
-                tg_id,
-                formatted,
-                parse_mode="HTML",
-                reply_markup=kb
-            )
-            sent_count += 1
-
-            # небольшой лог каждые 50 сообщений (чтобы не засорять логи)
-            if sent_count % 50 == 0 or sent_count <= 5:
-                print(f"✉️ [Affirmations] Отправлено {sent_count}/{total_users} (последний: {tg_id})")
-
-            await asyncio.sleep(SEND_SLEEP_SECONDS)
-
-        except TelegramRetryAfter as e:
-            wait = getattr(e, "retry_after", 5)
-            print(f"⏳ Telegram просит подождать {wait} секунд. (user {tg_id})")
-            await asyncio.sleep(wait)
-            failed_count += 1
-
-        except TelegramForbiddenError:
-            print(f"⛔ Пользователь {tg_id} заблокировал бота.")
-            blocked_count += 1
-
-        except TelegramBadRequest as e:
-            print(f"🚫 Ошибка: чат не найден или некорректный запрос ({tg_id}): {e}")
-            failed_count += 1
-
-        except TelegramNetworkError as e:
-            print(f"🚫 Сетевая ошибка Telegram API ({tg_id}): {e}")
-            failed_count += 1
-
-        except Exception as e:
-            print(f"⚠️ Неизвестная ошибка при отправке {tg_id}: {type(e).__name__}: {e}")
-            failed_count += 1
-
-    end_ts = datetime.utcnow()
-    print("✅ [Affirmations] done:", end_ts.isoformat())
+    async def send(tg_id: int):
+        safe = escape(random.choice(lines))
+        formatted = (
+            "🌞 <b>Аффирмация дня от Илы</b> 🌿\n\n"
+            f"<i>{safe}</i>\n\n"
+            "Если хочешь обсудить это — нажми кнопку ниже и начни диалог."
+        )
+        await bot.send_message(tg_id, formatted, parse_mode="HTML", reply_markup=kb)
+
+    return audiences.all_users(), send
+
+
+def _print_report(report: CampaignReport):
+    print("✅ [Affirmations] done:", datetime.utcnow().isoformat())
     print(
-        "📊 [Affirmations report]\n"
-        f"Всего пользователей: {total_users}\n"
-        f"✅ Получили сообщение: {sent_count}\n"
-        f"🚫 Не получили (ошибка): {failed_count}\n"
-        f"⛔ Заблокировали бота: {blocked_count}\n"
-        f"⏱ Время выполнения: {(end_ts - start_ts).total_seconds():.1f}s"
+        f"📊 [Affirmations report] кампания #{report.campaign_id}\n"
+        f"Всего пользователей: {report.total}\n"
+        f"✅ Получили сообщение: {report.delivered} (после повторов: {report.retried})\n"
+        f"🚫 Не получили (ошибка): {report.failed}\n"
+        f"⛔ Заблокировали бота: {report.blocked}\n"
+        f"⏭ Пропущено (бот заблокирован ранее): {report.skipped}\n"
+        f"⚠️ Прервано перезапуском: {report.interrupted}\n"
+        f"⏱ Время выполнения: {report.elapsed:.1f}s ({report.rate:.1f} сообщ./с)"
     )
 
 
+campaigns.register("affirmations", _prepare_affirmations, _print_report)
+
+
+async def send_affirmations():
+    """Основная функция рассылки"""
+    print("⏰ [Affirmations] start:", datetime.utcnow().isoformat())
+    try:
+        await campaigns.start("affirmations")
+    except Exception as e:
+        print("❗ Рассылка аффирмаций прервана (продолжится после перезапуска):", type(e).__name__, e)
+
+
 def start_scheduler():
     """Запускает ежедневную рассылку аффирмаций (09:00 по Алматы)"""
     scheduler = AsyncIOScheduler(timezone="Asia/Almaty")
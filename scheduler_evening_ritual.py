@@ -1,81 +1,67 @@
-import asyncio
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime, timedelta
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from bot_instance import bot
-from database import SessionLocal
-from models import User
+import audiences
+import campaigns
+from campaigns import CampaignReport
 from zoneinfo import ZoneInfo
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.exceptions import TelegramForbiddenError
 
 ASIA_ALMATY = ZoneInfo("Asia/Almaty")
 
-# 🌙 Основная функция рассылки вечернего ритуала
-async def send_evening_ritual():
-    db = SessionLocal()
-    try:
-        # 💡 Берём только активных пользователей (писали за последние 5 дней)
-        cutoff_date = datetime.utcnow() - timedelta(days=5)
-        users = db.query(User).filter(User.last_message_date >= cutoff_date).all()
-        total_users = len(users)
+# 🌙 Аудитория и отправка вечернего ритуала (для кампании и её продолжения после перезапуска)
+async def _prepare_evening_ritual():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✨ Завершить день", callback_data="finish_day")]
+    ])
 
-        print(f"🌙 Запуск вечернего ритуала — активных пользователей: {total_users}")
+    async def send(telegram_id: int):
+        await bot.send_message(
+            chat_id=telegram_id,
+            text=(
+                "🌙 *День подходит к концу...*\n\n"
+                "Ты прожил(а) ещё один день — со своими мыслями, чувствами, моментами.\n"
+                "Хочешь подвести маленький итог вместе со мной? 💫"
+            ),
+            parse_mode="Markdown",
+            reply_markup=keyboard
+        )
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✨ Завершить день", callback_data="finish_day")]
-        ])
+    # 💡 Берём только активных пользователей (писали за последние 5 дней)
+    return audiences.active_within(5), send
 
-        sent_count = 0
-        blocked_count = 0
-        failed_count = 0
 
-        for user in users:
-            try:
-                await bot.send_message(
-                    chat_id=int(user.telegram_id),
-                    text=(
-                        "🌙 *День подходит к концу...*\n\n"
-                        "Ты прожил(а) ещё один день — со своими мыслями, чувствами, моментами.\n"
-                        "Хочешь подвести маленький итог вместе со мной? 💫"
-                    ),
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-                sent_count += 1
-                await asyncio.sleep(0.3)
+# 📊 Итоговый отчёт
+def _print_report(report: CampaignReport):
+    print(f"\n===== 🌙 ВЕЧЕРНИЙ РИТУАЛ — ОТЧЁТ (кампания #{report.campaign_id}) =====")
+    print(f"👥 Активных пользователей (5 дней): {report.total}")
+    print(f"✅ Успешно отправлено: {report.delivered}")
+    print(f"🚫 Заблокировали бота: {report.blocked}")
+    print(f"⏭ Пропущено (бот заблокирован ранее): {report.skipped}")
+    print(f"⚠️ Ошибок при отправке: {report.failed}")
+    print(f"⚠️ Прервано перезапуском: {report.interrupted}")
+    print(f"⏱ Время выполнения: {report.elapsed:.1f}s ({report.rate:.1f} сообщ./с)")
+    print("🌘 Рассылка вечернего ритуала завершена.\n")
 
-            except TelegramForbiddenError:
-                blocked_count += 1
-                print("🚫 Пользователь заблокировал бота.")
 
-            except Exception as e:
-                failed_count += 1
-                print(f"⚠️ Ошибка при отправке сообщения: {e}")
+campaigns.register("evening_ritual", _prepare_evening_ritual, _print_report)
 
-        # 📊 Итоговый отчёт
-        print("\n===== 🌙 ВЕЧЕРНИЙ РИТУАЛ — ОТЧЁТ =====")
-        print(f"👥 Активных пользователей (5 дней): {total_users}")
-        print(f"✅ Успешно отправлено: {sent_count}")
-        print(f"🚫 Заблокировали бота: {blocked_count}")
-        print(f"⚠️ Ошибок при отправке: {failed_count}")
-        print("🌘 Рассылка вечернего ритуала завершена.\n")
 
-    finally:
-        db.close()
+# 🌙 Основная функция рассылки вечернего ритуала
+async def send_evening_ritual():
+    print("🌙 Запуск вечернего ритуала")
+    try:
+        await campaigns.start("evening_ritual")
+    except Exception as e:
+        print("❗ Вечерний ритуал прерван (продолжится после перезапуска):", type(e).__name__, e)
+
 
 
 # 🌘 Планировщик
 def start_scheduler():
-    scheduler = BackgroundScheduler(timezone=ASIA_ALMATY)
-    loop = asyncio.get_event_loop()
-
-    async def task_wrapper():
-        await send_evening_ritual()
-
-    def run_async():
-        asyncio.run_coroutine_threadsafe(task_wrapper(), loop)
+    scheduler = AsyncIOScheduler(timezone=ASIA_ALMATY)
 
     # 🕒 Запуск каждый день в 23:00 Asia/Almaty
-    scheduler.add_job(run_async, "cron", hour=23, minute=0)
+    scheduler.add_job(send_evening_ritual, "cron", hour=23, minute=0)
     scheduler.start()
     print("✅ Evening ritual scheduler запущен (23:00 Asia/Almaty)")
+    return scheduler
@@ -0,0 +1,153 @@
+"""
+telegram_stream.py
+
+Потоковый ответ в Telegram: сразу показываем «печатает…», затем отправляем
+первый кусок ответа и дописываем его через editMessageText по мере прихода
+токенов. Правки идут не чаще EDIT_INTERVAL секунд, чтобы не упираться
+в лимиты Telegram на редактирование.
+"""
+
+import asyncio
+import os
+import time
+
+from aiogram import types
+from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from openai_api import apply_free_tier_limit
+from utils import clean_markdown
+
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "1") == "1"
+EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.2))
+FIRST_CHUNK_CHARS = int(os.environ.get("STREAM_FIRST_CHUNK_CHARS", 20))
+TELEGRAM_TEXT_LIMIT = 4096
+TYPING_REFRESH_SECONDS = 4.0  # статус «печатает» живёт ~5 секунд
+TYPING_MAX_SECONDS = 120.0
+
+
+async def send_typing(message: types.Message) -> float:
+    """Показывает «печатает…» в чате сообщения. Возвращает время отправки (time.monotonic())."""
+    sent_at = time.monotonic()
+    try:
+        await message.bot.send_chat_action(message.chat.id, ChatAction.TYPING)
+    except Exception as e:
+        print(f"⚠️ Не удалось отправить typing: {e}")
+    return sent_at
+
+
+class StreamingReply:
+    """Собирает дельты текста и показывает их пользователю одним растущим сообщением."""
+
+    def __init__(self, message: types.Message, is_paid: bool, is_unlimited: bool, reply_markup=None):
+        self.message = message
+        self.is_paid = is_paid
+        self.is_unlimited = is_unlimited
+        self.reply_markup = reply_markup
+
+        self._raw = ""
+        self._shown = ""          # текст, который сейчас виден в текущем сообщении
+        self._offset = 0          # сколько символов ушло в предыдущие (заполненные) сообщения
+        self._sent: types.Message | None = None
+        self._next_edit_at = 0.0
+        self._typing_task: asyncio.Task | None = None
+        self.messages_sent = 0
+        self.edits = 0
+
+    @property
+    def started(self) -> bool:
+        return self.messages_sent > 0
+
+    # ---------- «Печатает…» ----------
+    async def start(self, typing_sent_at: float | None = None):
+        """
+        typing_sent_at — когда «печатает…» уже показали при приёме сообщения
+        (time.monotonic()); если статус ещё виден, повторно не отправляем.
+        """
+        if typing_sent_at is None or time.monotonic() - typing_sent_at >= TYPING_REFRESH_SECONDS:
+            typing_sent_at = await send_typing(self.message)
+        self._typing_task = asyncio.create_task(self._keep_typing(typing_sent_at))
+
+    async def _keep_typing(self, sent_at: float):
+        deadline = time.monotonic() + TYPING_MAX_SECONDS
+        while not self.started and time.monotonic() < deadline:
+            await asyncio.sleep(max(0.0, sent_at + TYPING_REFRESH_SECONDS - time.monotonic()))
+            if not self.started:
+                sent_at = await send_typing(self.message)
+
+    def _stop_typing(self):
+        if self._typing_task:
+            self._typing_task.cancel()
+            self._typing_task = None
+
+    def close(self):
+        """Останавливает «печатает…», если ответ так и не был отправлен."""
+        self._stop_typing()
+
+    # ---------- Текст ----------
+    def _render(self, raw: str) -> str:
+        return clean_markdown(apply_free_tier_limit(raw, self.is_paid, self.is_unlimited))
+
+    async def feed(self, delta: str):
+        """
+        Новая порция токенов от ассистента. Ошибки показа здесь не выпускаем:
+        иначе они прервут чтение стрима, а run в OpenAI продолжит идти.
+        Недошедший текст покажет finish().
+        """
+        self._raw += delta
+        text = self._render(self._raw)
+
+        if not self.started and len(text.strip()) < FIRST_CHUNK_CHARS:
+            return
+        if time.monotonic() < self._next_edit_at:
+            return
+        try:
+            await self._show(text)
+        except Exception as e:
+            print(f"⚠️ Не удалось показать часть ответа: {e}")
+            self._next_edit_at = time.monotonic() + EDIT_INTERVAL
+
+    async def finish(self, final_text: str):
+        """Финальная версия ответа — показываем целиком, без ограничения частоты правок."""
+        self._stop_typing()
+        text = clean_markdown(final_text)
+        if not text.strip():
+            return
+        await self._show(text, final=True)
+
+    async def _show(self, text: str, final: bool = False):
+        # Длинный ответ не влезает в одно сообщение — закрываем текущее и начинаем новое
+        while len(text) - self._offset > TELEGRAM_TEXT_LIMIT:
+            chunk = text[self._offset:self._offset + TELEGRAM_TEXT_LIMIT]
+            await self._put(chunk, final=True)
+            self._offset += len(chunk)
+            self._sent = None
+            self._shown = ""
+
+        await self._put(text[self._offset:], final=final)
+
+    async def _put(self, chunk: str, final: bool):
+        if not chunk.strip() or chunk == self._shown:
+            return
+
+        try:
+            if self._sent is None:
+                self._sent = await self.message.answer(chunk, reply_markup=self.reply_markup)
+                self.messages_sent += 1
+                self._stop_typing()
+            else:
+                await self._sent.edit_text(chunk)
+                self.edits += 1
+            self._shown = chunk
+            self._next_edit_at = time.monotonic() + EDIT_INTERVAL
+
+        except TelegramRetryAfter as e:
+            # Telegram просит притормозить: промежуточные правки пропускаем, финальную — ждём
+            self._next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await self._put(chunk, final=True)
+
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
@@ -0,0 +1,128 @@
+"""
+thread_pool.py
+
+Пул заранее созданных пустых тредов OpenAI.
+
+Новый пользователь (create_user_async), сброс диалога (reset_user_thread_async) и первое
+сообщение без треда берут готовый тред из пула — создание треда уходит
+с критического пути. Фоновая задача держит пул заполненным до THREAD_POOL_SIZE,
+а треды, пролежавшие дольше THREAD_POOL_TTL_SECONDS, удаляет и заменяет новыми.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+from openai_api import async_client
+
+THREAD_POOL_SIZE = int(os.environ.get("THREAD_POOL_SIZE", 10))
+THREAD_POOL_TTL_SECONDS = int(os.environ.get("THREAD_POOL_TTL_SECONDS", 6 * 3600))
+THREAD_POOL_REFILL_INTERVAL = 30
+
+
+class ThreadPool:
+    def __init__(self, size: int = THREAD_POOL_SIZE, ttl: int = THREAD_POOL_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self._threads: deque = deque()    # (thread_id, created_at)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+        # 📊 Метрики
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.expired = 0
+        self.returned = 0
+
+    # ---------- Выдача ----------
+    def take(self) -> str | None:
+        """Готовый тред или None, если пул пуст (тогда тред создастся вместе с run'ом)."""
+        now = time.monotonic()
+        while self._threads:
+            thread_id, created_at = self._threads.popleft()
+            if now - created_at < self.ttl:
+                self.hits += 1
+                self._wakeup.set()
+                return thread_id
+            self._schedule_delete(thread_id)
+        self.misses += 1
+        self._wakeup.set()
+        return None
+
+    def give_back(self, thread_id: str | None):
+        """Возвращает взятый тред, в который так ничего и не записали (запрос не дошёл до OpenAI)."""
+        if thread_id:
+            self._threads.appendleft((thread_id, time.monotonic()))
+            self.returned += 1
+
+    # ---------- Фоновая задача ----------
+    def start(self):
+        if self.size > 0 and self._task is None:
+            self._task = asyncio.create_task(self._refill_loop())
+            print(f"🧵 Thread pool started: size {self.size}")
+
+    async def stop(self):
+        """Останавливает пополнение и удаляет неиспользованные треды."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        leftovers = [thread_id for thread_id, _ in self._threads]
+        self._threads.clear()
+        await asyncio.gather(*(self._delete(t) for t in leftovers), return_exceptions=True)
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                self._drop_expired()
+                while len(self._threads) < self.size:
+                    thread = await async_client.beta.threads.create()
+                    self._threads.append((thread.id, time.monotonic()))
+                    self.created += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Не удалось пополнить пул тредов: {e}")
+
+            self._wakeup.clear()
+            try:
+                async with asyncio.timeout(THREAD_POOL_REFILL_INTERVAL):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        while self._threads and now - self._threads[0][1] >= self.ttl:
+            thread_id, _ = self._threads.popleft()
+            self._schedule_delete(thread_id)
+
+    # ---------- Удаление ----------
+    def _schedule_delete(self, thread_id: str):
+        self.expired += 1
+        try:
+            asyncio.get_running_loop().create_task(self._delete(thread_id))
+        except RuntimeError:
+            pass  # нет event loop (например, синхронный скрипт) — тред удалится на стороне OpenAI по сроку
+
+    async def _delete(self, thread_id: str):
+        try:
+            await async_client.beta.threads.delete(thread_id)
+        except Exception as e:
+            print(f"⚠️ Не удалось удалить неиспользованный тред {thread_id}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "ready": len(self._threads),
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "expired": self.expired,
+            "returned": self.returned,
+        }
+
+
+thread_pool = ThreadPool()
@@ -0,0 +1,160 @@
+"""
+update_queue.py
+
+Очередь входящих апдейтов Telegram для быстрого ответа на webhook.
+
+/webhook только валидирует апдейт и кладёт его в очередь, а пул воркеров
+разбирает её в фоне. Апдейты одного чата обрабатываются строго по порядку,
+апдейты разных чатов — параллельно.
+"""
+
+import asyncio
+import os
+import time
+import traceback
+from collections import deque
+
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Что делать, если очередь заполнена:
+#   "reject" — отвечаем Telegram 503, он сам доставит апдейт повторно позже
+#   "inline" — обрабатываем апдейт прямо в запросе (замедляем приём)
+WEBHOOK_QUEUE_OVERFLOW = os.environ.get("WEBHOOK_QUEUE_OVERFLOW", "reject")
+
+WAIT_SAMPLES = 500  # сколько последних замеров ожидания держим для статистики
+
+
+def _chat_key(update: Update) -> int:
+    """Ключ упорядочивания: id чата (или пользователя), к которому относится апдейт."""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return 0  # тип апдейта aiogram не знает — общая дорожка, диспетчер его пропустит
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = getattr(event.message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return 0
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь с «дорожками» по чатам.
+
+    В _lanes лежат ожидающие апдейты каждого чата. id чата попадает в _ready
+    не больше одного раза, поэтому один чат никогда не обрабатывается двумя
+    воркерами одновременно.
+    """
+
+    def __init__(self, handler, workers: int = WEBHOOK_WORKERS, maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self._handler = handler
+        self._workers_count = workers
+        self._maxsize = maxsize
+        self._lanes: dict[int, deque] = {}
+        self._ready: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._size = 0
+        self._active = 0   # апдейты, которые воркеры обрабатывают прямо сейчас
+
+        # 📊 Метрики
+        self.enqueued = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.max_depth = 0
+        self._waits: deque = deque(maxlen=WAIT_SAMPLES)
+
+    # ---------- Жизненный цикл ----------
+    def start(self):
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self._workers_count)
+        ]
+        print(f"📥 Update queue started: {self._workers_count} workers, maxsize {self._maxsize}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Даём воркерам дообработать очередь и начатые апдейты, затем останавливаем их."""
+        deadline = time.monotonic() + timeout
+        while (self._size or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._size:
+            print(f"⚠️ Update queue stopped with {self._size} unprocessed updates")
+
+    # ---------- Приём ----------
+    def submit(self, update: Update) -> bool:
+        """Кладёт апдейт в очередь. False — очередь заполнена."""
+        if self._ready is None or self._size >= self._maxsize:
+            self.rejected += 1
+            return False
+
+        key = _chat_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            self._ready.put_nowait(key)
+        lane.append((update, time.monotonic()))
+
+        self._size += 1
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._size)
+        return True
+
+    # ---------- Обработка ----------
+    async def _worker(self, index: int):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            update, enqueued_at = lane.popleft()
+            self._size -= 1
+            self._active += 1
+            self._waits.append(time.monotonic() - enqueued_at)
+
+            try:
+                await self._handler(update)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Ошибка при обработке апдейта {update.update_id} (worker {index}):", e)
+                traceback.print_exc()
+            finally:
+                self._active -= 1
+                # Чат возвращается в конец очереди — остальные чаты не ждут его хвост
+                if lane:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+
+    # ---------- Метрики ----------
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "depth": self._size,
+            "active": self._active,
+            "max_depth": self.max_depth,
+            "maxsize": self._maxsize,
+            "active_chats": len(self._lanes),
+            "workers": len(self._workers),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[int(len(waits) * 0.95) - 1] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
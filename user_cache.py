@@ -0,0 +1,142 @@
+"""
+user_cache.py
+
+Кэш «горячих» полей пользователя в памяти процесса: тариф, срок подписки,
+тред, счётчик бесплатных сообщений и дата последней активности.
+
+Запись живёт не дольше USER_CACHE_TTL_SECONDS, всего записей — не больше
+USER_CACHE_SIZE (вытесняется давно не использованная). Любой код, который
+меняет эти поля в users, сбрасывает запись (invalidate) — или, как quota.py,
+обновляет её тем же значением, что записал в БД.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 60))
+
+
+@dataclass
+class UserSnapshot:
+    telegram_id: int
+    has_paid: bool
+    is_unlimited: bool
+    subscription_expires_at: datetime | None
+    thread_id: str | None
+    free_messages_used: int
+    last_message_date: date | None
+
+    @property
+    def is_premium(self) -> bool:
+        return bool(self.has_paid or self.is_unlimited)
+
+    @classmethod
+    def from_row(cls, row) -> "UserSnapshot":
+        return cls(
+            telegram_id=int(row.telegram_id),
+            has_paid=bool(row.has_paid),
+            is_unlimited=bool(row.is_unlimited),
+            subscription_expires_at=row.subscription_expires_at,
+            thread_id=row.thread_id,
+            free_messages_used=row.free_messages_used or 0,
+            last_message_date=row.last_message_date,
+        )
+
+
+class UserCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[UserSnapshot, float]] = OrderedDict()
+
+        # 📊 Метрики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, telegram_id: int) -> UserSnapshot | None:
+        key = int(telegram_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        snapshot, stored_at = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return snapshot
+
+    def put(self, snapshot: UserSnapshot) -> UserSnapshot:
+        if self.maxsize <= 0:
+            return snapshot
+        self._entries[snapshot.telegram_id] = (snapshot, time.monotonic())
+        self._entries.move_to_end(snapshot.telegram_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return snapshot
+
+    def invalidate(self, telegram_id):
+        if self._entries.pop(int(telegram_id), None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    async def load(self, db: AsyncSession, telegram_id: int) -> UserSnapshot | None:
+        """Снимок из кэша, иначе — из БД (fetch)."""
+        snapshot = self.get(telegram_id)
+        if snapshot is not None:
+            return snapshot
+        return await self.fetch(db, telegram_id)
+
+    async def fetch(self, db: AsyncSession, telegram_id: int) -> UserSnapshot | None:
+        """Узкий SELECT только нужных колонок (users + user_activity); результат кладётся в кэш."""
+        from models import User, UserActivity
+        row = (await db.execute(
+            select(
+                User.telegram_id,
+                User.has_paid,
+                User.is_unlimited,
+                User.subscription_expires_at,
+                User.thread_id,
+                UserActivity.free_messages_used,
+                UserActivity.last_message_date,
+            )
+            .outerjoin(UserActivity, UserActivity.telegram_id == User.telegram_id)
+            .where(User.telegram_id == int(telegram_id))
+        )).first()
+        if row is None:
+            return None
+        return self.put(UserSnapshot.from_row(row))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+user_cache = UserCache()
@@ -1,8 +1,9 @@
 import re
 from datetime import datetime, timedelta
 from sqlalchemy import func
-from models import User
-from database import SessionLocal
+from models import User, UserActivity
+from database import AsyncSessionLocal
+from user_cache import user_cache
 
 
 def clean_markdown(text):
@@ -26,8 +27,10 @@ def get_stats_summary(session):
         # --- Общие данные ---
         total_users = session.query(func.count(User.id)).scalar()
 
+        # Диапазон, а не date(first_seen_at) — иначе индекс по first_seen_at не используется
+        today_start = datetime.combine(now.date(), datetime.min.time())
         new_today = session.query(func.count(User.id)).filter(
-            (User.first_seen_at != None) & (func.date(User.first_seen_at) == now.date())
+            (User.first_seen_at != None) & (User.first_seen_at >= today_start)
         ).scalar()
 
         new_7d = session.query(func.count(User.id)).filter(
@@ -38,17 +41,17 @@ def get_stats_summary(session):
             (User.first_seen_at != None) & (User.first_seen_at >= month_ago)
         ).scalar()
 
-        # --- Активность ---
-        active_24h = session.query(func.count(User.id)).filter(
-            (User.last_message_date != None) & (User.last_message_date >= day_ago.date())
+        # --- Активность (user_activity: строка на каждого пользователя) ---
+        active_24h = session.query(func.count(UserActivity.telegram_id)).filter(
+            (UserActivity.last_message_date != None) & (UserActivity.last_message_date >= day_ago.date())
         ).scalar()
 
-        active_7d = session.query(func.count(User.id)).filter(
-            (User.last_message_date != None) & (User.last_message_date >= week_ago.date())
+        active_7d = session.query(func.count(UserActivity.telegram_id)).filter(
+            (UserActivity.last_message_date != None) & (UserActivity.last_message_date >= week_ago.date())
         ).scalar()
 
-        inactive = session.query(func.count(User.id)).filter(
-            (User.last_message_date == None) | (User.last_message_date < week_ago.date())
+        inactive = session.query(func.count(UserActivity.telegram_id)).filter(
+            (UserActivity.last_message_date == None) | (UserActivity.last_message_date < week_ago.date())
         ).scalar()
 
         # --- Подписки ---
@@ -64,11 +67,11 @@ def get_stats_summary(session):
         ).scalar()
 
         # --- Бесплатный лимит ---
-        expired_trial = session.query(User).filter(
-            (User.free_messages_used >= 7),
+        expired_trial = session.query(func.count(User.id)).join(User.activity).filter(
+            (UserActivity.free_messages_used >= 7),
             (User.has_paid == False),
             (User.is_unlimited == False)
-        ).count()
+        ).scalar()
 
         # --- Реферальная активность ---
         referred_users = session.query(func.count(User.id)).filter(
@@ -101,18 +104,16 @@ def get_stats_summary(session):
 
 
 # ---------- Проверка подписки пользователя ----------
-def is_user_premium(user_id: int) -> bool:
-    """
-    Проверяет, является ли пользователь премиум-подписчиком.
-    """
-    db = SessionLocal()
+async def is_user_premium_async(user_id: int) -> bool:
+    """Является ли пользователь премиум-подписчиком — из кэша пользователей, БД только при промахе."""
     try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
+        user = user_cache.get(user_id)
+        if user is None:
+            async with AsyncSessionLocal() as db:
+                user = await user_cache.fetch(db, user_id)
         if not user:
             return False
-        return bool(user.has_paid or user.is_unlimited)
+        return user.is_premium
     except Exception as e:
         print(f"Ошибка проверки Premium: {e}")
         return False
-    finally:
-        db.close()